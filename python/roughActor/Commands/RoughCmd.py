@@ -1,9 +1,10 @@
-import time
-
 import opscore.protocols.keys as keys
 import opscore.protocols.types as types
 from opscore.utility.qstr import qstr
 
+from roughActor.Controllers import gaugeParams
+from roughActor.utils.deferredCmd import deferredCommand, sleep
+
 class RoughCmd(object):
 
     def __init__(self, actor):
@@ -18,16 +19,20 @@ class RoughCmd(object):
         self.vocab = [
             ('pump', '@raw', self.roughRaw),
             ('pump', 'ident', self.ident),
-            ('pump', 'status', self.status),
+            ('pump', 'status [@fresh] [@changed]', self.status),
             ('pump', 'start', self.startRough),
             ('pump', 'stop', self.stopRough),
             ('pump', 'standby <percent>', self.standby),
             ('pump', 'standby off', self.standbyOff),
 
             ('gauge', '@raw', self.gaugeRaw),
-            ('gauge', 'status', self.pressure),
+            ('gauge', 'status [@fresh] [@changed]', self.pressure),
             ('gauge', '<setRaw>', self.setRaw),
             ('gauge', '<getRaw>', self.getRaw),
+            ('gauge', '<target>', self.setTarget),
+            ('gauge', 'params dump [@fresh]', self.paramsDump),
+            ('gauge', 'params diff [<baseline>] [@fresh]', self.paramsDiff),
+            ('gauge', 'params save [<baseline>]', self.paramsSave),
         ]
 
         # Define typed command arguments for the above commands.
@@ -36,20 +41,26 @@ class RoughCmd(object):
                                                  help='the speed for standby mode'),
                                         keys.Key("getRaw", types.Int(),
                                                  help='the MPT200 query'),
+                                        keys.Key("target", types.Float(),
+                                                 help='the pressure (torr) to predict the arrival at. 0 to stop'),
                                         keys.Key("setRaw",
                                                  types.CompoundValueType(types.Int(help='the MPT200 code'),
                                                                          types.String(help='the MPT200 value'))),
+                                        keys.Key("baseline", types.String(),
+                                                 help='a gauge parameter baseline file'),
                                         )
 
+    @deferredCommand
     def roughRaw(self, cmd):
         """ Send a raw command to the rough controller. """
 
         cmd_txt = cmd.cmd.keywords['raw'].values[0]
 
         ctrlr = cmd.cmd.name
-        ret = self.actor.controllers[ctrlr].pumpCmd(cmd_txt, cmd=cmd)
+        ret = yield self.actor.controllers[ctrlr].pumpCmd(cmd_txt, cmd=cmd)
         cmd.finish('text="returned %r"' % (ret))
 
+    @deferredCommand
     def ident(self, cmd):
         """ Return the rough ids. 
 
@@ -60,61 +71,82 @@ class RoughCmd(object):
 
         """
         ctrlr = cmd.cmd.name
-        ret = self.actor.controllers[ctrlr].ident(cmd=cmd)
+        ret = yield self.actor.controllers[ctrlr].ident(cmd=cmd)
         cmd.finish('ident=%s' % (','.join(ret)))
 
-    def status(self, cmd, doFinish=True):
-        """ Return all status keywords. """
+    def pumpStatus(self, cmd, fresh=False, changedOnly=False):
+        """ Generate all pump status keywords. Returns a Deferred. """
 
         ctrlr = self.actor.controllers['pump']
-        ctrlr.status(cmd=cmd)
+        return ctrlr.status(cmd=cmd, fresh=fresh, changedOnly=changedOnly)
+
+    @deferredCommand
+    def status(self, cmd):
+        """ Return all status keywords.
+
+        Cached readings are used unless fresh is passed. With changed, only
+        the keywords which changed since they were last sent are generated.
+        """
 
-        if doFinish:
-            cmd.finish()
+        yield self.pumpStatus(cmd, fresh='fresh' in cmd.cmd.keywords,
+                              changedOnly='changed' in cmd.cmd.keywords)
+        cmd.finish()
 
+    @deferredCommand
     def standby(self, cmd):
         """ Go into standby mode, where the pump runs at a lower speed than normal. """
 
         percent = cmd.cmd.keywords['percent'].values[0]
-        ret = self.actor.controllers['pump'].startStandby(percent=percent,
-                                                          cmd=cmd)
+        ret = yield self.actor.controllers['pump'].startStandby(percent=percent,
+                                                                cmd=cmd)
         cmd.finish('text=%r' % (qstr(ret)))
 
+    @deferredCommand
     def standbyOff(self, cmd):
         """ Drop out of standby mode and go back to full-speed."""
 
-        ret = self.actor.controllers['pump'].stopStandby(cmd=cmd)
+        ret = yield self.actor.controllers['pump'].stopStandby(cmd=cmd)
 
         cmd.finish('text=%r' % (qstr(ret)))
 
+    @deferredCommand
     def startRough(self, cmd):
-        """ Turn on roughing pump. """
+        """ Turn on roughing pump, and finish once it is up to speed. """
+
+        pump = self.actor.controllers['pump']
 
-        self.status(cmd, doFinish=False)
+        yield self.pumpStatus(cmd)
         cmd.inform('text="starting pump....."')
-        self.actor.controllers['pump'].startPump(cmd=cmd)
-        time.sleep(5)
-        self.status(cmd, doFinish=True)
+        yield pump.startPump(cmd=cmd)
+        yield pump.waitForSpinUp(cmd=cmd)
+        yield self.pumpStatus(cmd, fresh=True)
+        cmd.finish()
 
+    @deferredCommand
     def stopRough(self, cmd):
-        """ Turn off roughing pump. """
+        """ Turn off roughing pump, and finish once it has stopped. """
 
-        self.status(cmd, doFinish=False)
+        pump = self.actor.controllers['pump']
+
+        yield self.pumpStatus(cmd)
         cmd.inform('text="stopping pump....."')
-        self.actor.controllers['pump'].stopPump(cmd=cmd)
-        time.sleep(5)
-        self.status(cmd, doFinish=True)
+        yield pump.stopPump(cmd=cmd)
+        yield pump.waitForSpinDown(cmd=cmd)
+        yield self.pumpStatus(cmd, fresh=True)
+        cmd.finish()
 
+    @deferredCommand
     def gaugeRaw(self, cmd):
         """ Send a raw command to a rough-side pressure gauge. """
 
         cmd_txt = cmd.cmd.keywords['raw'].values[0]
 
         gauge = self.actor.controllers['gauge']
-        ret = gauge.sendOneCommand(cmd_txt, cmd=cmd)
-        time.sleep(3)
+        ret = yield gauge.sendOneCommand(cmd_txt, cmd=cmd)
+        yield sleep(gauge.rawSettleTime)
         cmd.finish('text="returned %s"' % (qstr(ret)))
 
+    @deferredCommand
     def getRaw(self, cmd):
         """ Send a direct query command to the PCM's gauge controller. """
 
@@ -123,10 +155,11 @@ class RoughCmd(object):
         gauge = self.actor.controllers['gauge']
         getCmd = gauge.makeRawQueryCmd(cmdCode)
 
-        rawResp = gauge.sendOneCommand(getCmd, cmd=cmd)
+        rawResp = yield gauge.sendOneCommand(getCmd, cmd=cmd)
         ret = gauge.parseResponse(rawResp, cmd=cmd)
         cmd.finish('text="%s (raw=%s)"' % (ret, rawResp))
 
+    @deferredCommand
     def setRaw(self, cmd):
         """ Send a direct control command to the PCM's gauge controller. """
 
@@ -137,16 +170,78 @@ class RoughCmd(object):
 
         gauge = self.actor.controllers['gauge']
         setCmd = gauge.makeRawSetCmd(cmdCode, cmdValue, cmd=cmd)
-        ret = gauge.sendOneCommand(setCmd, cmd=cmd)
+        ret = yield gauge.sendOneCommand(setCmd, cmd=cmd)
         cmd.finish('text=%s' % (qstr("returned %r" % ret)))
 
-    def pressure(self, cmd):
-        """ Fetch the latest pressure reading from a rough-side pressure gauge. """
+    @deferredCommand
+    def setTarget(self, cmd):
+        """ Set the pressure to predict the pumpdown time to. """
+
+        target = cmd.cmd.keywords['target'].values[0]
+
+        gauge = self.actor.controllers['gauge']
+        gauge.setTarget(target if target > 0 else None, cmd=cmd)
+        gauge.genPumpdownKeys(cmd)
+        cmd.finish()
+
+    @deferredCommand
+    def paramsDump(self, cmd):
+        """ Read the configured gauge parameters which are stale, and report all of them. """
+
+        gauge = self.actor.controllers['gauge']
+        yield gauge.readParams(fresh='fresh' in cmd.cmd.keywords, cmd=cmd)
+        gauge.params.genKeys(cmd, gauge.name)
+        cmd.finish()
+
+    def baselinePath(self, cmd):
+        """ The baseline file named by the command, else the configured one. """
+
+        cmdKeys = cmd.cmd.keywords
+        if 'baseline' in cmdKeys:
+            return cmdKeys['baseline'].values[0]
+
+        path = self.actor.controllers['gauge'].paramsBaseline
+        if path is None:
+            raise ValueError('no baseline file given, and no gauge paramsBaseline configured')
+        return path
+
+    @deferredCommand
+    def paramsDiff(self, cmd):
+        """ Compare the gauge parameters with a baseline file, re-reading only the stale ones. """
+
+        gauge = self.actor.controllers['gauge']
+        path = self.baselinePath(cmd)
+        baseline = gaugeParams.loadBaseline(path)
+
+        yield gauge.readParams(sorted(set(gauge.params.codes()) | set(baseline)),
+                               fresh='fresh' in cmd.cmd.keywords, cmd=cmd)
+        diffs = gauge.params.diff(baseline)
+        for code, old, new in diffs:
+            cmd.warn('%sParamDiff=%d,%r,%r' % (gauge.name, code, old, new))
+        cmd.finish('%sParamDiffs=%d,%s' % (gauge.name, len(diffs), qstr(path)))
+
+    @deferredCommand
+    def paramsSave(self, cmd):
+        """ Save the gauge parameters, re-reading the stale ones, as a baseline file. """
 
         gauge = self.actor.controllers['gauge']
-        cmdStr = gauge.makePressureCmd()
-        rawResp = gauge.sendOneCommand(cmdStr, cmd=cmd)
-        resp = gauge.parseResponse(rawResp, cmd=cmd)
-        val = gauge.parsePressure(resp)
+        path = self.baselinePath(cmd)
+
+        yield gauge.readParams(cmd=cmd)
+        raw = gauge.params.raw()
+        gaugeParams.saveBaseline(path, raw)
+        cmd.finish('text=%s' % (qstr('saved %d parameters to %s' % (len(raw), path))))
+
+    def gaugeStatus(self, cmd, fresh=False, changedOnly=False):
+        """ Generate the gauge keywords. Returns a Deferred which fires with the pressure. """
+
+        gauge = self.actor.controllers['gauge']
+        return gauge.status(cmd=cmd, fresh=fresh, changedOnly=changedOnly)
+
+    @deferredCommand
+    def pressure(self, cmd):
+        """ Fetch the latest pressure reading from a rough-side pressure gauge. """
 
-        cmd.finish('pressure=%g' % (val))
+        yield self.gaugeStatus(cmd, fresh='fresh' in cmd.cmd.keywords,
+                               changedOnly='changed' in cmd.cmd.keywords)
+        cmd.finish()
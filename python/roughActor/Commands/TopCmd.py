@@ -1,5 +1,12 @@
+from twisted.internet import defer
+
 import opscore.protocols.keys as keys
 import opscore.protocols.types as types
+from opscore.utility.qstr import qstr
+
+from roughActor.utils import metrics
+from roughActor.utils import trace
+from roughActor.utils.deferredCmd import deadline, deferredCommand, timedCommand
 
 
 class TopCmd(object):
@@ -15,8 +22,12 @@ class TopCmd(object):
         #
         self.vocab = [
             ('ping', '', self.ping),
-            ('status', '', self.status),
+            ('status', '[@fresh]', self.status),
             ('monitor', '<controllers> <period>', self.monitor),
+            ('history', '<field> <seconds>', self.history),
+            ('metrics', '[@reset]', self.metrics),
+            ('trace', 'dump [<count>]', self.traceDump),
+            ('trace', 'diag @(on|off)', self.traceDiag),
         ]
 
         # Define typed command arguments for the above commands.
@@ -27,6 +38,12 @@ class TopCmd(object):
                                                  help='the names a controller.'),
                                         keys.Key("period", types.Int(),
                                                  help='the period to sample at.'),
+                                        keys.Key("field", types.String(),
+                                                 help='the name of a telemetry field, e.g. pressure or speed.'),
+                                        keys.Key("seconds", types.Float(),
+                                                 help='how far back to look.'),
+                                        keys.Key("count", types.Int(),
+                                                 help='how many entries to report.'),
                                         )
 
     def controllerKey(self):
@@ -36,24 +53,49 @@ class TopCmd(object):
 
         return key
 
+    @timedCommand
     def ping(self, cmd):
         """Query the actor for liveness/happiness."""
 
         cmd.warn("text='I am an empty and fake actor'")
         cmd.finish("text='Present and (probably) well'")
 
+    @deferredCommand
     def status(self, cmd):
-        """Report camera status and actor version. """
+        """Report actor version and the status of all controllers.
+
+        The controllers are queried concurrently, so this takes about as long
+        as the slowest one. A controller which fails, or does not answer
+        within controllers.statusTimeout seconds, is reported with a warning,
+        and the others' keywords are still generated.
+        """
 
         self.actor.sendVersionKey(cmd)
 
         cmd.inform('text="Present!"')
         cmd.inform(self.controllerKey())
+        self.actor.scheduler.genKeys(cmd)
+
+        fresh = 'fresh' in cmd.cmd.keywords
+        timeout = self.actor.actorConfig['controllers'].get('statusTimeout', 5.0)
+        names = list(self.actor.controllers.keys())
+        results = yield defer.DeferredList([deadline(self.actor.controllers[name].status(cmd=cmd, fresh=fresh),
+                                                     timeout)
+                                            for name in names],
+                                           consumeErrors=True)
+
+        failed = []
+        for name, (ok, ret) in zip(names, results):
+            if not ok:
+                failed.append(name)
+                cmd.warn('text=%s' % (qstr('%s status failed: %s' % (name, ret.getErrorMessage()))))
+
+        if names and len(failed) == len(names):
+            cmd.fail('text="no controller status available"')
+        else:
+            cmd.finish()
 
-        roughCmds = self.actor.commandSets['RoughCmd']
-        roughCmds.status(cmd, doFinish=False)
-        roughCmds.pressure(cmd)
-
+    @timedCommand
     def monitor(self, cmd):
         """ Enable/disable/adjust period controller monitors. """
 
@@ -77,3 +119,51 @@ class TopCmd(object):
             cmd.finish()
         else:
             cmd.fail('text="no controllers found"')
+
+    @deferredCommand
+    def history(self, cmd):
+        """ Report min/max/mean/last/slope of one telemetry field over the last few seconds. """
+
+        field = cmd.cmd.keywords['field'].values[0]
+        seconds = cmd.cmd.keywords['seconds'].values[0]
+
+        for ctrlr in self.actor.controllers.values():
+            ring = getattr(ctrlr, 'history', None)
+            if ring is not None and field in ring.fields:
+                break
+        else:
+            cmd.fail('text="no history for %s"' % (field))
+            return
+
+        n, vmin, vmax, vmean, vlast, slope = ring.stats(field, seconds)
+        cmd.finish('history=%s,%g,%d,%g,%g,%g,%g,%g' % (field, seconds, n,
+                                                        vmin, vmax, vmean, vlast, slope))
+
+    @deferredCommand
+    def metrics(self, cmd):
+        """ Report the device and command latencies and counters. With reset, then clear them. """
+
+        metrics.registry.genKeys(cmd, actor=self.actor.name)
+        if 'reset' in cmd.cmd.keywords:
+            metrics.registry.reset(actor=self.actor.name)
+        cmd.finish()
+
+    @deferredCommand
+    def traceDump(self, cmd):
+        """ Report the last device exchanges, oldest first. Default is the last 20. """
+
+        cmdKeys = cmd.cmd.keywords
+        count = cmdKeys['count'].values[0] if 'count' in cmdKeys else 20
+
+        n = trace.ring.genKeys(cmd, count, actor=self.actor.name)
+        cmd.finish('traceEntries=%d,%d' % (n, trace.ring.count))
+
+    @timedCommand
+    def traceDiag(self, cmd):
+        """ Turn the per-exchange diag keywords on or off. They are off by default. """
+
+        if 'on' in cmd.cmd.keywords:
+            trace.ring.diagActors.add(self.actor.name)
+        else:
+            trace.ring.diagActors.discard(self.actor.name)
+        cmd.finish('traceDiag=%s' % ('on' if self.actor.name in trace.ring.diagActors else 'off'))
@@ -0,0 +1,164 @@
+""" An append-only, memory-mapped archive of every controller reading, one file per UTC day.
+
+Each file is a 64-byte header followed by fixed-width records of
+`recordDtype`. The header holds the record count, which is updated after
+each record is written, so a reader never sees a partial record. Files
+are preallocated and grown by doubling, so an append is a store into
+the mapping, with no system call.
+
+See archiveReader for reading the files back.
+"""
+
+import logging
+import mmap
+import os
+import time
+
+import numpy as np
+
+MAGIC = b'RGHTLM02'
+
+headerDtype = np.dtype([('magic', 'S8'),
+                        ('itemsize', '<u4'),
+                        ('pad', '<u4'),
+                        ('count', '<u8'),
+                        ('spare', 'S40')])
+
+recordDtype = np.dtype([('time', '<f8'),
+                        ('controller', 'S8'),
+                        ('channel', '<u2'),
+                        ('pad', 'S2'),
+                        ('status', '<u4'),
+                        ('pressure', '<f8'),
+                        ('speed', '<f4'),
+                        ('motorTemp', '<f4'),
+                        ('controllerTemp', '<f4'),
+                        ('warnings', '<u4'),
+                        ('errors', '<u4'),
+                        ('spare', 'S12')])
+
+# What unset fields read as. The pump words are unsigned 32-bit, so unset ones are all ones.
+NOWORD = 0xFFFFFFFF
+missing = dict(status=NOWORD, pressure=np.nan, speed=np.nan, motorTemp=np.nan,
+               controllerTemp=np.nan, warnings=NOWORD, errors=NOWORD)
+valueFields = tuple(missing.keys())
+
+def dayName(timestamp):
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+def dayPath(directory, prefix, day):
+    return os.path.join(directory, '%s-%s.tlm' % (prefix, day))
+
+class ArchiveFile(object):
+    """ One open, writable, day file. """
+
+    def __init__(self, path, initialRecords=65536):
+        self.path = path
+
+        exists = os.path.exists(path) and os.path.getsize(path) >= headerDtype.itemsize
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if exists:
+            size = os.fstat(self.fd).st_size
+        else:
+            size = headerDtype.itemsize + initialRecords * recordDtype.itemsize
+            os.ftruncate(self.fd, size)
+        self._map(size)
+
+        if exists:
+            if self.header['magic'] != MAGIC or self.header['itemsize'] != recordDtype.itemsize:
+                raise ValueError('%s is not a telemetry archive of this version' % (path))
+        else:
+            self.header['magic'] = MAGIC
+            self.header['itemsize'] = recordDtype.itemsize
+            self.header['count'] = 0
+        self.count = int(self.header['count'])
+
+    def _map(self, size):
+        self.mmap = mmap.mmap(self.fd, size)
+        self.header = np.frombuffer(self.mmap, dtype=headerDtype, count=1)[0]
+        self.capacity = (size - headerDtype.itemsize) // recordDtype.itemsize
+        self.records = np.frombuffer(self.mmap, dtype=recordDtype, count=self.capacity,
+                                     offset=headerDtype.itemsize)
+
+    def _grow(self):
+        size = headerDtype.itemsize + 2 * self.capacity * recordDtype.itemsize
+        self.header = self.records = None
+        self.mmap.close()
+        os.ftruncate(self.fd, size)
+        self._map(size)
+
+    def append(self, row):
+        if self.count >= self.capacity:
+            self._grow()
+        self.records[self.count] = row
+        self.count += 1
+        self.header['count'] = self.count
+
+    def close(self):
+        self.mmap.flush()
+        self.header = self.records = None
+        self.mmap.close()
+        os.close(self.fd)
+
+class TelemetryArchive(object):
+    """ Append readings to daily memory-mapped files.
+
+    Args
+    ----
+    directory : str
+      Where to keep the files, named <prefix>-<YYYY-MM-DD>.tlm
+    prefix : str
+      Usually the actor name.
+    """
+
+    def __init__(self, directory, prefix):
+        self.directory = directory
+        self.prefix = prefix
+        self.logger = logging.getLogger('archive')
+
+        os.makedirs(directory, exist_ok=True)
+        self.day = None
+        self.file = None
+
+    def append(self, timestamp, controller, channel=0, **values):
+        """ Add one reading.
+
+        Args
+        ----
+        timestamp : float
+          Unix time of the reading.
+        controller : str
+          The controller name.
+        channel : int
+          Which device of the controller, e.g. the gauge bus ID.
+        values : dict
+          Some of valueFields. The others are stored as their `missing` value.
+        """
+
+        unknown = set(values) - set(valueFields)
+        if unknown:
+            raise KeyError('not archive fields: %s' % (', '.join(sorted(unknown))))
+
+        day = dayName(timestamp)
+        if day != self.day:
+            self._rotate(day)
+
+        row = dict(missing, **values)
+        row = (timestamp, controller.encode('latin-1'), channel, b'',
+               row['status'], row['pressure'], row['speed'], row['motorTemp'],
+               row['controllerTemp'], row['warnings'], row['errors'], b'')
+        self.file.append(row)
+
+    def _rotate(self, day):
+        if self.file is not None:
+            self.file.close()
+        path = dayPath(self.directory, self.prefix, day)
+        self.logger.info('archiving telemetry to %s', path)
+        self.file = ArchiveFile(path)
+        self.day = day
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.day = None
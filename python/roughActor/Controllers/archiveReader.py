@@ -0,0 +1,87 @@
+""" Read back the daily telemetry archive files written by archive.TelemetryArchive.
+
+    >>> from roughActor.Controllers import archiveReader
+    >>> for recs in archiveReader.slices('/data/rough', 'rough1', t0, t1):
+    ...     gauge = recs[recs['controller'] == b'gauge']
+    ...     print(gauge['time'], gauge['pressure'])
+
+The slices are read-only views into the memory-mapped files: nothing is
+copied until they are indexed with a mask, and files being written by the
+actor can be read at the same time.
+"""
+
+import calendar
+import os
+import time
+
+import numpy as np
+
+from .archive import MAGIC, dayPath, headerDtype, missing, recordDtype
+
+def openFile(path):
+    """ Return all the records in one archive file, as a read-only structured array. """
+
+    header = np.fromfile(path, dtype=headerDtype, count=1)
+    if len(header) == 0 or header[0]['magic'] != MAGIC or header[0]['itemsize'] != recordDtype.itemsize:
+        raise ValueError('%s is not a telemetry archive of this version' % (path))
+
+    mapped = np.memmap(path, dtype='u1', mode='r')
+    count = int(np.frombuffer(mapped, dtype=headerDtype, count=1)[0]['count'])
+    return np.frombuffer(mapped, dtype=recordDtype, count=count, offset=headerDtype.itemsize)
+
+def days(t0, t1):
+    """ The UTC day names from the one holding t0 to the one holding t1. """
+
+    day = calendar.timegm(time.gmtime(t0)[:3] + (0, 0, 0))
+    names = []
+    while day <= t1:
+        names.append(time.strftime('%Y-%m-%d', time.gmtime(day)))
+        day += 86400
+    return names
+
+def slices(directory, prefix, t0, t1):
+    """ Return the records with t0 <= time < t1, as one read-only array per day file.
+
+    Records are appended as they are read, so within a file they are in time order.
+    """
+
+    out = []
+    for day in days(t0, t1):
+        path = dayPath(directory, prefix, day)
+        if not os.path.exists(path):
+            continue
+        recs = openFile(path)
+        times = recs['time']
+        i0, i1 = np.searchsorted(times, [t0, t1])
+        if i1 > i0:
+            out.append(recs[i0:i1])
+    return out
+
+def read(directory, prefix, t0, t1, controller=None, channel=None):
+    """ Return the records with t0 <= time < t1 as one array, optionally for one controller/channel.
+
+    Unlike slices(), this copies the records when there are several days,
+    or a controller or channel to select.
+    """
+
+    parts = slices(directory, prefix, t0, t1)
+    if not parts:
+        recs = np.zeros(0, dtype=recordDtype)
+    elif len(parts) == 1:
+        recs = parts[0]
+    else:
+        recs = np.concatenate(parts)
+
+    if controller is not None:
+        recs = recs[recs['controller'] == controller.encode('latin-1')]
+    if channel is not None:
+        recs = recs[recs['channel'] == channel]
+    return recs
+
+def present(recs, field):
+    """ Return the mask of the records which have a value for field, e.g. the pump records for speed. """
+
+    fill = missing[field]
+    if isinstance(fill, float) and np.isnan(fill):
+        return ~np.isnan(recs[field])
+    return recs[field] != fill
@@ -0,0 +1,109 @@
+import logging
+import random
+
+from twisted.internet import reactor
+
+class DeviceOfflineError(Exception):
+    """ Raised instead of talking to a device which the circuit breaker has marked offline. """
+    pass
+
+class CircuitBreaker(object):
+    """ Stop talking to a device after repeated failures, and probe it until it comes back.
+
+    After `threshold` consecutive failed exchanges the breaker opens: the
+    device is considered offline and callers should fail fast. While open,
+    `probe` is called after probeMin seconds, then after exponentially
+    longer, jittered, delays up to probeMax, until it succeeds and the
+    breaker closes again.
+
+    Args
+    ----
+    name : str
+      The controller name, used in messages and keywords.
+    probe : callable
+      Returns a Deferred which fires if the device answers, and fails if not.
+    threshold : int
+      The number of consecutive failures which opens the breaker.
+    probeMin, probeMax : float
+      The first and the longest delays between probes, in seconds.
+    """
+
+    def __init__(self, name, probe, threshold=3, probeMin=1.0, probeMax=60.0,
+                 logger=None):
+        self.name = name
+        self.probe = probe
+        self.threshold = threshold
+        self.probeMin = probeMin
+        self.probeMax = probeMax
+        self.logger = logger if logger is not None else logging.getLogger(name)
+
+        self.state = 'closed'
+        self.failures = 0
+        self.probeDelay = probeMin
+        self.probeCall = None
+        self.probes = 0
+
+        # Called with the breaker whenever it opens or closes.
+        self.listener = None
+
+    @property
+    def isOpen(self):
+        return self.state == 'open'
+
+    def succeeded(self):
+        self.failures = 0
+        if self.state == 'open':
+            self._setState('closed')
+
+    def failed(self):
+        self.failures += 1
+        if self.state == 'closed' and self.failures >= self.threshold:
+            self._setState('open')
+            self.probeDelay = self.probeMin
+            self._scheduleProbe()
+
+    def _setState(self, state):
+        if state == 'open':
+            self.logger.warning('%s offline after %d failures', self.name, self.failures)
+        else:
+            self.logger.warning('%s back online after %d probes', self.name, self.probes)
+        self.state = state
+        if state == 'closed':
+            self._cancelProbe()
+        if self.listener is not None:
+            self.listener(self)
+
+    def _scheduleProbe(self):
+        self._cancelProbe()
+        delay = self.probeDelay * random.uniform(0.8, 1.2)
+        self.probeCall = reactor.callLater(delay, self._probe)
+
+    def _cancelProbe(self):
+        if self.probeCall is not None and self.probeCall.active():
+            self.probeCall.cancel()
+        self.probeCall = None
+
+    def _probe(self):
+        self.probeCall = None
+        self.probes += 1
+        d = self.probe()
+        d.addCallbacks(self._probeSucceeded, self._probeFailed)
+
+    def _probeSucceeded(self, _):
+        self.logger.info('%s answered probe %d', self.name, self.probes)
+        self.succeeded()
+
+    def _probeFailed(self, failure):
+        self.logger.info('%s failed probe %d: %s', self.name, self.probes, failure.getErrorMessage())
+        if self.state != 'open':
+            return
+        self.probeDelay = min(2 * self.probeDelay, self.probeMax)
+        self._scheduleProbe()
+
+    def stop(self):
+        self._cancelProbe()
+
+    def genKeys(self, cmd):
+        """ Generate the breaker keyword: state, consecutive failures, probes. """
+
+        cmd.inform('%sBreaker=%s,%d,%d' % (self.name, self.state, self.failures, self.probes))
@@ -0,0 +1,65 @@
+""" A compact binary log of the raw bytes exchanged with a device.
+
+The log is a sequence of records, each a little-endian (float64 monotonic
+time, uint8 kind, uint16 length) header followed by `length` bytes. The
+kinds are:
+
+  SENT      -- bytes written to the device
+  RECEIVED  -- bytes read from the device, as they arrived
+  RESET     -- the connection was closed; replies no longer pair with telegrams
+  START     -- a capture started; the data is the device name and the unix time
+
+Captures are appended, so one file can hold several.
+"""
+
+import struct
+import time
+
+SENT = 0
+RECEIVED = 1
+RESET = 2
+START = 3
+
+recordHeader = struct.Struct('<dBH')
+
+class TrafficCapture(object):
+    """ Append the traffic of one device to a capture file.
+
+    Args
+    ----
+    path : str
+      The capture file, appended to.
+    name : str
+      The device name, recorded in the START record.
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.file = open(path, 'ab', buffering=65536)
+        self.records = 0
+        self.record(START, b'%s %r' % (name.encode('latin-1'), time.time()))
+
+    def record(self, kind, data):
+        self.file.write(recordHeader.pack(time.monotonic(), kind, len(data)))
+        self.file.write(data)
+        self.records += 1
+        if kind in (RESET, START):
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def readCapture(path):
+    """ Yield (time, kind, data) for each record in a capture file. """
+
+    with open(path, 'rb') as f:
+        buf = f.read()
+
+    i = 0
+    size = recordHeader.size
+    while i + size <= len(buf):
+        t, kind, n = recordHeader.unpack_from(buf, i)
+        i += size
+        yield t, kind, buf[i:i+n]
+        i += n
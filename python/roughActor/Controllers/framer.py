@@ -0,0 +1,73 @@
+class LineFramer(object):
+    """ Split a byte stream into EOL-terminated frames, however it was chunked.
+
+    Bytes are accumulated until an EOL arrives, so telegrams split across
+    reads are put back together, and several telegrams arriving in one
+    read are all returned. Each byte is only scanned once.
+
+    A frame which grows past maxLength without an EOL is reported once, as
+    None, and the rest of it, up to and including the next EOL, is dropped.
+
+    Args
+    ----
+    EOL : bytes
+      The frame terminator.
+    maxLength : int
+      The longest acceptable frame, including the EOL.
+    keepEOL : bool
+      Whether to leave the EOL on the returned frames.
+    """
+
+    def __init__(self, EOL=b'\r', maxLength=1024, keepEOL=True):
+        self.EOL = EOL
+        self.maxLength = maxLength
+        self.keepEOL = keepEOL
+
+        self.buffer = bytearray()
+        self.scanned = 0
+        self.discarding = False
+        self.overflows = 0
+
+    def reset(self):
+        """ Drop any partial frame, e.g. after the connection was re-opened. """
+
+        del self.buffer[:]
+        self.scanned = 0
+        self.discarding = False
+
+    def feed(self, data):
+        """ Add some bytes and return the list of frames which they completed. """
+
+        buf = self.buffer
+        buf += data
+        EOL = self.EOL
+        frames = []
+
+        start = 0
+        while True:
+            eolAt = buf.find(EOL, max(start, self.scanned - len(EOL) + 1))
+            if eolAt < 0:
+                break
+            end = eolAt + len(EOL)
+            if self.discarding:
+                self.discarding = False
+            elif end - start > self.maxLength:
+                self.overflows += 1
+                frames.append(None)
+            else:
+                frames.append(bytes(buf[start:end if self.keepEOL else eolAt]))
+            start = end
+            self.scanned = end
+
+        del buf[:start]
+        self.scanned = len(buf)
+
+        if len(buf) > self.maxLength:
+            del buf[:]
+            self.scanned = 0
+            if not self.discarding:
+                self.discarding = True
+                self.overflows += 1
+                frames.append(None)
+
+        return frames
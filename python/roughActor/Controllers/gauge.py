@@ -1,10 +1,15 @@
-from importlib import reload
-
 import logging
-import socket
+import time
+
+from twisted.internet import defer
 
+from . import gaugeParams
+from . import history
 from . import pfeiffer
-reload(pfeiffer)
+from . import publisher
+from . import pumpdown
+from . import statusCache
+from . import transport
 
 class gauge(pfeiffer.Pfeiffer):
     def __init__(self, actor, name,
@@ -20,14 +25,72 @@ class gauge(pfeiffer.Pfeiffer):
         self.host = self.actor.actorConfig[self.name]['host']
         self.port = self.actor.actorConfig[self.name]['port']
 
-        pfeiffer.Pfeiffer.__init__(self)
+        config = self.actor.actorConfig[self.name]
+        self.connection = transport.DeviceConnection(self.name, self.host, self.port, EOL=self.EOL,
+                                                     timeout=config.get('timeout', 1.0),
+                                                     idleTimeout=config.get('idleTimeout', 30.0),
+                                                     minTimeout=config.get('minTimeout', 0.2),
+                                                     maxTimeout=config.get('maxTimeout', 2.0),
+                                                     retries=config.get('retries', 2),
+                                                     breakerThreshold=config.get('breakerThreshold', 3),
+                                                     maxReplyLength=config.get('maxReplyLength', 256),
+                                                     replyKey=self.replyKey,
+                                                     logger=self.logger, actorName=self.actor.name)
+        self.connection.breaker.listener = self.breakerChanged
+        if config.get('captureFile'):
+            self.connection.startCapture(config['captureFile'])
+
+        # How long to wait after a raw command before finishing.
+        self.rawSettleTime = config.get('rawSettleTime', 3.0)
+
+        # The RS-485 addresses of all the gauges on this line. The first one
+        # is the main gauge, which raw commands and the pressure keyword are for.
+        self.busIDs = list(config.get('busIDs', [1]))
+
+        # How long status readings can be shared between commands, in seconds.
+        cacheMaxAge = dict(pressure=1.0)
+        cacheMaxAge.update(config.get('cacheMaxAge', dict()))
+        maxAges = {self.pressureField(busID): cacheMaxAge['pressure'] for busID in self.busIDs}
+        self.cache = statusCache.StatusCache(self.name, maxAges)
+
+        # What the monitor loops need to see before they publish a new pressure.
+        self.publisher = publisher.KeyPublisher(heartbeat=config.get('heartbeat', 60.0))
+        self.pressureDeadband = config.get('pressureDeadband', 0.02)
+
+        # The main gauge's pumpdown rate, and the pressure to predict the arrival at.
+        self.pumpdown = pumpdown.PumpdownEstimator(window=config.get('pumpdownWindow', 60.0))
+        self.targetPressure = config.get('targetPressure', None)
+        self.pumpdownDeadband = config.get('pumpdownDeadband', 0.1)
+
+        self.history = history.TelemetryRing([self.pressureField(busID) for busID in self.busIDs],
+                                             size=config.get('historySize', 86400))
+
+        # The main gauge's configuration parameters, their types by code, and
+        # how long a reading of them stays good. They are read paramPipeline
+        # telegrams at a time: one by default, since an RS-485 bus need not take
+        # back-to-back telegrams. Raise it in the config for lines known to.
+        self.params = gaugeParams.ParamTable(config.get('params', gaugeParams.defaultParams))
+        self.paramsMaxAge = config.get('paramsMaxAge', 3600.0)
+        self.paramsBaseline = config.get('paramsBaseline', None)
+        self.paramPipeline = config.get('paramPipeline', 1)
+
+        pfeiffer.Pfeiffer.__init__(self, name=self.name, busID=self.busIDs[0])
+
+        # Ask the main gauge for its pressure when probing whether the line is back online.
+        self.connection.probeCmd = b'%s%s' % (self.makePressureCmd(), self.EOL)
 
     def start(self, cmd=None):
         pass
 
+    def breakerChanged(self, breaker):
+        """ Publish the circuit breaker state when the gauges go offline or come back. """
+
+        breaker.genKeys(self.actor.bcast)
+
     def stop(self, cmd=None):
-        pass
+        self.connection.shutdown()
 
+    @defer.inlineCallbacks
     def sendOneCommand(self, cmdStr, cmd=None):
         """ Send a single line command and return response.
 
@@ -38,7 +101,8 @@ class gauge(pfeiffer.Pfeiffer):
 
         Returns
         -------
-        response : bytes
+        response : Deferred
+          Fires with the reply bytes.
 
         """
         if cmd is None:
@@ -50,45 +114,210 @@ class gauge(pfeiffer.Pfeiffer):
             pass
 
         fullCmd = b"%s%s" % (cmdStr, self.EOL)
-        self.logger.info('sending %r', fullCmd)
-        cmd.diag('text="sending %r"' % fullCmd)
 
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(1.0)
-        except socket.error as e:
-            cmd.warn('text="failed to create socket to %s: %s"' % (self.name, e))
-            raise
+        # Label the latency with the parameter number, e.g. 740 for the pressure.
+        # Only queries (action 00) can be safely repeated.
+        ret = yield self.connection.exchange(fullCmd, cmd=cmd, label=cmdStr[5:8].decode('latin-1'),
+                                             idempotent=cmdStr[3:5] == b'00')
 
-        try:
-            s.connect((self.host, self.port))
-            s.sendall(fullCmd)
-        except socket.error as e:
-            cmd.warn('text="failed to create connect or send to %s: %s"' % (self.name, e))
-            raise
+        return ret
 
-        try:
-            ret = s.recv(1024)
-        except socket.error as e:
-            cmd.warn('text="failed to read response from %s: %s"' % (self.name, e))
-            raise
+    def replyKey(self, data):
+        """ The (bus ID, code) of a telegram or of a reply with a good CRC, else None.
 
-        self.logger.info('received %r', ret)
-        cmd.diag('text="received %r"' % ret)
-        s.close()
+        The CRC lets the transport tell a corrupted reply from one which
+        belongs to another telegram.
+        """
 
-        return ret
+        data = data.strip()
+        if len(data) < 10 or not data[-3:].isdigit() or int(data[-3:]) != self.gaugeCrc(data[:-3]):
+            return None
+        return data[:3], data[5:8]
+
+    def pressureField(self, busID):
+        """ The cache, history and keyword name for one gauge's pressure. """
+
+        return 'pressure' if busID == self.busIDs[0] else 'pressure%d' % (busID)
+
+    @defer.inlineCallbacks
+    def readPressure(self, cmd=None, busID=None):
+        """ Read a new pressure from one gauge. Returns a Deferred firing with torr.
+
+        A reply from any other gauge fails the read: it is not saved, since
+        it may well be the answer to an earlier query.
+        """
+
+        if busID is None:
+            busID = self.busID
+
+        cmdStr = self.makePressureCmd(busID=busID)
+        rawResp = yield self.sendOneCommand(cmdStr, cmd=cmd)
+        respBusID, resp = self.parseTelegram(rawResp, cmdCode=740)
+        if respBusID != busID:
+            raise ValueError('reply from %s bus ID %d to a query for bus ID %d: %r' % (self.name, respBusID,
+                                                                                      busID, rawResp))
+        val = self.parsePressure(resp)
+
+        now = time.time()
+        field = self.pressureField(busID)
+        self.cache.put(field, val, now)
+        self.history.append({field: val}, now)
+        archive = getattr(self.actor, 'archive', None)
+        if archive is not None:
+            archive.append(now, self.name, channel=busID, pressure=val)
+        if busID == self.busIDs[0]:
+            self.pumpdown.add(now, val)
+
+        return val
+
+    @defer.inlineCallbacks
+    def readPressures(self, busIDs=None, cmd=None):
+        """ Poll several gauges in turn, with one outstanding telegram at a time.
+
+        A gauge which does not answer does not stop the others from being
+        read.
+
+        Returns
+        -------
+        failed : Deferred
+          Fires with the list of bus IDs which could not be read.
+        """
+
+        if busIDs is None:
+            busIDs = self.busIDs
+
+        failed = []
+        for busID in busIDs:
+            try:
+                yield self.readPressure(cmd=cmd, busID=busID)
+            except Exception as e:
+                failed.append(busID)
+                if cmd is not None:
+                    cmd.warn('text="%s: failed to read gauge %d: %s"' % (self.name, busID, e))
+
+        return failed
+
+    @defer.inlineCallbacks
+    def status(self, cmd=None, fresh=False, changedOnly=False):
+        """ Generate the keywords for all gauges. Returns a Deferred firing with the main pressure.
+
+        The main gauge generates the pressure keyword, the others pressureNN
+        keywords, NN being their bus ID.
+
+        Args
+        ----
+        fresh : bool
+          If True, always read the pressures from the gauges, else accept
+          readings younger than the cache max age.
+        changedOnly : bool
+          If True, only generate the pressures which moved by more than the
+          pressureDeadband fraction, plus periodic heartbeats.
+        """
+        if cmd is None:
+            cmd = self.actor.bcast
+
+        fields = [self.pressureField(busID) for busID in self.busIDs]
+        stale = self.cache.staleFields(fields, fresh=fresh)
+        failed = yield self.readPressures([busID for busID, field in zip(self.busIDs, fields)
+                                           if field in stale],
+                                          cmd=cmd)
+        if self.busIDs[0] in failed:
+            raise RuntimeError('failed to read the main %s pressure' % (self.name))
+
+        force = not changedOnly
+        if self.publisher.heartbeatDue('link', force=force):
+            self.cache.genKeys(cmd)
+            self.connection.genKeys(cmd)
+        for busID, field in zip(self.busIDs, fields):
+            reading = self.cache.reading(field)
+            if busID in failed or reading is None:
+                continue
+            val = reading[0]
+            if self.publisher.shouldPublish(field, val, force=force,
+                                            deadband=self.pressureDeadband, fractional=True):
+                cmd.inform('%s=%g' % (field, val))
+        self.genPumpdownKeys(cmd, changedOnly=changedOnly)
+
+        return self.cache.reading(fields[0])[0]
+
+    def genPumpdownKeys(self, cmd, changedOnly=False):
+        """ Generate pumpdownRate=d(ln P)/dt per second, and etaToTarget=target torr,seconds. """
+
+        force = not changedOnly
+        rate = self.pumpdown.rate()
+        if self.publisher.shouldPublish('pumpdownRate', rate, force=force,
+                                        deadband=self.pumpdownDeadband, fractional=True):
+            cmd.inform('pumpdownRate=%g' % (rate))
+
+        if self.targetPressure is None:
+            return
+        eta = self.pumpdown.eta(self.targetPressure)
+        if self.publisher.shouldPublish('etaToTarget', eta, force=force,
+                                        deadband=self.pumpdownDeadband, fractional=True):
+            cmd.inform('etaToTarget=%g,%g' % (self.targetPressure, eta))
+
+    def setTarget(self, pressure, cmd=None):
+        """ Set the pressure, in torr, to predict the arrival at. None to stop predicting. """
+
+        self.targetPressure = pressure
+        self.publisher.published.pop('etaToTarget', None)
+
+    @defer.inlineCallbacks
+    def readParams(self, codes=None, fresh=False, cmd=None):
+        """ Read the main gauge's stale parameters into the parameter table.
+
+        The query telegrams are written paramPipeline at a time, and the
+        replies, which come back in order, are matched to them. A parameter
+        which the gauge cannot return is saved with its error.
+
+        Args
+        ----
+        codes : list of int
+          The parameters to read. Default is all the configured ones.
+        fresh : bool
+          If True, read all of them, else only those older than paramsMaxAge.
+
+        Returns
+        -------
+        read : Deferred
+          Fires with the list of codes which were read.
+        """
+        if cmd is None:
+            cmd = self.actor.bcast
+
+        if codes is None:
+            codes = self.params.codes()
+        if not fresh:
+            codes = self.params.stale(self.paramsMaxAge, codes)
+
+        for i in range(0, len(codes), self.paramPipeline):
+            batch = codes[i:i+self.paramPipeline]
+            fullCmds = [b'%s%s' % (self.makeRawQueryCmd(code), self.EOL) for code in batch]
+            rets = yield self.connection.exchangeMany(fullCmds, cmd=cmd, label='params',
+                                                      idempotent=True)
+            now = time.time()
+            for code, ret in zip(batch, rets):
+                try:
+                    raw = self.parseResponse(ret, cmdCode=code, cmd=cmd)
+                except ValueError as e:
+                    self.params.put(code, None, now, error=str(e))
+                else:
+                    self.params.put(code, raw, now)
+
+        return codes
 
+    @defer.inlineCallbacks
     def gaugeRawCmd(self, cmdStr, cmd=None):
         gaugeStr = self.gaugeMakeRawCmd(cmdStr, cmd=cmd)
-        ret = self.sendOneCommand(gaugeStr, cmd=cmd)
+        ret = yield self.sendOneCommand(gaugeStr, cmd=cmd)
 
         return ret
 
+    @defer.inlineCallbacks
     def gaugeCmd(self, cmdStr, cmd=None):
         if cmd is None:
             cmd = self.actor.bcast
 
         # ret = self.sendOneCommand(cmdStr, cmd)
-        ret = self.gaugeRawCmd(cmdStr, cmd=cmd)
+        ret = yield self.gaugeRawCmd(cmdStr, cmd=cmd)
         return ret
@@ -0,0 +1,144 @@
+""" A typed, timestamped table of MPT200 parameter values, and baselines to compare it with.
+
+The MPT200 returns every parameter as a short string, whose meaning
+depends on the parameter's data type (manual section 6.4). The types we
+decode are:
+
+  bool    -- '000000'/'111111', or '0'/'1'
+  int     -- unsigned integer digits
+  real    -- unsigned digits, in hundredths
+  expo    -- 4 mantissa and 2 exponent digits, as for the pressure
+  string  -- taken as is
+
+A baseline is a JSON file of the raw strings, by code, so that it does not
+depend on how we decode them.
+"""
+
+import json
+import time
+
+# Replies which say that the parameter could not be read.
+errorValues = ('NO_DEF', '_RANGE', '_LOGIC')
+
+# Some of the section 6.5 parameters, with their types.
+defaultParams = {303: 'string',        # Error code
+                 312: 'string',        # Software version
+                 340: 'int',           # Correction factor
+                 349: 'string',        # Device name
+                 354: 'string',        # Hardware version
+                 355: 'string'}        # Serial number
+
+def decodeBool(raw):
+    if raw not in ('0', '1', '000000', '111111'):
+        raise ValueError('not a boolean: %r' % (raw))
+    return raw[0] == '1'
+
+def decodeExpo(raw):
+    mantissa = int(raw[0:4], base=10) * 10.0 ** -3
+    exponent = int(raw[4:6], base=10) - 20
+    return mantissa * 10**exponent
+
+decoders = dict(bool=decodeBool,
+                int=lambda raw: int(raw, base=10),
+                real=lambda raw: int(raw, base=10) / 100.0,
+                expo=decodeExpo,
+                string=lambda raw: raw)
+
+class ParamTable(object):
+    """ The last values read of a set of parameters.
+
+    Args
+    ----
+    params : dict
+      The parameter types, by code.
+    """
+
+    def __init__(self, params):
+        self.params = {int(code): paramType for code, paramType in params.items()}
+        for code, paramType in self.params.items():
+            if paramType not in decoders:
+                raise ValueError('unknown type %r for parameter %d' % (paramType, code))
+
+        # (value, raw, time, error), by code
+        self.entries = dict()
+
+    def codes(self):
+        return sorted(self.params.keys())
+
+    def put(self, code, raw, now=None, error=None):
+        """ Save one raw value, or the reason it could not be read. Returns the decoded value. """
+
+        if now is None:
+            now = time.time()
+
+        value = None
+        if error is None:
+            if raw in errorValues:
+                error = raw
+            else:
+                try:
+                    value = decoders[self.params.get(code, 'string')](raw)
+                except ValueError as e:
+                    error = str(e)
+        self.entries[code] = (value, raw, now, error)
+
+        return value
+
+    def stale(self, maxAge, codes=None, now=None):
+        """ The codes which were not successfully read within the last maxAge seconds. """
+
+        if now is None:
+            now = time.time()
+        if codes is None:
+            codes = self.codes()
+
+        stale = []
+        for code in codes:
+            entry = self.entries.get(code)
+            if entry is None or entry[3] is not None or now - entry[2] > maxAge:
+                stale.append(code)
+        return stale
+
+    def raw(self):
+        """ The raw strings of the parameters which were successfully read, by code. """
+
+        return {code: entry[1] for code, entry in self.entries.items() if entry[3] is None}
+
+    def diff(self, baseline):
+        """ Return (code, baseline raw, live raw) for the parameters which differ from a baseline.
+
+        A parameter missing on either side is reported with None for that side.
+        """
+
+        live = self.raw()
+        diffs = []
+        for code in sorted(set(live) | set(baseline)):
+            if live.get(code) != baseline.get(code):
+                diffs.append((code, baseline.get(code), live.get(code)))
+        return diffs
+
+    def genKeys(self, cmd, name):
+        """ Generate one <name>Param=code,type,value,age keyword per parameter, by code. """
+
+        now = time.time()
+        for code in self.codes():
+            entry = self.entries.get(code)
+            if entry is None:
+                continue
+            value, raw, t, error = entry
+            if error is not None:
+                cmd.warn('%sParam=%d,%s,%r,%0.1f' % (name, code, self.params[code], error, now - t))
+            else:
+                cmd.inform('%sParam=%d,%s,%r,%0.1f' % (name, code, self.params[code], value, now - t))
+
+def saveBaseline(path, raw):
+    """ Write the raw parameter strings, by code, to a baseline file. """
+
+    with open(path, 'w') as f:
+        json.dump({str(code): value for code, value in sorted(raw.items())}, f, indent=1)
+
+def loadBaseline(path):
+    """ Read a baseline file. Returns the raw parameter strings, by code. """
+
+    with open(path) as f:
+        return {int(code): value for code, value in json.load(f).items()}
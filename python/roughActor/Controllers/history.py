@@ -0,0 +1,105 @@
+import time
+
+import numpy as np
+
+class TelemetryRing(object):
+    """ A fixed-size, preallocated ring buffer of timestamped controller readings.
+
+    Each row holds one timestamp and one value per field. Fields which were
+    not part of a reading are NaN, and are ignored by the statistics.
+
+    Args
+    ----
+    fields : list of str
+      The names of the columns.
+    size : int
+      The number of rows to keep.
+    """
+
+    def __init__(self, fields, size=86400):
+        self.fields = tuple(fields)
+        self.columns = {f: i for i, f in enumerate(self.fields)}
+        self.size = size
+
+        self.times = np.zeros(size, dtype='f8')
+        self.values = np.full((size, len(self.fields)), np.nan, dtype='f8')
+        self.count = 0
+        self.next = 0
+
+    def append(self, values, timestamp=None):
+        """ Add one reading.
+
+        Args
+        ----
+        values : dict
+          Some of the fields, by name.
+        timestamp : float
+          Unix time of the reading. Defaults to now.
+        """
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        i = self.next
+        row = self.values[i]
+        row[:] = np.nan
+        for field, value in values.items():
+            row[self.columns[field]] = value
+        self.times[i] = timestamp
+
+        self.next = (i + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def _segments(self):
+        """ The (start, stop) index ranges of the rows, oldest first. """
+
+        if self.count < self.size:
+            return [(0, self.count)]
+        return [(self.next, self.size), (0, self.next)]
+
+    def window(self, field, seconds, now=None):
+        """ Return the (times, values) of one field over the last few seconds, oldest first. """
+
+        if now is None:
+            now = time.time()
+        col = self.columns[field]
+        t0 = now - seconds
+
+        times = []
+        values = []
+        for start, stop in self._segments():
+            i = start + np.searchsorted(self.times[start:stop], t0)
+            times.append(self.times[i:stop])
+            values.append(self.values[i:stop, col])
+        times = np.concatenate(times)
+        values = np.concatenate(values)
+
+        good = np.isfinite(values)
+        return times[good], values[good]
+
+    def stats(self, field, seconds, now=None):
+        """ Return the statistics of one field over the last few seconds.
+
+        Returns
+        -------
+        n : int
+          The number of readings.
+        min, max, mean, last : float
+        slope : float
+          The least-squares rate of change, per second.
+        """
+
+        times, values = self.window(field, seconds, now=now)
+        n = len(values)
+        if n == 0:
+            return 0, np.nan, np.nan, np.nan, np.nan, np.nan
+
+        mean = values.mean()
+        slope = np.nan
+        if n > 1:
+            dt = times - times.mean()
+            denom = np.dot(dt, dt)
+            if denom > 0:
+                slope = np.dot(dt, values - mean) / denom
+
+        return n, values.min(), values.max(), mean, values[-1], slope
@@ -1,12 +1,17 @@
+from . import pfeifferCodec
+
 class Pfeiffer(object):
-    def __init__(self, name=None):
-        self.busID = 1
+    def __init__(self, name=None, busID=1):
+        self.busID = busID
 
         if name is None:
             name = 'gauge'
         self.name = name
 
-    def parseResponse(self, resp, cmdCode=None, cmd=None):
+        # Complete query telegrams, by (busID, code)
+        self.queryTelegrams = dict()
+
+    def parseResponse(self, resp, cmdCode=None, cmd=None, busID=None):
         """ Fully validate a response telegram, return value
 
         Args
@@ -15,6 +20,8 @@ class Pfeiffer(object):
           The full, raw response from the gauge
         cmdCode : int/string
           Optionally, the command code that resp is a reply to.
+        busID : int
+          The gauge the response must come from. Default is self.busID
 
         Returns
         -------
@@ -23,6 +30,34 @@ class Pfeiffer(object):
 
         """
 
+        if busID is None:
+            busID = self.busID
+
+        respBusID, valStr = self.parseTelegram(resp, cmdCode=cmdCode)
+        if respBusID != busID:
+            raise ValueError('response from %s does not have the right bus ID (%03d vs %03d): %r' % (self.name,
+                                                                                                    respBusID, busID,
+                                                                                                    resp))
+        return valStr
+
+    def parseTelegram(self, resp, cmdCode=None):
+        """ Validate a response telegram from any gauge on the bus.
+
+        Args
+        ----
+        resp : string
+          The full, raw response from the gauge
+        cmdCode : int/string
+          Optionally, the command code that resp is a reply to.
+
+        Returns
+        -------
+        busID : int
+          The gauge which sent the response.
+        value : string
+          The unconverted, but otherwise valid, value string.
+        """
+
         resp = resp.strip()
         try:
             resp = resp.decode('latin-1')
@@ -43,9 +78,11 @@ class Pfeiffer(object):
             raise ValueError('response from %s does not have the right CRC (%03d vs %03d): %r' % (self.name,
                                                                                                   respCrc, calcCrc,
                                                                                                   resp))
-        if int(resp[:3]) != self.busID:
-            raise ValueError('response from %s does not have the right bus ID: %r' % (self.name,
-                                                                                      resp))
+        try:
+            respBusID = int(resp[:3], base=10)
+        except ValueError:
+            raise ValueError('response from %s does not have a valid bus ID: %r' % (self.name,
+                                                                                   resp))
         if resp[3:5] != '10':
             raise ValueError('response from %s does not have an action of 10 (%s): %r' % (self.name,
                                                                                           resp[3:5],
@@ -63,7 +100,7 @@ class Pfeiffer(object):
             raise ValueError('value from %s (%r) is not the right length (%d): %r' % (self.name,
                                                                                       valStr, valLen,
                                                                                       resp))
-        return valStr
+        return respBusID, valStr
 
     def gaugeCrc(self, s):
         try:
@@ -71,9 +108,9 @@ class Pfeiffer(object):
         except AttributeError:
             pass
 
-        return sum([c for c in s]) % 256
+        return sum(s) % 256
 
-    def makeRawCmd(self, cmdStr, cmd=None):
+    def makeRawCmd(self, cmdStr, cmd=None, busID=None):
         """ Send set or query string.
 
         Basically, this adds the bus ID, the CRC, and the EOL.
@@ -82,6 +119,8 @@ class Pfeiffer(object):
         ----
         cmdStr : string
           Formatted telegram string. We add the bus ID and the CRC
+        busID : int
+          The gauge to address. Default is self.busID
 
         Returns
         -------
@@ -92,13 +131,16 @@ class Pfeiffer(object):
         if isinstance(cmdStr, str):
             cmdStr = cmdStr.encode('latin-1')
 
-        cmdStr = b'%03d%s' % (self.busID, cmdStr)
+        if busID is None:
+            busID = self.busID
+
+        cmdStr = b'%03d%s' % (busID, cmdStr)
         crc = self.gaugeCrc(cmdStr)
         cmdStr = b'%s%03d' % (cmdStr, crc)
 
         return cmdStr
 
-    def makeRawQueryCmd(self, code, cmd=None):
+    def makeRawQueryCmd(self, code, cmd=None, busID=None):
         """ Return command to read a single gauge variable.
 
         Args
@@ -106,16 +148,30 @@ class Pfeiffer(object):
         code : int/str
           One of the commands in section 6.5
           We turn this into a %03d string
+        busID : int
+          The gauge to address. Default is self.busID
 
         Returns
         -------
         cmd - string
         """
 
+        if busID is None:
+            busID = self.busID
+
+        key = (busID, code)
+        try:
+            return self.queryTelegrams[key]
+        except KeyError:
+            pass
+
         cmdStr = b'00%03d02=?' % (code)
-        return self.makeRawCmd(cmdStr)
+        telegram = self.makeRawCmd(cmdStr, busID=busID)
+        self.queryTelegrams[key] = telegram
 
-    def makeRawSetCmd(self, code, value, cmd=None):
+        return telegram
+
+    def makeRawSetCmd(self, code, value, cmd=None, busID=None):
         """ Return command to set a single gauge variable.
 
         Args
@@ -126,6 +182,8 @@ class Pfeiffer(object):
         value : string
           Some value, sent as is. In other words, you must 
           pad it if necessary.
+        busID : int
+          The gauge to address. Default is self.busID
 
         Returns
         -------
@@ -134,10 +192,10 @@ class Pfeiffer(object):
         """
 
         cmdStr = b'10%03d%02d%s' % (code, len(value), value)
-        return self.makeRawCmd(cmdStr)
+        return self.makeRawCmd(cmdStr, busID=busID)
 
-    def makePressureCmd(self):
-        return self.makeRawQueryCmd(740)
+    def makePressureCmd(self, busID=None):
+        return self.makeRawQueryCmd(740, busID=busID)
 
     def parsePressure(self, rawReading):
         # 430013 -> 4300 13 -> 4.3e-7
@@ -149,3 +207,14 @@ class Pfeiffer(object):
 
         return reading
 
+    def parseResponses(self, resps, cmdCode=None, busID=None):
+        """ Validate many raw responses at once. See pfeifferCodec.decodeResponses() """
+
+        if busID is None:
+            busID = self.busID
+        return pfeifferCodec.decodeResponses(resps, busID=busID, cmdCode=cmdCode)
+
+    def parsePressures(self, resps, busID=None):
+        """ Convert many raw pressure responses to torr, with NaN for invalid ones. """
+
+        return pfeifferCodec.parsePressures(self.parseResponses(resps, cmdCode=740, busID=busID))
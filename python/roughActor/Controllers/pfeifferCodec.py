@@ -0,0 +1,109 @@
+""" Vectorized decoding of many Pfeiffer response telegrams at once.
+
+This applies the same checks as Pfeiffer.parseResponse() -- CRC, bus ID,
+action, command code and value length -- to whole arrays of raw
+responses, for replaying captured gauge traffic and for high-rate sampling.
+"""
+
+import numpy as np
+
+ZERO = ord('0')
+
+def responseArray(resps):
+    """ Pack raw responses into a zero-padded uint8 array.
+
+    Args
+    ----
+    resps : list of bytes/str
+      Raw responses. Surrounding whitespace and EOLs are stripped.
+
+    Returns
+    -------
+    arr : uint8 array, (n, width)
+    lengths : int array, (n,)
+    """
+
+    resps = [r.encode('latin-1') if isinstance(r, str) else r for r in resps]
+    resps = [r.strip() for r in resps]
+    lengths = np.fromiter((len(r) for r in resps), dtype='i4', count=len(resps))
+    width = max(16, lengths.max() if len(resps) else 0)
+
+    joined = np.frombuffer(b''.join(r.ljust(width, b'\0') for r in resps), dtype='u1')
+    return joined.reshape(len(resps), width), lengths
+
+def _digits(arr, start, stop):
+    """ The decimal value of columns [start, stop), and whether they are all digits. """
+
+    d = arr[:, start:stop].astype('i4') - ZERO
+    ok = ((d >= 0) & (d <= 9)).all(axis=1)
+    scale = 10 ** np.arange(stop - start - 1, -1, -1)
+    return d @ scale, ok
+
+def decodeResponses(resps, busID=None, cmdCode=None):
+    """ Validate many response telegrams at once.
+
+    Args
+    ----
+    resps : list of bytes/str
+      Raw responses, as returned by the gauge.
+    busID : int
+      If set, the bus ID which the responses must come from.
+    cmdCode : int
+      If set, the command code which the responses must be for.
+
+    Returns
+    -------
+    decoded : dict of arrays, each of length n
+      valid : bool -- passed all the checks
+      busID, code, valLen : int -- the parsed header fields
+      arr, lengths -- the packed telegrams, from responseArray()
+    """
+
+    arr, lengths = responseArray(resps)
+    n, width = arr.shape
+    rows = np.arange(n)
+
+    valid = lengths >= 13
+
+    # The CRC is the sum of all bytes before the three CRC digits.
+    crcIdx = np.clip(lengths - 3, 0, width - 3)
+    body = np.arange(width)[None, :] < crcIdx[:, None]
+    calcCrc = (arr.astype('i4') * body).sum(axis=1) % 256
+    crcDigits = arr[rows[:, None], crcIdx[:, None] + np.arange(3)[None, :]].astype('i4') - ZERO
+    valid &= ((crcDigits >= 0) & (crcDigits <= 9)).all(axis=1)
+    valid &= (crcDigits @ np.array([100, 10, 1])) == calcCrc
+
+    respBusID, ok = _digits(arr, 0, 3)
+    valid &= ok
+    if busID is not None:
+        valid &= respBusID == busID
+
+    valid &= (arr[:, 3] == ord('1')) & (arr[:, 4] == ord('0'))
+
+    code, ok = _digits(arr, 5, 8)
+    valid &= ok
+    if cmdCode is not None:
+        valid &= code == cmdCode
+
+    valLen, ok = _digits(arr, 8, 10)
+    valid &= ok & (valLen == lengths - 13)
+
+    return dict(valid=valid, busID=respBusID, code=code, valLen=valLen,
+                arr=arr, lengths=lengths)
+
+def parsePressures(decoded):
+    """ Convert decoded pressure (740) responses to torr, NaN where invalid.
+
+    This is the vectorized Pfeiffer.parsePressure(): the 6-digit value is a
+    4-digit mantissa (x 1e-3) and a 2-digit exponent (+ 20), in hPa.
+    """
+
+    arr = decoded['arr']
+    mantissa, okM = _digits(arr, 10, 14)
+    exponent, okE = _digits(arr, 14, 16)
+    ok = decoded['valid'] & okM & okE & (decoded['valLen'] == 6)
+
+    # Only convert the valid rows: the digits of the others can be anything, and overflow.
+    torr = np.full(len(arr), np.nan)
+    torr[ok] = 0.750061683 * mantissa[ok] * 1e-3 * 10.0 ** (exponent[ok] - 20)
+    return torr
@@ -0,0 +1,64 @@
+import time
+
+def isNaN(value):
+    return isinstance(value, float) and value != value
+
+class KeyPublisher(object):
+    """ Decide which of a controller's monitored keywords are worth sending.
+
+    A keyword is published when it has never been published, when its value
+    has left the deadband around the last published value, or when it has
+    not been published for `heartbeat` seconds.
+
+    Args
+    ----
+    heartbeat : float
+      The longest time between two publications of a keyword, in seconds.
+    """
+
+    def __init__(self, heartbeat=60.0):
+        self.heartbeat = heartbeat
+        self.published = dict()
+
+    def shouldPublish(self, key, value, force=False, deadband=0.0, fractional=False):
+        """ Return True if key should be published, and if so remember its value.
+
+        Args
+        ----
+        key : str
+          The name to track the value under.
+        value : object
+          The new value. With no deadband, any change is published.
+        force : bool
+          Always publish.
+        deadband : float
+          How far value needs to move from the last published value.
+        fractional : bool
+          If True, the deadband is a fraction of the last published value.
+        """
+
+        now = time.time()
+        last = self.published.get(key)
+
+        if force or last is None or now - last[1] >= self.heartbeat:
+            publish = True
+        elif isNaN(value) or isNaN(last[0]):
+            # A value which cannot be compared is only news when it appears or goes away.
+            publish = isNaN(value) != isNaN(last[0])
+        else:
+            lastValue = last[0]
+            if deadband == 0:
+                publish = value != lastValue
+            else:
+                if fractional:
+                    deadband *= abs(lastValue)
+                publish = abs(value - lastValue) > deadband
+
+        if publish:
+            self.published[key] = (value, now)
+        return publish
+
+    def heartbeatDue(self, key, force=False):
+        """ Return True if key, which changes too often to track, is due for a heartbeat. """
+
+        return self.shouldPublish(key, None, force=force)
@@ -1,8 +1,91 @@
+import functools
 import logging
-import socket
+import time
+
+from twisted.internet import defer, reactor, task
 
 from opscore.utility.qstr import qstr
 
+from . import history
+from . import publisher
+from . import pumpSchema
+from . import statusCache
+from . import transport
+
+statusFlags = ('Decelerating',
+               'Running/Accelerating',
+               'Standby speed',
+               'Normal speed',
+               'Above ramp speed',
+               'Above overload speed',
+               'Control mode bit 0',
+               'Control mode bit 1',
+               'bit 8',
+               'bit 9',
+               'Serial enable',
+               'bit 11',
+               'bit 12',
+               'Control mode bit 2',
+               'bit 14',
+               'bit 15',
+
+               'Power limit active',
+               'Acceleration limited',
+               'Deceleration limited',
+               'bit 19',
+               'Service due!',
+               'bit 21',
+               'Warning active',
+               'Alarm active',
+               'bit 24',
+               'bit 25',
+               'bit 26',
+               'bit 27',
+               'bit 28',
+               'bit 39',
+               'bit 30',
+               'bit 31')
+
+warningFlags = ('bit 0',
+                'Pump temperature low',
+                'bit 2',
+                'bit 3',
+                'bit 4',
+                'bit 5',
+                'Pump temperature high',
+                'bit 7',
+                'bit 8',
+                'bit 9',
+                'Pump temperature above max',
+                'bit 11',
+                'bit 12',
+                'bit 13',
+                'bit 14',
+                'Self-test warning')
+
+errorFlags = ('bit 0',
+              'Over voltage trip',
+              'Over current trip',
+              'Over temperature trip',
+              'Under temperature trip',
+              'Power stage fault',
+              'bit 6',
+              'bit 7',
+              'H/W fault latched',
+              'EEPROM fault',
+              'bit10',
+              'Parameters not loaded',
+              'Self test fault',
+              'Serial mode interlock',
+              'Overload timeout',
+              'Acceleration timeout')
+
+@functools.lru_cache(maxsize=1024)
+def decodeFlags(word, flags):
+    """ Return the names of the bits set in word. Memoized, since the words rarely change. """
+
+    return tuple(flags[i] for i in range(len(flags)) if word & (1 << i))
+
 class pump(object):
     def __init__(self, actor, name,
                  loglevel=logging.INFO):
@@ -17,12 +100,58 @@ class pump(object):
         self.host = self.actor.actorConfig[self.name]['host']
         self.port = self.actor.actorConfig[self.name]['port']
 
+        config = self.actor.actorConfig[self.name]
+        self.connection = transport.DeviceConnection(self.name, self.host, self.port, EOL=self.EOL,
+                                                     timeout=config.get('timeout', 1.0),
+                                                     idleTimeout=config.get('idleTimeout', 30.0),
+                                                     minTimeout=config.get('minTimeout', 0.2),
+                                                     maxTimeout=config.get('maxTimeout', 2.0),
+                                                     retries=config.get('retries', 2),
+                                                     breakerThreshold=config.get('breakerThreshold', 3),
+                                                     maxReplyLength=config.get('maxReplyLength', 256),
+                                                     logger=self.logger, actorName=self.actor.name)
+        self.connection.breaker.listener = self.breakerChanged
+        if config.get('captureFile'):
+            self.connection.startCapture(config['captureFile'])
+
+        # How to decide that a start or stop has completed.
+        self.spinUpSpeed = config.get('spinUpSpeed', 25)
+        self.spinUpTimeout = config.get('spinUpTimeout', 180.0)
+        self.spinDownTimeout = config.get('spinDownTimeout', 180.0)
+        self.speedPollPeriod = config.get('speedPollPeriod', 2.0)
+
+        # How many queries to write back-to-back.
+        self.maxPipeline = config.get('maxPipeline', 8)
+
+        # How long status readings can be shared between commands, in seconds.
+        maxAges = dict(speed=1.0, temps=5.0, lifetimes=60.0)
+        maxAges.update(config.get('cacheMaxAge', dict()))
+        self.cache = statusCache.StatusCache(self.name, maxAges)
+
+        # What the monitor loops need to see before they publish a new value.
+        self.publisher = publisher.KeyPublisher(heartbeat=config.get('heartbeat', 60.0))
+        self.speedDeadband = config.get('speedDeadband', 1)
+        self.tempDeadband = config.get('tempDeadband', 1)
+
+        self.history = history.TelemetryRing(('speed', 'motorTemp', 'controllerTemp',
+                                              'status', 'warnings', 'errors'),
+                                             size=config.get('historySize', 86400))
+
+        # Ask for the pump's identity when probing whether it is back online.
+        self.connection.probeCmd = b'?S801%s' % (self.EOL)
+
     def start(self, cmd=None):
         pass
 
+    def breakerChanged(self, breaker):
+        """ Publish the circuit breaker state when the pump goes offline or comes back. """
+
+        breaker.genKeys(self.actor.bcast)
+
     def stop(self, cmd=None):
-        pass
+        self.connection.shutdown()
 
+    @defer.inlineCallbacks
     def sendOneCommand(self, cmdStr, cmd=None):
         if cmd is None:
             cmd = self.actor.bcast
@@ -33,34 +162,50 @@ class pump(object):
             pass
         
         fullCmd = b"%s%s" % (cmdStr, self.EOL)
-        self.logger.info('sending %r', fullCmd)
-        cmd.diag('text="sending %r"' % fullCmd)
+        ret = yield self.connection.exchange(fullCmd, cmd=cmd, label=cmdStr[:5].decode('latin-1'),
+                                             idempotent=cmdStr.startswith(b'?'))
 
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(1.0)
-        except socket.error as e:
-            cmd.warn('text="failed to create socket to rough: %s"' % (e))
-            raise
- 
-        try:
-            s.connect((self.host, self.port))
-            s.sendall(fullCmd)
-        except socket.error as e:
-            cmd.warn('text="failed to create connect or send to rough: %s"' % (e))
-            raise
+        return ret.decode('latin-1')
 
-        try:
-            ret = s.recv(1024)
-        except socket.error as e:
-            cmd.warn('text="failed to read response from rough: %s"' % (e))
-            raise
+    @defer.inlineCallbacks
+    def query(self, cmdStrs, cmd=None):
+        """ Send several queries back-to-back and return the decoded replies.
 
-        self.logger.info('received %r', ret)
-        cmd.diag('text="received %r"' % ret)
-        s.close()
+        The queries are written on one connection, at most maxPipeline at a
+        time, and the replies are matched to the queries by their =Vnnn
+        prefix.
 
-        return ret.decode('latin-1')
+        Args
+        ----
+        cmdStrs : list of str
+          The queries, e.g. ['?V802', '?V808']
+
+        Returns
+        -------
+        replies : dict
+          The decodeReply() record for each query string.
+        """
+        if cmd is None:
+            cmd = self.actor.bcast
+
+        replies = dict()
+        for i in range(0, len(cmdStrs), self.maxPipeline):
+            batch = cmdStrs[i:i+self.maxPipeline]
+            fullCmds = [b"%s%s" % (cmdStr.encode('latin-1'), self.EOL) for cmdStr in batch]
+            # Label the latency by the queries, like single sendOneCommand() exchanges.
+            label = '+'.join(cmdStr[:5] for cmdStr in batch)
+            rets = yield self.connection.exchangeMany(fullCmds, cmd=cmd, label=label,
+                                                      idempotent=True)
+            rets = [ret.decode('latin-1') for ret in rets]
+            for cmdStr in batch:
+                for ret in rets:
+                    if ret[1:5] == cmdStr[1:5]:
+                        break
+                else:
+                    raise ValueError('no reply to %r in %r' % (cmdStr, rets))
+                replies[cmdStr] = self.decodeReply(cmdStr, ret, cmd=cmd)
+
+        return replies
 
     def parseReply(self, cmdStr, reply, cmd=None):
         cmdType = cmdStr[:1]
@@ -78,160 +223,103 @@ class pump(object):
                                                                                             replyCheck)))
         return reply[5:].strip().split(';')
 
+    def decodeReply(self, cmdStr, reply, cmd=None):
+        """ Check a query reply and decode it with its pumpSchema, e.g. into a pumpSchema.Speed. """
+
+        return pumpSchema.decode(cmdStr, self.parseReply(cmdStr, reply, cmd=cmd))
+
+    @defer.inlineCallbacks
     def ident(self, cmd=None):
         cmdStr = '?S801'
 
-        ret = self.sendOneCommand(cmdStr, cmd=cmd)
+        ret = yield self.sendOneCommand(cmdStr, cmd=cmd)
         reply = self.parseReply(cmdStr, ret, cmd=cmd)
 
         return reply
 
+    @defer.inlineCallbacks
     def startPump(self, cmd=None):
         cmdStr = '!C802 1'
 
-        ret = self.sendOneCommand(cmdStr, cmd=cmd)
+        ret = yield self.sendOneCommand(cmdStr, cmd=cmd)
         reply = self.parseReply(cmdStr, ret, cmd=cmd)
 
         return reply
 
+    @defer.inlineCallbacks
     def stopPump(self, cmd=None):
         cmdStr = '!C802 0'
 
-        ret = self.sendOneCommand(cmdStr, cmd=cmd)
+        ret = yield self.sendOneCommand(cmdStr, cmd=cmd)
         reply = self.parseReply(cmdStr, ret, cmd=cmd)
 
         return reply
 
+    @defer.inlineCallbacks
     def startStandby(self, percent=90, cmd=None):
         cmdStr = "!S805 %d" % (percent)
-        ret = self.sendOneCommand(cmdStr, cmd=cmd)
+        ret = yield self.sendOneCommand(cmdStr, cmd=cmd)
 
         cmdStr = "!C803 1"
-        ret = self.sendOneCommand(cmdStr, cmd=cmd)
+        ret = yield self.sendOneCommand(cmdStr, cmd=cmd)
         return ret
 
+    @defer.inlineCallbacks
     def stopStandby(self, cmd=None):
         cmdStr = "!C803 0"
-        ret = self.sendOneCommand(cmdStr, cmd=cmd)
+        ret = yield self.sendOneCommand(cmdStr, cmd=cmd)
         return ret
 
     def errorString(self, errorMask):
-        errorFlags = ('bit 0',
-                      'Over voltage trip',
-                      'Over current trip',
-                      'Over temperature trip',
-                      'Under temperature trip',
-                      'Power stage fault',
-                      'bit 6',
-                      'bit 7',
-                      'H/W fault latched',
-                      'EEPROM fault',
-                      'bit10',
-                      'Parameters not loaded',
-                      'Self test fault',
-                      'Serial mode interlock',
-                      'Overload timeout',
-                      'Acceleration timeout')
-                      
-        errors = []
-        for i in range(16):
-            if errorMask & (1 << i):
-                errors.append(errorFlags[i])
-
-        return errors
+        return list(decodeFlags(errorMask, errorFlags))
     
-    def statusWord(self, status, cmd=None):
-        flags = ('Decelerating',
-                 'Running/Accelerating',
-                 'Standby speed',
-                 'Normal speed',
-                 'Above ramp speed',
-                 'Above overload speed',
-                 'Control mode bit 0',
-                 'Control mode bit 1',
-                 'bit 8',
-                 'bit 9',
-                 'Serial enable',
-                 'bit 11',
-                 'bit 12',
-                 'Control mode bit 2',
-                 'bit 14',
-                 'bit 15',
-                 
-                 'Power limit active',
-                 'Acceleration limited',
-                 'Deceleration limited',
-                 'bit 19',
-                 'Service due!',
-                 'bit 21',
-                 'Warning active',
-                 'Alarm active',
-                 'bit 24',
-                 'bit 25',
-                 'bit 26',
-                 'bit 27',
-                 'bit 28',
-                 'bit 39',
-                 'bit 30',
-                 'bit 31')
-
-        warningFlags = ('bit 0',
-                        'Pump temperature low',
-                        'bit 2',
-                        'bit 3',
-                        'bit 4',
-                        'bit 5',
-                        'Pump temperature high',
-                        'bit 7',
-                        'bit 8',
-                        'bit 9',
-                        'Pump temperature above max',
-                        'bit 11',
-                        'bit 12',
-                        'bit 13',
-                        'bit 14',
-                        'Self-test warning')
-
-        allFlags = []
-        statusWord = status[0]
-        for i in range(32):
-            if statusWord & (1 << i):
-                allFlags.append(flags[i])
-
-        warnings = []
-        warningWord = status[1]
-        for i in range(16):
-            if warningWord & (1 << i):
-                warnings.append(warningFlags[i])
-
-        errorWord = status[2]
-        errors = self.errorString(errorWord)
+    def statusWord(self, status, cmd=None, changedOnly=False):
+        """ Decode the status, warning and error words, and generate their keywords.
+
+        Args
+        ----
+        status : tuple of int
+          The status, warning and error words.
+        changedOnly : bool
+          Only generate the keywords whose words changed since they were
+          last generated, or which are due for a heartbeat.
+        """
+
+        statusWord, warningWord, errorWord = status
+        allFlags = list(decodeFlags(statusWord, statusFlags))
+        warnings = decodeFlags(warningWord, warningFlags)
+        errors = decodeFlags(errorWord, errorFlags)
         
         if cmd is not None:
-            cmd.inform('%sStatus=0x%04x,%r' % (self.name,
-                                               statusWord, ', '.join(allFlags)))
-            if len(warnings) > 0:
-                cmd.warn('%sWarnings=0x%02x,%r' % (self.name,
-                                                   warningWord, ','.join(warnings)))
-            else:
-                cmd.inform('%sWarnings=0x%02x,%r' % (self.name,
-                                                     warningWord, 'OK'))
-            if len(errors) > 0:
-                cmd.warn('%sErrors=0x%02x,%r' % (self.name,
-                                                 errorWord, ','.join(errors)))
-            else:
-                cmd.inform('%sErrors=0x%02x,%r' % (self.name,
-                                                   errorWord, 'OK'))
+            force = not changedOnly
+            if self.publisher.shouldPublish('status', statusWord, force=force):
+                cmd.inform('%sStatus=0x%04x,%r' % (self.name,
+                                                   statusWord, ', '.join(allFlags)))
+            if self.publisher.shouldPublish('warnings', warningWord, force=force):
+                if len(warnings) > 0:
+                    cmd.warn('%sWarnings=0x%02x,%r' % (self.name,
+                                                       warningWord, ','.join(warnings)))
+                else:
+                    cmd.inform('%sWarnings=0x%02x,%r' % (self.name,
+                                                         warningWord, 'OK'))
+            if self.publisher.shouldPublish('errors', errorWord, force=force):
+                if len(errors) > 0:
+                    cmd.warn('%sErrors=0x%02x,%r' % (self.name,
+                                                     errorWord, ','.join(errors)))
+                else:
+                    cmd.inform('%sErrors=0x%02x,%r' % (self.name,
+                                                       errorWord, 'OK'))
             return allFlags
 
+    @defer.inlineCallbacks
     def quickStatus(self, cmd):
         cmdStr = '?V802'
 
-        ret = self.sendOneCommand(cmdStr, cmd=cmd)
-        reply = self.parseReply(cmdStr, ret, cmd=cmd)
+        ret = yield self.sendOneCommand(cmdStr, cmd=cmd)
+        reading = self.decodeReply(cmdStr, ret, cmd=cmd)
 
-        hz = int(reply[0])
-        errorWord = int(reply[4], base=16)
+        hz = reading.speed
+        errorWord = reading.errors
         
         if errorWord == 0:
             status = "OK"
@@ -240,78 +328,178 @@ class pump(object):
 
         return hz, errorWord, status
     
+    def saveReading(self, field, reading):
+        """ Save a new decoded reading in the status cache, the telemetry history and the archive. """
+
+        now = time.time()
+        self.cache.put(field, reading, now)
+
+        if field not in ('speed', 'temps'):
+            return
+        values = reading.asdict()
+
+        self.history.append(values, now)
+        archive = getattr(self.actor, 'archive', None)
+        if archive is not None:
+            archive.append(now, self.name, **values)
+
+    def genSpeedKeys(self, reading, cmd, changedOnly=False):
+        if self.publisher.shouldPublish('speed', reading.speed, force=not changedOnly,
+                                        deadband=self.speedDeadband):
+            cmd.inform('pumpSpeed=%d' % (reading.speed))
+        self.statusWord(reading.words, cmd=cmd, changedOnly=changedOnly)
+
+        return reading
+
+    @defer.inlineCallbacks
     def speed(self, cmd=None):
         cmdStr = '?V802'
 
-        ret = self.sendOneCommand(cmdStr, cmd=cmd)
-        reply = self.parseReply(cmdStr, ret, cmd=cmd)
+        ret = yield self.sendOneCommand(cmdStr, cmd=cmd)
+        reading = self.decodeReply(cmdStr, ret, cmd=cmd)
+        self.saveReading('speed', reading)
 
-        hz = int(reply[0])
-        status = ((int(reply[1], base=16) | (int(reply[2], base=16) << 16)),
-                  int(reply[3], base=16),
-                  int(reply[4], base=16))
-        
+        return self.genSpeedKeys(reading, cmd)
 
-        cmd.inform('pumpSpeed=%d' % (hz))
-        self.statusWord(status, cmd=cmd)
+    @defer.inlineCallbacks
+    def waitForSpeed(self, speedReached, timeout, cmd=None):
+        """ Poll the pump speed on a reactor timer until it satisfies a test.
 
-        return hz, status
+        Each poll generates the pumpSpeed and status keywords.
 
-    def pumpTemp(self, cmd=None):
-        cmdStr = '?V808'
+        Args
+        ----
+        speedReached : callable
+          Called with the speed in Hz, returns True when we are done.
+        timeout : float
+          Give up after this many seconds.
 
-        ret = self.sendOneCommand(cmdStr, cmd=cmd)
-        temps = self.parseReply(cmdStr, ret, cmd=cmd)
+        Returns
+        -------
+        hz : Deferred
+          Fires with the final speed, or fails if the timeout expires.
+        """
 
-        cmd.inform('pumpTemps=%d,%d' % (int(temps[0], base=10),
-                                        int(temps[1], base=10)))
+        if cmd is None:
+            cmd = self.actor.bcast
 
-        return temps
+        t0 = time.time()
+        while True:
+            reading = yield self.speed(cmd=cmd)
+            hz = reading.speed
+            if speedReached(hz):
+                return hz
+            if time.time() - t0 > timeout:
+                raise RuntimeError('pump speed still %d Hz after %gs' % (hz, timeout))
 
-    def pumpLifetimes(self, cmd=None):
+            yield task.deferLater(reactor, self.speedPollPeriod, lambda: None)
 
-        past = []
-        left = []
-        for q in 811, 810, 813:
-            cmdStr = f'?V{q}'
+    def waitForSpinUp(self, cmd=None):
+        """ Return a Deferred which fires when the pump reaches spinUpSpeed. """
 
-            ret = self.sendOneCommand(cmdStr, cmd=cmd)
-            reply = self.parseReply(cmdStr, ret, cmd=cmd)
+        return self.waitForSpeed(lambda hz: hz >= self.spinUpSpeed,
+                                 self.spinUpTimeout, cmd=cmd)
 
-            past.append(int(reply[0], base=10))
-            if q == 813:
-                left.append(int(reply[1], base=10))
-        
-        for q in 814, 815:
-            cmdStr = f'?V{q}'
+    def waitForSpinDown(self, cmd=None):
+        """ Return a Deferred which fires when the pump has stopped. """
 
-            ret = self.sendOneCommand(cmdStr, cmd=cmd)
-            reply = self.parseReply(cmdStr, ret, cmd=cmd)
+        return self.waitForSpeed(lambda hz: hz == 0,
+                                 self.spinDownTimeout, cmd=cmd)
 
-            left.append(int(reply[1], base=10))
+    def genTempKeys(self, temps, cmd, changedOnly=False):
+        motorTemp = temps.motorTemp
+        controllerTemp = temps.controllerTemp
+
+        force = not changedOnly
+        moved = [self.publisher.shouldPublish(key, t, force=force, deadband=self.tempDeadband)
+                 for key, t in (('motorTemp', motorTemp), ('controllerTemp', controllerTemp))]
+        if any(moved):
+            cmd.inform('pumpTemps=%d,%d' % (motorTemp, controllerTemp))
+
+        return temps
+
+    @defer.inlineCallbacks
+    def pumpTemp(self, cmd=None):
+        cmdStr = '?V808'
 
-        cmd.inform('pumpTimes=%d,%d,%d' % tuple(past))
-        cmd.inform('pumpLife=%d,%d,%d' % tuple(left))
+        ret = yield self.sendOneCommand(cmdStr, cmd=cmd)
+        temps = self.decodeReply(cmdStr, ret, cmd=cmd)
+        self.saveReading('temps', temps)
+
+        return self.genTempKeys(temps, cmd)
+
+    lifetimeQueries = ('?V811', '?V810', '?V813', '?V814', '?V815')
+
+    def genLifetimeKeys(self, replies, cmd, changedOnly=False):
+        past = [replies[cmdStr].elapsed for cmdStr in ('?V811', '?V810', '?V813')]
+        left = [replies[cmdStr].left for cmdStr in ('?V813', '?V814', '?V815')]
+
+        if self.publisher.shouldPublish('lifetimes', (past, left), force=not changedOnly):
+            cmd.inform('pumpTimes=%d,%d,%d' % tuple(past))
+            cmd.inform('pumpLife=%s' % ','.join('nan' if t is None else '%d' % t for t in left))
 
         return past, left
-    
-    def status(self, cmd=None):
+
+    @defer.inlineCallbacks
+    def pumpLifetimes(self, cmd=None):
+        replies = yield self.query(self.lifetimeQueries, cmd=cmd)
+        self.saveReading('lifetimes', replies)
+
+        return self.genLifetimeKeys(replies, cmd)
+
+    fieldQueries = dict(speed=('?V802',),
+                        temps=('?V808',),
+                        lifetimes=lifetimeQueries)
+
+    @defer.inlineCallbacks
+    def status(self, cmd=None, fresh=False, changedOnly=False):
+        """ Generate all pump status keywords.
+
+        Only the fields which are older than their cache max age are read
+        from the pump, in one batch.
+
+        Args
+        ----
+        fresh : bool
+          If True, read all fields from the pump.
+        changedOnly : bool
+          If True, only generate the keywords which changed (or left their
+          deadband) since they were last generated, plus periodic heartbeats.
+        """
+        if cmd is None:
+            cmd = self.actor.bcast
+
+        stale = self.cache.staleFields(self.fieldQueries.keys(), fresh=fresh)
+        queries = [q for field in stale for q in self.fieldQueries[field]]
+        if queries:
+            replies = yield self.query(queries, cmd=cmd)
+            for field in stale:
+                if field == 'lifetimes':
+                    self.saveReading(field, {q: replies[q] for q in self.lifetimeQueries})
+                else:
+                    self.saveReading(field, replies[self.fieldQueries[field][0]])
+
         reply = []
 
-        speeds = self.speed(cmd=cmd)
+        speeds = self.genSpeedKeys(self.cache.reading('speed')[0], cmd, changedOnly=changedOnly)
         # VAW = self.pumpVAW(cmd=cmd)
-        temps = self.pumpTemp(cmd=cmd)
-        reply.extend(speeds)
+        temps = self.genTempKeys(self.cache.reading('temps')[0], cmd, changedOnly=changedOnly)
+        reply.append(speeds)
         # reply.extend(VAW)
-        reply.extend(temps)
+        reply.append(temps)
+
+        ret = self.genLifetimeKeys(self.cache.reading('lifetimes')[0], cmd, changedOnly=changedOnly)
+        if self.publisher.heartbeatDue('link', force=not changedOnly):
+            self.cache.genKeys(cmd)
+            self.connection.genKeys(cmd)
 
-        ret = self.pumpLifetimes(cmd)
         return reply
 
+    @defer.inlineCallbacks
     def pumpCmd(self, cmdStr, cmd=None):
         if cmd is None:
             cmd = self.actor.bcast
 
-        ret = self.sendOneCommand(cmdStr, cmd)
+        ret = yield self.sendOneCommand(cmdStr, cmd)
         return ret
 
@@ -0,0 +1,112 @@
+""" Typed decoding of the pump's ?Vnnn query replies into compact records.
+
+Each query has a schema: the record class and the base of each of the
+';'-separated reply fields. A reply is checked and converted once, when it
+arrives, and the record is then what the cache, the history, the archive
+and the keyword generation all use.
+
+    >>> pumpSchema.decode('?V802', ['30', '0C0A', '0000', '0000', '0000'])
+    Speed(speed=30, status=3082, warnings=0, errors=0)
+"""
+
+class Reading(object):
+    """ A decoded reply: a fixed set of typed fields. """
+
+    __slots__ = ()
+
+    def asdict(self):
+        """ The fields, by name, as the history and the archive take them. """
+
+        return {f: getattr(self, f) for f in self.__slots__}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, f) == getattr(other, f)
+                                                 for f in self.__slots__)
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__,
+                           ', '.join('%s=%r' % (f, getattr(self, f)) for f in self.__slots__))
+
+class Speed(Reading):
+    """ ?V802: the rotation speed in Hz, and the status, warning and error words. """
+
+    __slots__ = ('speed', 'status', 'warnings', 'errors')
+
+    def __init__(self, speed, statusLow, statusHigh, warnings, errors):
+        self.speed = speed
+        self.status = statusLow | (statusHigh << 16)
+        self.warnings = warnings
+        self.errors = errors
+
+    @property
+    def words(self):
+        """ The (status, warning, error) words, as pump.statusWord() takes them. """
+
+        return self.status, self.warnings, self.errors
+
+class Temps(Reading):
+    """ ?V808: the motor and controller temperatures, in degC. """
+
+    __slots__ = ('motorTemp', 'controllerTemp')
+
+    def __init__(self, motorTemp, controllerTemp):
+        self.motorTemp = motorTemp
+        self.controllerTemp = controllerTemp
+
+class Lifetime(Reading):
+    """ ?V810-?V815: an elapsed count or time, and what is left until service, if reported. """
+
+    __slots__ = ('elapsed', 'left')
+
+    def __init__(self, elapsed, left=None):
+        self.elapsed = elapsed
+        self.left = left
+
+class Schema(object):
+    """ How to decode the reply to one query.
+
+    Args
+    ----
+    recordClass : Reading subclass
+      Built with one argument per reply field.
+    bases : tuple of int
+      The base of each reply field: 10 or 16.
+    required : int
+      How many of the fields must be present. The others are optional,
+      and fields beyond the bases are ignored. Default is all of them.
+    """
+
+    __slots__ = ('recordClass', 'bases', 'required')
+
+    def __init__(self, recordClass, bases, required=None):
+        self.recordClass = recordClass
+        self.bases = bases
+        self.required = len(bases) if required is None else required
+
+    def decode(self, fields):
+        if len(fields) < self.required or (self.required == len(self.bases)
+                                           and len(fields) != len(self.bases)):
+            raise ValueError('expected %d fields for a %s reply, got %r' % (len(self.bases),
+                                                                           self.recordClass.__name__,
+                                                                           fields))
+        return self.recordClass(*[int(f, base=b) for f, b in zip(fields, self.bases)])
+
+schemas = {'?V802': Schema(Speed, (10, 16, 16, 16, 16)),
+           '?V808': Schema(Temps, (10, 10)),
+           '?V810': Schema(Lifetime, (10, 10), required=1),
+           '?V811': Schema(Lifetime, (10, 10), required=1),
+           '?V813': Schema(Lifetime, (10, 10), required=1),
+           '?V814': Schema(Lifetime, (10, 10), required=1),
+           '?V815': Schema(Lifetime, (10, 10), required=1)}
+
+def decode(cmdStr, fields):
+    """ Decode the split fields of the reply to a query. Queries without a schema keep their fields.
+
+    Raises ValueError if the fields do not match the schema.
+    """
+
+    try:
+        schema = schemas[cmdStr]
+    except KeyError:
+        return fields
+    return schema.decode(fields)
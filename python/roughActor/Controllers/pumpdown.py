@@ -0,0 +1,114 @@
+import math
+from collections import deque
+
+class PumpdownEstimator(object):
+    """ Fit d(ln P)/dt over a sliding window of pressure readings, in O(1) per reading.
+
+    The least-squares line through (t, ln P) is kept as running sums, which
+    readings are added to as they arrive and subtracted from as they leave
+    the window, so no history is ever re-scanned. To keep the sums precise,
+    times are relative to a recent reading; moving that origin is the only
+    pass over the window, once every few windows.
+
+    Args
+    ----
+    window : float
+      How many seconds of readings to fit over.
+    minReadings : int
+      How many readings are needed before there is a rate.
+    """
+
+    def __init__(self, window=60.0, minReadings=3):
+        self.window = window
+        self.minReadings = minReadings
+        self.readings = deque()
+        self._clear()
+
+    def _clear(self):
+        self.readings.clear()
+        self.t0 = None
+        self.n = 0
+        self.St = self.Sy = self.Stt = self.Sty = 0.0
+
+    def add(self, t, pressure):
+        """ Add one reading, and drop the ones which have left the window. """
+
+        if not pressure > 0:
+            return
+
+        if self.t0 is None:
+            self.t0 = t
+        t -= self.t0
+        y = math.log(pressure)
+
+        if t > 10 * self.window:
+            self._rebase(t)
+            t = 0.0
+
+        self.readings.append((t, y))
+        self.n += 1
+        self.St += t
+        self.Sy += y
+        self.Stt += t * t
+        self.Sty += t * y
+
+        while self.readings[0][0] < t - self.window:
+            ot, oy = self.readings.popleft()
+            self.n -= 1
+            self.St -= ot
+            self.Sy -= oy
+            self.Stt -= ot * ot
+            self.Sty -= ot * oy
+
+    def _rebase(self, t):
+        """ Move the time origin to t, and recompute the sums of the readings still in the window. """
+
+        t0 = self.t0 + t
+        old = [(ot - t, oy) for ot, oy in self.readings if ot >= t - self.window]
+        self._clear()
+        self.t0 = t0
+        for ot, oy in old:
+            self.readings.append((ot, oy))
+            self.n += 1
+            self.St += ot
+            self.Sy += oy
+            self.Stt += ot * ot
+            self.Sty += ot * oy
+
+    def fit(self):
+        """ Return (slope, intercept) of ln P against time since t0, or None. """
+
+        if self.n < self.minReadings:
+            return None
+        denom = self.n * self.Stt - self.St * self.St
+        if denom <= 0:
+            return None
+        slope = (self.n * self.Sty - self.St * self.Sy) / denom
+        intercept = (self.Sy - slope * self.St) / self.n
+        return slope, intercept
+
+    def rate(self):
+        """ The fitted d(ln P)/dt, per second. NaN if there are not enough readings. """
+
+        fit = self.fit()
+        return math.nan if fit is None else fit[0]
+
+    def eta(self, target):
+        """ Seconds from the latest reading until the fit reaches target. NaN if it never will.
+
+        0 if the fitted pressure is already at or below the target.
+        """
+
+        fit = self.fit()
+        if fit is None or target is None or not target > 0:
+            return math.nan
+
+        slope, intercept = fit
+        tLast = self.readings[-1][0]
+        yNow = intercept + slope * tLast
+        yTarget = math.log(target)
+        if yNow <= yTarget:
+            return 0.0
+        if slope >= 0:
+            return math.nan
+        return (yTarget - yNow) / slope
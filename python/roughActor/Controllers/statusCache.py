@@ -0,0 +1,75 @@
+import time
+
+class StatusCache(object):
+    """ The latest timestamped readings of a controller's status fields.
+
+    Each field has its own maximum age, after which readers have to go back
+    to the hardware. This lets commands from several clients and the
+    monitor loops share one device query.
+
+    Args
+    ----
+    name : str
+      The controller name, used in keywords.
+    maxAges : dict
+      The maximum age in seconds of each field. The keyword order follows
+      this dict.
+    """
+
+    def __init__(self, name, maxAges):
+        self.name = name
+        self.maxAges = dict(maxAges)
+        self.readings = dict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, field, value, timestamp=None):
+        """ Save a new reading of one field. """
+
+        if timestamp is None:
+            timestamp = time.time()
+        self.readings[field] = (value, timestamp)
+
+    def reading(self, field):
+        """ Return the (value, timestamp) of the last reading of a field, or None. """
+
+        return self.readings.get(field)
+
+    def staleFields(self, fields, fresh=False):
+        """ Return the fields which need to be re-read from the device.
+
+        Args
+        ----
+        fields : list of str
+          The fields which the caller wants.
+        fresh : bool
+          If True, all the fields are stale.
+
+        Returns
+        -------
+        stale : list of str
+        """
+
+        now = time.time()
+        stale = []
+        for field in fields:
+            reading = self.readings.get(field)
+            if fresh or reading is None or now - reading[1] > self.maxAges.get(field, 0.0):
+                stale.append(field)
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return stale
+
+    def genKeys(self, cmd):
+        """ Generate the reading times and the cache hit/miss counts. """
+
+        times = []
+        for field in self.maxAges:
+            reading = self.readings.get(field)
+            times.append('%0.3f' % (reading[1]) if reading is not None else 'nan')
+
+        cmd.inform('%sReadTimes=%s' % (self.name, ','.join(times)))
+        cmd.inform('%sCache=%d,%d' % (self.name, self.hits, self.misses))
@@ -0,0 +1,614 @@
+import heapq
+import itertools
+import logging
+import random
+from collections import deque
+
+from twisted.internet import defer, endpoints, error, protocol, reactor, task
+from twisted.python.failure import Failure
+
+from roughActor.utils import metrics as metricsMod
+from roughActor.utils import trace as traceMod
+from . import breaker
+from . import capture
+from . import framer
+
+class DeviceProtocol(protocol.Protocol):
+    """ The reactor side of a DeviceConnection: splits the byte stream into replies. """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.framer = framer.LineFramer(connection.EOL, maxLength=connection.maxReplyLength)
+
+    def connectionMade(self):
+        self.transport.setTcpKeepAlive(True)
+
+    def dataReceived(self, data):
+        if self.connection.capture is not None:
+            self.connection.capture.record(capture.RECEIVED, data)
+        for reply in self.framer.feed(data):
+            if reply is None:
+                self.connection.replyTooLong()
+            else:
+                self.connection.replyReceived(reply)
+
+    def connectionLost(self, reason):
+        self.connection.connectionLost(self, reason)
+
+class RttEstimator(object):
+    """ Estimate a reply timeout from the observed round-trip times, like TCP's RTO (RFC 6298).
+
+    Args
+    ----
+    initial : float
+      The timeout to use before any reply has been seen, in seconds.
+    minTimeout, maxTimeout : float
+      The bounds on the timeout, in seconds.
+    """
+
+    def __init__(self, initial=1.0, minTimeout=0.2, maxTimeout=2.0):
+        self.minTimeout = minTimeout
+        self.maxTimeout = maxTimeout
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial
+
+    def sample(self, rtt):
+        """ Update the estimate with one measured round-trip time. """
+
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, self.minTimeout), self.maxTimeout)
+
+    def backoff(self):
+        """ Double the timeout after a timeout, until the next good sample. """
+
+        self.rto = min(2 * self.rto, self.maxTimeout)
+
+PRIORITY_CONTROL = 0
+PRIORITY_POLL = 10
+
+class DeviceConnection(object):
+    """ A persistent, non-blocking TCP connection to one device behind a terminal server.
+
+    The connection is opened on first use and kept open between telegrams. It
+    is closed after `idleTimeout` seconds without traffic, and is
+    re-opened on the next exchange when a reused connection turns out to
+    have been dropped. Idempotent telegrams are then transparently re-sent
+    once; the others fail, since the device may already have acted on them.
+
+    The reply timeout follows the observed round-trip times, between
+    minTimeout and maxTimeout. Idempotent exchanges which time out are
+    retried up to `retries` times, after a short random delay. After
+    repeated failures the circuit breaker marks the device offline: exchanges
+    then fail at once with breaker.DeviceOfflineError, while `probeCmd` is
+    sent in the background with exponential backoff until the device answers.
+
+    Exchanges are queued, and only one is outstanding at a time: a monitor
+    poll, an operator query and a raw command never interleave on the
+    device. The queue is ordered by priority, so control commands
+    (PRIORITY_CONTROL) go ahead of queued polls (PRIORITY_POLL), then by
+    arrival. An idempotent exchange identical to one already queued or in
+    flight is not sent again: it gets the same replies.
+
+    All methods must be called from the reactor thread. Several telegrams
+    can be written back-to-back as one exchange, and their replies are
+    matched to them in order.
+
+    Args
+    ----
+    name : str
+      The controller name, used in messages and keywords.
+    host, port : str, int
+      The terminal server address.
+    EOL : bytes
+      The reply terminator.
+    timeout : float
+      Connect timeout, and the reply timeout until replies have been timed, in seconds.
+    minTimeout, maxTimeout : float
+      The bounds on the reply timeout, in seconds.
+    retries : int
+      How many times to retry idempotent exchanges which timed out.
+    probeCmd : bytes
+      A harmless, complete, telegram to check whether an offline device is back.
+    replyKey : callable
+      Optionally, returns what identifies a telegram or a well-formed
+      reply, e.g. its command code, or None for a malformed reply. Replies
+      are then checked against the telegram they are paired with.
+    breakerThreshold : int
+      The number of consecutive failed exchanges which marks the device offline.
+    maxReplyLength : int
+      The longest acceptable reply, including the EOL.
+    idleTimeout : float
+      Close the connection after this many idle seconds. 0 to never close it.
+    metrics : metrics.Metrics
+      Where to record latencies, errors and byte counts. Default is the
+      actor-wide registry.
+    trace : trace.TraceRing
+      Where to record each exchange. Default is the actor-wide ring.
+    actorName : str
+      The actor the device belongs to, which labels the metrics and the
+      trace, since one process can run several actors.
+    """
+
+    def __init__(self, name, host, port, EOL=b'\r', timeout=1.0, idleTimeout=30.0,
+                 logger=None, metrics=None, trace=None, actorName='',
+                 minTimeout=0.2, maxTimeout=2.0, retries=2,
+                 probeCmd=None, breakerThreshold=3, maxReplyLength=256, replyKey=None):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.EOL = EOL
+        self.timeout = timeout
+        self.rtt = RttEstimator(initial=timeout, minTimeout=minTimeout, maxTimeout=maxTimeout)
+        self.retries = retries
+        self.probeCmd = probeCmd
+        self.replyKey = replyKey
+
+        # If set, called with each (telegram, reply) pair of the exchanges which succeed,
+        # i.e. the pairs the controllers get, e.g. by test harnesses.
+        self.replyListener = None
+        self.maxReplyLength = maxReplyLength
+        self.idleTimeout = idleTimeout
+        self.logger = logger if logger is not None else logging.getLogger(name)
+        self.metrics = metrics if metrics is not None else metricsMod.registry
+        self.trace = trace if trace is not None else traceMod.ring
+        self.actorName = actorName
+        self.labels = dict(actor=actorName, device=name)
+        self.traceActor = actorName.encode('latin-1')
+        self.traceDevice = name.encode('latin-1')
+        if max(len(self.traceActor), len(self.traceDevice)) > traceMod.NAMELEN:
+            raise ValueError('actor and device names must fit in %d bytes to be traced: %s/%s'
+                             % (traceMod.NAMELEN, actorName, name))
+        self.breaker = breaker.CircuitBreaker(name, self._probe, threshold=breakerThreshold,
+                                              logger=self.logger)
+
+        self.protocol = None
+        self.connectWaiters = []
+        self.pending = deque()
+        self.idleCall = None
+
+        # Queued exchanges: heap of (priority, sequence, job), and jobs by telegrams.
+        self.queue = []
+        self.sequence = itertools.count()
+        self.jobs = dict()
+        self.busy = False
+
+        # When set, a capture.TrafficCapture recording all traffic.
+        self.capture = None
+
+        self.connects = 0
+        self.reuses = 0
+        self.reconnects = 0
+
+    def connect(self):
+        """ Return a Deferred which fires with the connected protocol. """
+
+        if self.protocol is not None:
+            return defer.succeed(self.protocol)
+
+        d = defer.Deferred()
+        self.connectWaiters.append(d)
+        if len(self.connectWaiters) == 1:
+            endpoint = endpoints.TCP4ClientEndpoint(reactor, self.host, self.port,
+                                                    timeout=self.timeout)
+            connecting = endpoints.connectProtocol(endpoint, DeviceProtocol(self))
+            connecting.addCallbacks(self._connected, self._connectFailed)
+
+        return d
+
+    def _connected(self, proto):
+        self.protocol = proto
+        self.connects += 1
+        self.logger.info('connected to %s:%s', self.host, self.port)
+
+        waiters, self.connectWaiters = self.connectWaiters, []
+        for d in waiters:
+            d.callback(proto)
+
+    def _connectFailed(self, failure):
+        waiters, self.connectWaiters = self.connectWaiters, []
+        for d in waiters:
+            d.errback(failure)
+
+    def startCapture(self, path):
+        """ Start recording all traffic to a capture file. See capture.py """
+
+        self.stopCapture()
+        self.capture = capture.TrafficCapture(path, self.name)
+        self.logger.info('capturing %s traffic to %s', self.name, path)
+
+    def stopCapture(self):
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+
+    def close(self):
+        """ Drop the connection, if it is open. """
+
+        if self.protocol is not None:
+            self.protocol.transport.loseConnection()
+
+    def shutdown(self):
+        """ Close the connection for good: stop probing and capturing. """
+
+        self.breaker.stop()
+        self.stopCapture()
+        self.close()
+
+    def connectionLost(self, proto, reason):
+        if proto is not self.protocol:
+            return
+
+        self.logger.info('connection to %s closed: %s', self.name, reason.getErrorMessage())
+        self.protocol = None
+        if self.capture is not None:
+            self.capture.record(capture.RESET, b'')
+        self._cancelIdle()
+
+        pending, self.pending = self.pending, deque()
+        for entry in pending:
+            d, timeoutCall, _, _ = entry
+            if timeoutCall is not None and timeoutCall.active():
+                timeoutCall.cancel()
+            d.errback(reason)
+
+    def replyReceived(self, reply):
+        if not self.pending:
+            self.logger.warning('dropping unexpected reply from %s: %r', self.name, reply)
+            self.metrics.incr('device_unexpected_replies_total', **self.labels)
+            return
+
+        self.metrics.incr('device_bytes_received_total', len(reply), **self.labels)
+
+        d, timeoutCall, armedAt, telegram = self.pending.popleft()
+        timeoutCall.cancel()
+        if self.replyKey is not None:
+            self._checkReply(telegram, reply)
+        self.rtt.sample(reactor.seconds() - armedAt)
+        if self.pending:
+            self._armTimeout()
+        else:
+            self._startIdle()
+        d.callback(reply)
+
+    def replyTooLong(self):
+        """ Fail the oldest outstanding telegram, whose reply overflowed the framer. """
+
+        self.metrics.incr('device_overflows_total', **self.labels)
+        if not self.pending:
+            self.logger.warning('dropping unexpected, overlong, reply from %s', self.name)
+            return
+
+        d, timeoutCall, _, _ = self.pending.popleft()
+        timeoutCall.cancel()
+        if self.pending:
+            self._armTimeout()
+        d.errback(ValueError('reply from %s is longer than %d bytes' % (self.name,
+                                                                         self.maxReplyLength)))
+
+    def _checkReply(self, telegram, reply):
+        """ Count the replies which are malformed, or well-formed but for another telegram. """
+
+        key = self.replyKey(reply)
+        if key is None:
+            self.metrics.incr('device_malformed_replies_total', **self.labels)
+        elif key != self.replyKey(telegram):
+            self.logger.warning('reply from %s to %r is for another telegram: %r',
+                                self.name, telegram, reply)
+            self.metrics.incr('device_mismatched_replies_total', **self.labels)
+
+    def _armTimeout(self):
+        """ Start the reply timer for the oldest outstanding telegram. """
+
+        entry = self.pending[0]
+        if entry[1] is None:
+            entry[1] = reactor.callLater(self.rtt.rto, self._timedOut, self.rtt.rto)
+            entry[2] = reactor.seconds()
+
+    def _timedOut(self, timeout):
+        d, _, _, _ = self.pending.popleft()
+        self.rtt.backoff()
+
+        # The device might still answer, so we can no longer pair replies with telegrams.
+        if self.protocol is not None:
+            self.protocol.transport.abortConnection()
+        d.errback(error.TimeoutError('no reply from %s within %0.2fs' % (self.name, timeout)))
+
+    def _startIdle(self):
+        self._cancelIdle()
+        if self.idleTimeout > 0:
+            self.idleCall = reactor.callLater(self.idleTimeout, self._idle)
+
+    def _cancelIdle(self):
+        if self.idleCall is not None and self.idleCall.active():
+            self.idleCall.cancel()
+        self.idleCall = None
+
+    def _idle(self):
+        self.idleCall = None
+        self.logger.info('closing idle connection to %s', self.name)
+        self.close()
+
+    def _send(self, fullCmds):
+        """ Write telegrams back-to-back, return a Deferred firing with the list of replies. """
+
+        self._cancelIdle()
+
+        replies = []
+        for fullCmd in fullCmds:
+            d = defer.Deferred()
+            self.pending.append([d, None, None, fullCmd])
+            replies.append(d)
+        self._armTimeout()
+        data = b''.join(fullCmds)
+        if self.capture is not None:
+            self.capture.record(capture.SENT, data)
+        self.protocol.transport.write(data)
+        self.metrics.incr('device_bytes_sent_total', len(data), **self.labels)
+
+        d = defer.gatherResults(replies, consumeErrors=True)
+        d.addCallbacks(self._delivered, lambda failure: failure.value.subFailure,
+                       callbackArgs=(fullCmds,))
+        return d
+
+    def _delivered(self, replies, fullCmds):
+        if self.replyListener is not None:
+            for fullCmd, reply in zip(fullCmds, replies):
+                self.replyListener(fullCmd, reply)
+        return replies
+
+    def exchange(self, fullCmd, cmd, label=None, idempotent=False, priority=None):
+        """ Send one complete telegram and return a Deferred which fires with the raw reply.
+
+        Args
+        ----
+        fullCmd : bytes
+          The telegram, including its EOL.
+        cmd : Command
+          Where to send warnings.
+        label : str
+          What to record the latency under. Default is 'other'.
+        idempotent : bool
+          Whether the telegram can safely be sent again if it times out,
+          or shared with an identical one.
+        priority : int
+          Lower goes first. Default is PRIORITY_POLL for idempotent
+          telegrams, PRIORITY_CONTROL for others.
+
+        Returns
+        -------
+        reply : bytes
+        """
+
+        d = self.exchangeMany([fullCmd], cmd, label=label, idempotent=idempotent, priority=priority)
+        d.addCallback(lambda replies: replies[0])
+        return d
+
+    def exchangeMany(self, fullCmds, cmd, label=None, idempotent=False, priority=None):
+        """ Send several telegrams back-to-back, and return a Deferred which fires with all replies.
+
+        The reply timeout applies to each reply in turn, measured from the
+        previous reply.
+
+        Args
+        ----
+        fullCmds : list of bytes
+          The telegrams, each including its EOL.
+        cmd : Command
+          Where to send warnings.
+        label : str
+          What to record the latency under. Default is 'other'.
+        idempotent : bool
+          Whether the telegrams can safely be sent again if they time out,
+          or shared with identical ones.
+        priority : int
+          Lower goes first. Default is PRIORITY_POLL for idempotent
+          telegrams, PRIORITY_CONTROL for others.
+
+        Returns
+        -------
+        replies : list of bytes
+          The raw replies, in the order they arrived.
+        """
+
+        if label is None:
+            label = 'other'
+        if priority is None:
+            priority = PRIORITY_POLL if idempotent else PRIORITY_CONTROL
+
+        if self.breaker.isOpen:
+            self.metrics.incr('device_rejected_total', command=label, **self.labels)
+            return defer.fail(breaker.DeviceOfflineError('%s is offline: not sending' % (self.name)))
+
+        key = tuple(fullCmds)
+        if idempotent and key in self.jobs:
+            self.metrics.incr('device_coalesced_total', command=label, **self.labels)
+            job = self.jobs[key]
+        else:
+            job = dict(fullCmds=fullCmds, cmd=cmd, label=label, idempotent=idempotent,
+                       waiters=[], queuedAt=reactor.seconds())
+            if idempotent:
+                self.jobs[key] = job
+            heapq.heappush(self.queue, (priority, next(self.sequence), job))
+            reactor.callLater(0, self._runNext)
+
+        d = defer.Deferred()
+        job['waiters'].append(d)
+        return d
+
+    def _runNext(self):
+        """ Start the next queued exchange, if none is running. """
+
+        if self.busy or not self.queue:
+            return
+        _, _, job = heapq.heappop(self.queue)
+        self.busy = True
+
+        label = job['label']
+        self.metrics.observe('device_queue_seconds', reactor.seconds() - job['queuedAt'],
+                             **self.labels)
+        if self.breaker.isOpen and label != 'probe':
+            self.metrics.incr('device_rejected_total', command=label, **self.labels)
+            d = defer.fail(breaker.DeviceOfflineError('%s is offline: not sending' % (self.name)))
+        else:
+            d = self._runJob(job)
+        d.addBoth(self._jobDone, job)
+
+    def _jobDone(self, ret, job):
+        self.jobs.pop(tuple(job['fullCmds']), None)
+        self.busy = False
+        reactor.callLater(0, self._runNext)
+
+        for d in job['waiters']:
+            if isinstance(ret, Failure):
+                d.errback(ret)
+            else:
+                d.callback(list(ret))
+
+    def _runJob(self, job):
+        """ Run one exchange, recording its latency and outcome. """
+
+        label = job['label']
+        request = b''.join(job['fullCmds'])
+        t0 = reactor.seconds()
+
+        def recordLatency(ret):
+            dt = reactor.seconds() - t0
+            reply = b''.join(ret)
+            self.metrics.observe('device_latency_seconds', dt,
+                                 command=label, **self.labels)
+            self.trace.record(self.traceActor, self.traceDevice, request, reply, dt)
+            if self.actorName in self.trace.diagActors:
+                self._traceDiag(job['cmd'], 'text="%s sent %r, received %r in %0.4fs"'
+                                % (self.name, request, reply, dt))
+            self.breaker.succeeded()
+            return ret
+
+        def recordError(failure):
+            dt = reactor.seconds() - t0
+            if failure.check(error.TimeoutError):
+                self.metrics.incr('device_timeouts_total', command=label, **self.labels)
+                status = traceMod.TIMEOUT
+            else:
+                self.metrics.incr('device_errors_total', command=label, **self.labels)
+                status = traceMod.ERROR
+            self.trace.record(self.traceActor, self.traceDevice, request, b'', dt, status)
+            if self.actorName in self.trace.diagActors:
+                self._traceDiag(job['cmd'], 'text="%s sent %r, failed after %0.4fs: %s"'
+                                % (self.name, request, dt, failure.getErrorMessage()))
+            wasOpen = self.breaker.isOpen
+            self.breaker.failed()
+            if self.breaker.isOpen and not wasOpen:
+                self._warn(job['cmd'], '%s marked offline after %d failures'
+                           % (self.name, self.breaker.failures))
+            return failure
+
+        d = self._exchangeRetrying(job['fullCmds'], job['cmd'], label, job['idempotent'])
+        d.addCallbacks(recordLatency, recordError)
+        return d
+
+    def _traceDiag(self, cmd, text):
+        """ Generate one exchange's diag keyword, only while the trace ring asks for them. """
+
+        self.logger.info(text)
+        if cmd is not None:
+            cmd.diag(text)
+
+    @defer.inlineCallbacks
+    def _exchangeRetrying(self, fullCmds, cmd, label, idempotent):
+        """ Run _exchangeMany, retrying timeouts after random delays if that is safe. """
+
+        attempt = 0
+        while True:
+            lastAttempt = not idempotent or attempt >= self.retries
+            try:
+                ret = yield self._exchangeMany(fullCmds, cmd, idempotent=idempotent,
+                                               lastAttempt=lastAttempt)
+                return ret
+            except error.TimeoutError:
+                if lastAttempt:
+                    raise
+            attempt += 1
+            self.metrics.incr('device_retries_total', command=label, **self.labels)
+            delay = random.uniform(0, 0.05 * 2 ** attempt)
+            self.logger.info('retrying %s %s in %0.3fs', self.name, label, delay)
+            yield task.deferLater(reactor, delay, lambda: None)
+
+    def _warn(self, cmd, text):
+        self.logger.info(text)
+        if cmd is not None:
+            cmd.warn('text="%s"' % (text))
+
+    def _attemptFailed(self, cmd, text, e, lastAttempt):
+        """ Warn about a failed exchange, unless it is a timeout which will be retried. """
+
+        if lastAttempt or not isinstance(e, error.TimeoutError):
+            self._warn(cmd, text)
+        else:
+            self.logger.info(text)
+
+    def _probe(self):
+        """ Check whether an offline device answers, for the circuit breaker. """
+
+        if self.probeCmd is None:
+            return self.connect()
+
+        job = dict(fullCmds=[self.probeCmd], cmd=None, label='probe', idempotent=False,
+                   waiters=[], queuedAt=reactor.seconds())
+        d = defer.Deferred()
+        job['waiters'].append(d)
+        heapq.heappush(self.queue, (PRIORITY_CONTROL, next(self.sequence), job))
+        self._runNext()
+        return d
+
+    @defer.inlineCallbacks
+    def _exchangeMany(self, fullCmds, cmd, idempotent=False, lastAttempt=True):
+
+        reused = self.protocol is not None
+        try:
+            yield self.connect()
+        except Exception as e:
+            self._attemptFailed(cmd, 'failed to connect to %s: %s' % (self.name, e), e, lastAttempt)
+            raise
+
+        try:
+            ret = yield self._send(fullCmds)
+        except (error.ConnectionLost, error.ConnectionDone) as e:
+            if not reused or not idempotent:
+                # The device may have acted on the telegrams: only the caller can resend them.
+                self._warn(cmd, 'failed to send to or read from %s: %s' % (self.name, e))
+                raise
+
+            # The terminal server may have dropped an idle connection: reconnect and retry once.
+            self.logger.info('reconnecting to %s after %s', self.name, e)
+            self.reconnects += 1
+            reused = False
+            try:
+                yield self.connect()
+                ret = yield self._send(fullCmds)
+            except Exception as e:
+                self._attemptFailed(cmd, 'failed to send to or read from %s: %s' % (self.name, e),
+                                    e, lastAttempt)
+                raise
+        except Exception as e:
+            self._attemptFailed(cmd, 'failed to read response from %s: %s' % (self.name, e),
+                                e, lastAttempt)
+            raise
+
+        if reused:
+            self.reuses += 1
+
+        return ret
+
+    def genKeys(self, cmd):
+        """ Generate the connection keyword: connects, reuses, reconnects, reply timeout; and the breaker keyword. """
+
+        cmd.inform('%sConnection=%d,%d,%d,%0.3f' % (self.name,
+                                                    self.connects, self.reuses, self.reconnects,
+                                                    self.rtt.rto))
+        self.breaker.genKeys(cmd)
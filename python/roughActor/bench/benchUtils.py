@@ -0,0 +1,82 @@
+import time
+
+from twisted.internet import defer
+
+def percentile(sortedVals, pct):
+    """ Return the pct percentile of an already sorted list, by nearest rank. """
+
+    if not sortedVals:
+        return float('nan')
+    i = int(round(pct / 100.0 * (len(sortedVals) - 1)))
+    return sortedVals[i]
+
+class Timings(object):
+    """ Latencies and error counts for one benchmarked operation. """
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.t0 = None
+        self.t1 = None
+
+    def start(self):
+        self.t0 = time.perf_counter()
+
+    def stop(self):
+        self.t1 = time.perf_counter()
+
+    def add(self, latency):
+        self.latencies.append(latency)
+
+    def summary(self):
+        """ Return (count, errors, p50 ms, p99 ms, max ms, ops/s). """
+
+        lats = sorted(self.latencies)
+        elapsed = (self.t1 - self.t0) if self.t1 is not None else float('nan')
+        ops = len(lats) + self.errors
+        return (len(lats), self.errors,
+                1000 * percentile(lats, 50), 1000 * percentile(lats, 99),
+                1000 * (lats[-1] if lats else float('nan')),
+                ops / elapsed if elapsed > 0 else float('nan'))
+
+    header = '%-32s %7s %6s %10s %10s %10s %10s' % ('operation', 'n', 'errs',
+                                                    'p50(ms)', 'p99(ms)', 'max(ms)', 'ops/s')
+
+    def format(self):
+        return '%-32s %7d %6d %10.3f %10.3f %10.3f %10.1f' % ((self.name,) + self.summary())
+
+@defer.inlineCallbacks
+def timeDeferred(name, func, count):
+    """ Call a Deferred-returning function count times in sequence, timing each call. """
+
+    timings = Timings(name)
+    timings.start()
+    for i in range(count):
+        t0 = time.perf_counter()
+        try:
+            yield func()
+        except Exception:
+            timings.errors += 1
+            continue
+        timings.add(time.perf_counter() - t0)
+    timings.stop()
+
+    return timings
+
+def timeCall(name, func, count):
+    """ Call a plain function count times, timing each call. """
+
+    timings = Timings(name)
+    timings.start()
+    for i in range(count):
+        t0 = time.perf_counter()
+        try:
+            func()
+        except Exception:
+            timings.errors += 1
+            continue
+        timings.add(time.perf_counter() - t0)
+    timings.stop()
+
+    return timings
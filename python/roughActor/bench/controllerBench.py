@@ -0,0 +1,119 @@
+""" Latency and throughput of the controller methods, against the local simulators.
+
+Run with:  python -m roughActor.bench.controllerBench [--count N] [--latency S] ...
+"""
+
+import logging
+
+from twisted.internet import defer, reactor
+
+from roughActor.sim import runSims
+from . import benchUtils
+
+def runCommand(actor, cmdStr):
+    """ Dispatch a command, returning a Deferred which fails if the command does. """
+
+    def checkFailed(cmd):
+        if cmd.failed:
+            raise RuntimeError('%r failed' % (cmdStr))
+        return cmd
+
+    cmd = actor.runCommand(cmdStr, record=False)
+    return cmd.done.addCallback(checkFailed)
+
+def deviceOps(actor):
+    """ The benchmarked device operations: (name, Deferred-returning function). """
+
+    pump = actor.controllers['pump']
+    gauge = actor.controllers['gauge']
+    cmd = actor.bcast
+
+    return [('pump.ident', lambda: pump.ident(cmd=cmd)),
+            ('pump.speed', lambda: pump.speed(cmd=cmd)),
+            ('pump.pumpTemp', lambda: pump.pumpTemp(cmd=cmd)),
+            ('pump.pumpLifetimes', lambda: pump.pumpLifetimes(cmd=cmd)),
+            ('pump.status(fresh)', lambda: pump.status(cmd=cmd, fresh=True)),
+            ('pump.status(cached)', lambda: pump.status(cmd=cmd)),
+            ('gauge.readPressure', lambda: gauge.readPressure(cmd=cmd)),
+            ('gauge.status(fresh)', lambda: gauge.status(cmd=cmd, fresh=True)),
+            ('gauge.status(cached)', lambda: gauge.status(cmd=cmd)),
+            ('cmd: pump status fresh', lambda: runCommand(actor, 'pump status fresh')),
+            ('cmd: gauge status fresh', lambda: runCommand(actor, 'gauge status fresh')),
+            ('cmd: status fresh', lambda: runCommand(actor, 'status fresh'))]
+
+def parseOps(actor, gaugeSim):
+    """ The benchmarked pure parsing operations: (name, function). """
+
+    pump = actor.controllers['pump']
+    gauge = actor.controllers['gauge']
+
+    pressureReply = gaugeSim.reply(gauge.makePressureCmd())
+    pressureVal = gauge.parseResponse(pressureReply)
+    pressureBatch = [pressureReply] * 1000
+    speedReply = '=V802 30;0C0A;0000;0000;0000\r'
+
+    return [('Pfeiffer.parseResponse', lambda: gauge.parseResponse(pressureReply)),
+            ('Pfeiffer.parsePressure', lambda: gauge.parsePressure(pressureVal)),
+            ('Pfeiffer.parsePressures(x1000)', lambda: gauge.parsePressures(pressureBatch)),
+            ('Pfeiffer.makePressureCmd', gauge.makePressureCmd),
+            ('pump.parseReply', lambda: pump.parseReply('?V802', speedReply)),
+            ('pump.decodeReply', lambda: pump.decodeReply('?V802', speedReply)),
+            ('pump.statusWord', lambda: pump.statusWord((0x0C0A, 0, 0))),
+            ]
+
+@defer.inlineCallbacks
+def runBench(args):
+    actor, pumpSim, gaugeSim = runSims.startSimActor(latency=args.latency, jitter=args.jitter,
+                                                     dropRate=args.dropRate,
+                                                     corruptRate=args.corruptRate,
+                                                     splitRate=args.splitRate,
+                                                     seed=args.seed)
+    for c in actor.controllers.values():
+        c.logger.setLevel(args.logLevel)
+
+    results = []
+    try:
+        for name, func in deviceOps(actor):
+            timings = yield benchUtils.timeDeferred(name, func, args.count)
+            results.append(timings)
+        for name, func in parseOps(actor, gaugeSim):
+            results.append(benchUtils.timeCall(name, func, args.count * 100))
+    finally:
+        for c in actor.controllers.values():
+            c.stop()
+
+    print(benchUtils.Timings.header)
+    for timings in results:
+        print(timings.format())
+    print('simulators: pump %d requests (%d dropped, %d corrupted); gauge %d requests (%d dropped, %d corrupted)'
+          % (pumpSim.requests, pumpSim.dropped, pumpSim.corrupted,
+             gaugeSim.requests, gaugeSim.dropped, gaugeSim.corrupted))
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='benchmark the pump and gauge controllers')
+    parser.add_argument('--count', type=int, default=200,
+                        help='calls per device operation')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='simulated reply latency, in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--dropRate', type=float, default=0.0)
+    parser.add_argument('--corruptRate', type=float, default=0.0)
+    parser.add_argument('--splitRate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--logLevel', type=int, default=logging.WARNING)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.logLevel)
+
+    def run():
+        d = runBench(args)
+        d.addErrback(lambda f: print(f.getTraceback()))
+        d.addBoth(lambda _: reactor.stop())
+
+    reactor.callWhenRunning(run)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
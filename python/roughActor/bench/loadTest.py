@@ -0,0 +1,239 @@
+""" Drive the actor's command handlers with several concurrent command streams.
+
+Each client sends commands from the mix back-to-back, with an optional
+random think time, against a SimActor with the TopCmd and RoughCmd command
+sets and the local device simulators. At the end we report:
+
+  - the completion latency and throughput of each command,
+  - reactor stalls: how late a 10ms timer fired, when later than --stallThreshold,
+  - the device link counters: errors, timeouts, retries, coalesced, unexpected,
+    malformed and mismatched replies,
+  - corruption: the replies the simulators damaged on purpose,
+  - interleaving errors: replies which the transport delivered for another
+    telegram than the one the simulator answered with them.
+
+The exit status is 1 if there were any interleaving errors, so the test
+can gate a deployment. Run with:
+
+  python -m roughActor.bench.loadTest [--clients N] [--duration S] [--latency S] ...
+"""
+
+import logging
+import random
+import sys
+import time
+
+from twisted.internet import defer, reactor, task
+
+from roughActor.sim import runSims
+from roughActor.utils import metrics
+from roughActor.utils.deferredCmd import sleep
+from . import benchUtils
+
+defaultMix = ('status',
+              'pump status',
+              'gauge status',
+              'pump status fresh',
+              'gauge status fresh',
+              'monitor controllers=pump,gauge period=1')
+
+# The device counters to report.
+deviceCounters = ('device_errors_total', 'device_timeouts_total', 'device_retries_total',
+                  'device_coalesced_total', 'device_rejected_total',
+                  'device_unexpected_replies_total', 'device_malformed_replies_total',
+                  'device_mismatched_replies_total')
+
+class StallMonitor(object):
+    """ Measure how late a short periodic timer fires, to find the reactor being blocked. """
+
+    def __init__(self, interval=0.01, threshold=0.05):
+        self.interval = interval
+        self.threshold = threshold
+        self.lateness = []
+        self.stalls = 0
+        self.loop = task.LoopingCall(self.tick)
+        self.last = None
+
+    def start(self):
+        self.last = time.perf_counter()
+        self.loop.start(self.interval, now=False)
+
+    def stop(self):
+        if self.loop.running:
+            self.loop.stop()
+
+    def tick(self):
+        now = time.perf_counter()
+        late = now - self.last - self.interval
+        self.last = now
+        self.lateness.append(late)
+        if late > self.threshold:
+            self.stalls += 1
+
+    def format(self):
+        lats = sorted(self.lateness)
+        return ('reactor: %d ticks, %d stalls > %0.0fms; lateness p50 %0.2fms, p99 %0.2fms, max %0.2fms'
+                % (len(lats), self.stalls, 1000 * self.threshold,
+                   1000 * benchUtils.percentile(lats, 50), 1000 * benchUtils.percentile(lats, 99),
+                   1000 * (lats[-1] if lats else float('nan'))))
+
+class LoadResults(object):
+    """ The per-command timings, failures and interleaving errors of all the clients.
+
+    A reply is an interleaving error when the transport delivers it, as
+    part of an exchange which succeeded, for a telegram the simulator did
+    not send it in answer to. Corrupted replies are not: the simulator
+    records them as it sent them.
+    """
+
+    def __init__(self, mix):
+        self.timings = {cmdStr: benchUtils.Timings('cmd: %s' % (cmdStr)) for cmdStr in mix}
+        self.total = benchUtils.Timings('all commands')
+        self.failures = []
+        self.interleavings = []
+
+    def start(self):
+        for t in list(self.timings.values()) + [self.total]:
+            t.start()
+
+    def stop(self):
+        for t in list(self.timings.values()) + [self.total]:
+            t.stop()
+
+    def pairChecker(self, name, sim):
+        """ Return a connection replyListener which checks its pairs against what sim answered. """
+
+        def check(telegram, reply):
+            key = telegram.rstrip(sim.EOL), reply.rstrip(sim.EOL)
+            if sim.answered[key] > 0:
+                sim.answered[key] -= 1
+            else:
+                self.interleavings.append((name, telegram, reply))
+
+        return check
+
+    def add(self, cmdStr, cmd, latency):
+        if cmd.failed:
+            self.timings[cmdStr].errors += 1
+            self.total.errors += 1
+            self.failures.append((cmdStr, cmd.replies[-1][1] if cmd.replies else ''))
+        else:
+            self.timings[cmdStr].add(latency)
+            self.total.add(latency)
+
+@defer.inlineCallbacks
+def client(actor, mix, deadline, think, rng, results):
+    """ Send commands from the mix, in a random order, until the deadline. """
+
+    while time.perf_counter() < deadline:
+        cmdStr = rng.choice(mix)
+        t0 = time.perf_counter()
+        cmd = actor.runCommand(cmdStr)
+        yield cmd.done
+        results.add(cmdStr, cmd, time.perf_counter() - t0)
+        if think > 0:
+            yield sleep(rng.uniform(0, 2 * think))
+
+@defer.inlineCallbacks
+def runLoad(args):
+    actor, pumpSim, gaugeSim = runSims.startSimActor(name='loadTest', latency=args.latency,
+                                                     jitter=args.jitter,
+                                                     dropRate=args.dropRate,
+                                                     corruptRate=args.corruptRate,
+                                                     splitRate=args.splitRate,
+                                                     seed=args.seed)
+    for c in actor.controllers.values():
+        c.logger.setLevel(args.logLevel)
+    metrics.registry.reset(actor=actor.name)
+
+    mix = args.mix if args.mix else defaultMix
+    results = LoadResults(mix)
+    for name, sim in (('pump', pumpSim), ('gauge', gaugeSim)):
+        actor.controllers[name].connection.replyListener = results.pairChecker(name, sim)
+    stalls = StallMonitor(threshold=args.stallThreshold / 1000.0)
+
+    stalls.start()
+    results.start()
+    deadline = time.perf_counter() + args.duration
+    try:
+        yield defer.gatherResults([client(actor, mix, deadline, args.think,
+                                          random.Random(args.seed + i), results)
+                                   for i in range(args.clients)],
+                                  consumeErrors=True)
+    finally:
+        results.stop()
+        stalls.stop()
+        for name in actor.controllers:
+            actor.scheduler.setPeriod(name, 0)
+        for c in actor.controllers.values():
+            c.stop()
+
+    print('%d clients for %0.1fs' % (args.clients, args.duration))
+    print(benchUtils.Timings.header)
+    for cmdStr in mix:
+        print(results.timings[cmdStr].format())
+    print(results.total.format())
+    print(stalls.format())
+
+    counters = {name: 0 for name in deviceCounters}
+    for (name, labels), value in metrics.registry.counters.items():
+        if name in counters and dict(labels).get('actor') == actor.name:
+            counters[name] += value
+    print('devices: %s' % (', '.join('%s=%d' % (name[len('device_'):-len('_total')], counters[name])
+                                      for name in deviceCounters)))
+    print('simulators: pump %d requests (%d dropped, %d corrupted); gauge %d requests (%d dropped, %d corrupted)'
+          % (pumpSim.requests, pumpSim.dropped, pumpSim.corrupted,
+             gaugeSim.requests, gaugeSim.dropped, gaugeSim.corrupted))
+    print('corruption: %d replies corrupted by the simulators, %d malformed replies detected'
+          % (pumpSim.corrupted + gaugeSim.corrupted, counters['device_malformed_replies_total']))
+
+    for cmdStr, response in results.failures[:args.showErrors]:
+        print('  failed %r: %s' % (cmdStr, response))
+    print('%d interleaving errors' % (len(results.interleavings)))
+    for name, telegram, reply in results.interleavings[:args.showErrors]:
+        print('  %s: %r paired with %r' % (name, telegram, reply))
+
+    return len(results.interleavings)
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='load test the actor command handlers')
+    parser.add_argument('--clients', type=int, default=8,
+                        help='number of concurrent command streams')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='how long to run, in seconds')
+    parser.add_argument('--think', type=float, default=0.0,
+                        help='mean random pause between a client\'s commands, in seconds')
+    parser.add_argument('--mix', type=str, nargs='+',
+                        help='the commands to choose from. Default is %s' % (', '.join(defaultMix)))
+    parser.add_argument('--stallThreshold', type=float, default=50.0,
+                        help='how late a timer must fire to count as a reactor stall, in ms')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='simulated reply latency, in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--dropRate', type=float, default=0.0)
+    parser.add_argument('--corruptRate', type=float, default=0.0)
+    parser.add_argument('--splitRate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--showErrors', type=int, default=10,
+                        help='how many failures and interleaving errors to list')
+    parser.add_argument('--logLevel', type=int, default=logging.WARNING)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.logLevel)
+
+    status = []
+    def run():
+        d = runLoad(args)
+        d.addCallback(status.append)
+        d.addErrback(lambda f: print(f.getTraceback()))
+        d.addBoth(lambda _: reactor.stop())
+
+    reactor.callWhenRunning(run)
+    reactor.run()
+
+    sys.exit(0 if status == [0] else 1)
+
+if __name__ == '__main__':
+    main()
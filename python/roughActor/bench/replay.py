@@ -0,0 +1,148 @@
+""" Replay captured device traffic through the controller parsers.
+
+A capture (see Controllers/capture.py) is re-framed exactly as the
+transport would have framed it, each reply is paired with the telegram it
+answered, and the pair is fed through the same code the controllers use:
+
+  pump  : pump.decodeReply(), then statusWord() for ?V802
+  gauge : Pfeiffer.parseTelegram(), the bus ID check, then parsePressure() for 740
+
+Replies which fail are listed with their capture times, so a production
+failure can be turned into a regression case. Run with:
+
+  python -m roughActor.bench.replay pump.cap --device pump [--realtime] [--repeat N]
+"""
+
+import time
+
+from roughActor.Controllers import capture
+from roughActor.Controllers import framer
+from roughActor.sim import simActor
+
+class ReplayCmd(simActor.SimCmd):
+    """ Collect the warnings the parsers generate, without keeping the informational replies. """
+
+    def __init__(self):
+        simActor.SimCmd.__init__(self, record=False)
+        self.warnings = []
+
+    def warn(self, response=''):
+        self.warnings.append(response)
+
+def pairs(path, EOL=b'\r'):
+    """ Yield (time, telegram, reply) for each answered telegram in a capture, in order.
+
+    A telegram whose reply never came is yielded with reply None, when the
+    connection is reset. An overlong reply is yielded as b''.
+    """
+
+    sentFramer = framer.LineFramer(EOL)
+    replyFramer = framer.LineFramer(EOL, maxLength=256)
+    unanswered = []
+
+    for t, kind, data in capture.readCapture(path):
+        if kind == capture.SENT:
+            unanswered.extend(sentFramer.feed(data))
+        elif kind == capture.RECEIVED:
+            for reply in replyFramer.feed(data):
+                if not unanswered:
+                    continue
+                yield t, unanswered.pop(0), b'' if reply is None else reply
+        elif kind in (capture.RESET, capture.START):
+            for telegram in unanswered:
+                yield t, telegram, None
+            unanswered = []
+            sentFramer.reset()
+            replyFramer.reset()
+
+class Replayer(object):
+    """ Feed captured telegram/reply pairs through one controller's parsers.
+
+    Args
+    ----
+    device : str
+      'pump' or 'gauge'.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        actor = simActor.SimActor('replay', {device: dict(host='127.0.0.1', port=0)})
+        self.controller = actor.attachController(device)
+        self.cmd = ReplayCmd()
+
+        self.count = 0
+        self.failures = []
+        self.unanswered = 0
+
+    def decode(self, telegram, reply):
+        """ Parse one reply the way the controller would. Returns the decoded value. """
+
+        if self.device == 'pump':
+            cmdStr = telegram.strip().decode('latin-1')
+            nWarnings = len(self.cmd.warnings)
+            reading = self.controller.decodeReply(cmdStr, reply.decode('latin-1'), cmd=self.cmd)
+            if len(self.cmd.warnings) > nWarnings:
+                raise ValueError(self.cmd.warnings[-1])
+            if cmdStr == '?V802':
+                self.controller.statusWord(reading.words, cmd=self.cmd)
+            return reading
+        else:
+            gauge = self.controller
+            busID, valStr = gauge.parseTelegram(reply, cmdCode=int(telegram[5:8]))
+            if busID != int(telegram[:3]):
+                raise ValueError('reply from bus ID %d to a telegram for %d' % (busID, int(telegram[:3])))
+            if int(telegram[5:8]) == 740:
+                return gauge.parsePressure(valStr)
+            return valStr
+
+    def replay(self, path, realtime=False):
+        """ Replay one capture file. With realtime, pace the replies as they were captured. """
+
+        t0 = None
+        start = time.monotonic()
+        for t, telegram, reply in pairs(path, EOL=self.controller.EOL):
+            if realtime:
+                if t0 is None:
+                    t0 = t
+                delay = (t - t0) - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+
+            if reply is None:
+                self.unanswered += 1
+                continue
+            self.count += 1
+            try:
+                self.decode(telegram, reply)
+            except Exception as e:
+                self.failures.append((t, telegram, reply, str(e)))
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='replay captured device traffic through the parsers')
+    parser.add_argument('captures', nargs='+', help='capture files')
+    parser.add_argument('--device', choices=('pump', 'gauge'), required=True)
+    parser.add_argument('--realtime', action='store_true',
+                        help='pace the replay like the capture')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='replay the captures this many times, for throughput')
+    parser.add_argument('--showFailures', type=int, default=20,
+                        help='how many failures to list')
+    args = parser.parse_args(argv)
+
+    replayer = Replayer(args.device)
+    t0 = time.perf_counter()
+    for i in range(args.repeat):
+        for path in args.captures:
+            replayer.replay(path, realtime=args.realtime)
+    elapsed = time.perf_counter() - t0
+
+    print('%d replies, %d failed, %d unanswered telegrams in %0.3fs (%0.0f replies/s)'
+          % (replayer.count, len(replayer.failures), replayer.unanswered,
+             elapsed, replayer.count / elapsed if elapsed > 0 else float('nan')))
+    for t, telegram, reply, err in replayer.failures[:args.showFailures]:
+        print('  t=%0.6f %r -> %r: %s' % (t, telegram, reply, err))
+
+if __name__ == '__main__':
+    main()
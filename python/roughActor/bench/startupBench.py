@@ -0,0 +1,132 @@
+""" Time from actor process launch to the first answered ping, and to connected controllers.
+
+Each run launches a fresh python process which builds a SimActor, attaches
+the controllers in the background like OurActor does, and answers a ping
+as soon as its reactor is running. The parent runs the device simulators.
+
+Run with:  python -m roughActor.bench.startupBench [--count N] [--latency S]
+"""
+
+import os
+import sys
+import time
+
+from twisted.internet import defer, protocol, reactor
+
+from roughActor.sim import runSims
+from . import benchUtils
+
+class ChildProtocol(protocol.ProcessProtocol):
+    """ Timestamp the lines the child prints, relative to its launch. """
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.events = dict()
+        self.buffer = b''
+        self.done = defer.Deferred()
+
+    def outReceived(self, data):
+        now = time.perf_counter() - self.t0
+        self.buffer += data
+        while b'\n' in self.buffer:
+            line, self.buffer = self.buffer.split(b'\n', 1)
+            self.events.setdefault(line.decode('latin-1').strip(), now)
+
+    def errReceived(self, data):
+        sys.stderr.write(data.decode('latin-1'))
+
+    def processEnded(self, reason):
+        self.done.callback(self.events)
+
+@defer.inlineCallbacks
+def runBench(args):
+    pumpSim, gaugeSim = runSims.startSims(latency=args.latency)
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    childArgs = [sys.executable, '-m', 'roughActor.bench.startupBench', '--child',
+                 '--pumpPort', str(pumpSim.port), '--gaugePort', str(gaugeSim.port),
+                 '--runTime', str(args.runTime)]
+
+    names = ('ping', 'pump attached', 'gauge attached', 'pump connected', 'gauge connected')
+    results = {name: benchUtils.Timings('launch -> %s' % (name)) for name in names}
+    for t in results.values():
+        t.start()
+    for i in range(args.count):
+        child = ChildProtocol()
+        reactor.spawnProcess(child, sys.executable, childArgs, env=env)
+        events = yield child.done
+        for name in names:
+            if name in events:
+                results[name].add(events[name])
+            else:
+                results[name].errors += 1
+    for t in results.values():
+        t.stop()
+
+    print(benchUtils.Timings.header)
+    for name in names:
+        print(results[name].format())
+
+def child(args):
+    """ Start a SimActor against the parent's simulators and report the startup milestones. """
+
+    from roughActor.sim import simActor
+    from roughActor.utils import startup
+
+    class EventCmd(simActor.SimCmd):
+        """ Print the startup keywords as they are generated. """
+
+        def _reply(self, flag, response):
+            for name in 'controllerAttached', 'controllerConnected':
+                if response.startswith(name + '='):
+                    controller = response.split('=')[1].split(',')[0]
+                    print('%s %s' % (controller, name[len('controller'):].lower()), flush=True)
+
+    config = dict(controllers=dict(starting=['pump', 'gauge'], all=['pump', 'gauge']),
+                  pump=dict(host='127.0.0.1', port=args.pumpPort),
+                  gauge=dict(host='127.0.0.1', port=args.gaugePort))
+    actor = simActor.SimActor('rough1', config)
+
+    def ping():
+        cmd = actor.runCommand('ping')
+        cmd.done.addCallback(lambda _: print('ping', flush=True))
+
+    def started():
+        actor.attachCmdSet('TopCmd')
+        startup.attachControllers(actor, config['controllers']['starting'], cmd=EventCmd())
+        ping()
+        reactor.callLater(args.runTime, reactor.stop)
+
+    reactor.callWhenRunning(started)
+    reactor.run()
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='benchmark actor startup')
+    parser.add_argument('--count', type=int, default=10,
+                        help='number of actor launches')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='simulated reply latency, in seconds')
+    parser.add_argument('--runTime', type=float, default=1.0,
+                        help='how long each launched actor runs, in seconds')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--pumpPort', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--gaugePort', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args)
+        return
+
+    def run():
+        d = runBench(args)
+        d.addErrback(lambda f: print(f.getTraceback()))
+        d.addBoth(lambda _: reactor.stop())
+
+    reactor.callWhenRunning(run)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,11 @@ from twisted.internet import reactor
 
 import actorcore.ICC
 
+from roughActor.Controllers import archive
+from roughActor.utils import metrics
+from roughActor.utils import scheduler
+from roughActor.utils import startup
+
 class OurActor(actorcore.ICC.ICC):
     def __init__(self, name,
                  productName=None):
@@ -17,51 +22,68 @@ class OurActor(actorcore.ICC.ICC):
         super().__init__(name, productName=productName)
 
         self.everConnected = False
-        self.monitors = dict()
+        self.archive = None
+        self.scheduler = scheduler.MonitorScheduler(self)
 
     def connectionMade(self):
         if self.everConnected is False:
-            logging.info("Attaching all controllers...")
+            archiveDir = self.actorConfig.get('archive', dict()).get('directory')
+            if archiveDir:
+                logging.info("Archiving telemetry to %s", archiveDir)
+                self.archive = archive.TelemetryArchive(archiveDir, self.name)
+
+            # Attach in the background, so that we answer the hub while slow devices connect.
+            logging.info("Attaching all controllers in the background...")
             self.allControllers = self.actorConfig['controllers']['starting']
-            self.attachAllControllers()
+            startup.attachControllers(self, self.allControllers)
             self.everConnected = True
 
-    def statusLoop(self, controller):
-        try:
-            self.callCommand("%s status" % (controller))
-        except:
-            pass
-        
-        if self.monitors[controller] > 0:
-            reactor.callLater(self.monitors[controller],
-                              self.statusLoop,
-                              controller)
-            
-    def monitor(self, controller, period, cmd=None):
-        if controller not in self.monitors:
-            self.monitors[controller] = 0
+            metricsPort = self.actorConfig.get('metrics', dict()).get('httpPort')
+            if metricsPort:
+                logging.info("Serving metrics on port %d", metricsPort)
+                reactor.callFromThread(metrics.startHttpServer, metricsPort)
 
-        running = self.monitors[controller] > 0
-        self.monitors[controller] = period
+    def monitor(self, controller, period, cmd=None):
+        """ Start, adjust or stop (period=0) the status monitor for one controller. """
 
-        if (not running) and period > 0:
-            cmd.warn('text="starting %gs loop for %s"' % (self.monitors[controller],
-                                                          controller))
-            self.statusLoop(controller)
+        if period > 0:
+            cmd.warn('text="setting %gs loop for %s"' % (period, controller))
         else:
-            cmd.warn('text="adjusted %s loop to %gs"' % (controller, self.monitors[controller]))
-            
+            cmd.warn('text="stopping loop for %s"' % (controller))
+        reactor.callFromThread(self.scheduler.setPeriod, controller, period)
+
+def runActors(names):
+    """ Run several actors in this process and reactor.
+
+    Each actor has its own hub connection, configuration section,
+    controllers, scheduler and archive. They share the reactor, the
+    metrics registry and the trace ring, in which their entries are
+    labelled with the actor name.
+    """
+
+    actors = [OurActor(name, productName='roughActor') for name in names]
+    for actor in actors:
+        actor.run(doReactor=False)
+    reactor.run()
+
 # To work
 def main():
     import argparse
     
     parser = argparse.ArgumentParser()
-    parser.add_argument('--name', type=str, required=True,
-                        help='runnng actor name: rough1 or rough2')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--name', type=str,
+                       help='runnng actor name: rough1 or rough2')
+    group.add_argument('--names', type=str, nargs='+',
+                       help='run several actors in this process, e.g. rough1 rough2')
     parser.add_argument('--logLevel', default=logging.INFO, type=int, nargs='?',
                         help='logging level')
     args = parser.parse_args()
     
+    if args.names:
+        runActors(args.names)
+        return
+
     theActor = OurActor(args.name,
                         productName='roughActor')
     theActor.run()
@@ -0,0 +1,102 @@
+import math
+
+from twisted.internet import reactor
+
+from roughActor.Controllers import pfeiffer
+from . import simDevice
+
+class GaugeSim(simDevice.SimDevice):
+    """ A simulated Pfeiffer MPT200 gauge, speaking the telegram protocol with CRCs.
+
+    The pressure falls exponentially from `startPressure` to
+    `basePressure` with time constant `tau`, starting when the simulator
+    is created. Corrupted replies get a wrong CRC.
+
+    Args
+    ----
+    busIDs : list of int
+      The RS-485 addresses to answer to.
+    startPressure, basePressure : float
+      In hPa, which is what the gauge reports.
+    tau : float
+      Pumpdown time constant, in seconds.
+    """
+
+    def __init__(self, busIDs=(1,), startPressure=1000.0, basePressure=1e-3, tau=300.0,
+                 **kwargs):
+        simDevice.SimDevice.__init__(self, **kwargs)
+
+        self.busIDs = list(busIDs)
+        self.startPressure = startPressure
+        self.basePressure = basePressure
+        self.tau = tau
+        self.t0 = reactor.seconds()
+
+        self.codec = pfeiffer.Pfeiffer()
+
+        # Some of the section 6.5 parameters.
+        self.params = {busID: {303: '000000',    # Error code
+                               312: '010300',    # Software version
+                               340: '000000',    # Correction factor
+                               349: 'MPT200',    # Device name
+                               354: '010000',    # Hardware version
+                               355: '1234567890'}
+                       for busID in self.busIDs}
+
+    def pressure(self, busID):
+        """ The current simulated pressure, in hPa. Each gauge on the bus reads a bit higher. """
+
+        t = reactor.seconds() - self.t0
+        p = self.basePressure + (self.startPressure - self.basePressure) * math.exp(-t / self.tau)
+        return p * (1 + 0.05 * self.busIDs.index(busID))
+
+    def encodePressure(self, hPa):
+        """ Format a pressure the way parsePressure() expects: 4 mantissa and 2 exponent digits. """
+
+        exponent = int(math.floor(math.log10(hPa)))
+        mantissa = int(round(hPa / 10**exponent * 1000))
+        if mantissa >= 10000:
+            mantissa //= 10
+            exponent += 1
+
+        return b'%04d%02d' % (mantissa, exponent + 20)
+
+    def makeReply(self, busID, code, value):
+        body = b'%03d10%03d%02d%s' % (busID, code, len(value), value)
+        return b'%s%03d' % (body, self.codec.gaugeCrc(body))
+
+    def corrupt(self, reply):
+        crc = int(reply[-3:])
+        return reply[:-3] + b'%03d' % ((crc + 1) % 256)
+
+    def reply(self, request):
+        try:
+            busID = int(request[:3])
+            action = request[3:5]
+            code = int(request[5:8])
+            valLen = int(request[8:10])
+            value = request[10:10+valLen]
+            crc = int(request[-3:])
+        except ValueError:
+            return None
+
+        if busID not in self.busIDs:
+            return None
+        if crc != self.codec.gaugeCrc(request[:-3]):
+            return None
+
+        if action == b'00':
+            if code == 740:
+                return self.makeReply(busID, code, self.encodePressure(self.pressure(busID)))
+            reply = self.params[busID].get(code)
+            if reply is None:
+                return self.makeReply(busID, code, b'NO_DEF')
+            return self.makeReply(busID, code, reply.encode('latin-1'))
+
+        if action == b'10':
+            if code not in self.params[busID]:
+                return self.makeReply(busID, code, b'NO_DEF')
+            self.params[busID][code] = value.decode('latin-1')
+            return self.makeReply(busID, code, value)
+
+        return None
@@ -0,0 +1,115 @@
+from twisted.internet import reactor
+
+from . import simDevice
+
+class PumpSim(simDevice.SimDevice):
+    """ A simulated nXDS pump, speaking the ?Vnnn/!Cnnn serial dialect.
+
+    The speed ramps linearly towards the full or standby speed when the pump
+    is started, and back to zero when it is stopped.
+
+    Args
+    ----
+    fullSpeed : int
+      Full speed, in Hz.
+    rampRate : float
+      Acceleration and deceleration, in Hz/s.
+    """
+
+    def __init__(self, fullSpeed=30, rampRate=5.0, **kwargs):
+        simDevice.SimDevice.__init__(self, **kwargs)
+
+        self.fullSpeed = fullSpeed
+        self.rampRate = rampRate
+
+        self.running = False
+        self.standby = False
+        self.standbyPercent = 70
+        self.hz = 0.0
+        self.lastUpdate = reactor.seconds()
+
+        self.temps = [27, 31]
+        self.warningWord = 0
+        self.errorWord = 0
+        self.lifetimes = {810: (12345, 0),
+                          811: (23456, 0),
+                          813: (3456, 26544),
+                          814: (0, 40000),
+                          815: (0, 15000)}
+
+    def targetSpeed(self):
+        if not self.running:
+            return 0.0
+        if self.standby:
+            return self.fullSpeed * self.standbyPercent / 100.0
+        return float(self.fullSpeed)
+
+    def updateSpeed(self):
+        now = reactor.seconds()
+        step = self.rampRate * (now - self.lastUpdate)
+        self.lastUpdate = now
+
+        target = self.targetSpeed()
+        if self.hz < target:
+            self.hz = min(target, self.hz + step)
+        else:
+            self.hz = max(target, self.hz - step)
+
+    def statusWords(self):
+        target = self.targetSpeed()
+
+        status = 1 << 10                     # Serial enable
+        if self.hz > target:
+            status |= 1 << 0                 # Decelerating
+        if self.running:
+            status |= 1 << 1                 # Running/Accelerating
+            if self.standby:
+                status |= 1 << 2             # Standby speed
+            if self.hz >= target:
+                status |= 1 << 3             # Normal speed
+        if self.warningWord:
+            status |= 1 << 22
+        if self.errorWord:
+            status |= 1 << 23
+
+        return status, self.warningWord, self.errorWord
+
+    def reply(self, request):
+        request = request.decode('latin-1').strip()
+        code = request[1:5]
+        args = request[5:].split()
+
+        self.updateSpeed()
+        if request.startswith('?'):
+            if code == 'S801':
+                vals = ['nXDS15iC', 'D3970100', 'D3970200', '%d' % (self.fullSpeed * 60)]
+            elif code == 'V802':
+                status, warnings, errors = self.statusWords()
+                vals = ['%d' % (int(self.hz)),
+                        '%04X' % (status & 0xffff), '%04X' % (status >> 16),
+                        '%04X' % (warnings), '%04X' % (errors)]
+            elif code == 'V808':
+                vals = ['%d' % (t) for t in self.temps]
+            elif code[0] == 'V' and int(code[1:]) in self.lifetimes:
+                vals = ['%d' % (t) for t in self.lifetimes[int(code[1:])]]
+            else:
+                return b'*%s 4' % (code.encode('latin-1'))
+            return b'=%s %s' % (code.encode('latin-1'), ';'.join(vals).encode('latin-1'))
+
+        if request.startswith('!'):
+            try:
+                arg = int(args[0])
+            except (IndexError, ValueError):
+                return b'*%s 3' % (code.encode('latin-1'))
+
+            if code == 'C802':
+                self.running = arg == 1
+            elif code == 'C803':
+                self.standby = arg == 1
+            elif code == 'S805':
+                self.standbyPercent = arg
+            else:
+                return b'*%s 4' % (code.encode('latin-1'))
+            return b'*%s 0' % (code.encode('latin-1'))
+
+        return None
@@ -0,0 +1,93 @@
+import logging
+
+from twisted.internet import reactor
+
+from . import gaugeSim
+from . import pumpSim
+from . import simActor
+
+def startSims(pumpPort=0, gaugePort=0, **simArgs):
+    """ Start a pump and a gauge simulator on localhost.
+
+    Args
+    ----
+    pumpPort, gaugePort : int
+      The ports to listen on. 0 for any free port.
+    simArgs : dict
+      latency, jitter, dropRate, corruptRate, splitRate and seed, passed to both.
+
+    Returns
+    -------
+    pump, gauge : PumpSim, GaugeSim
+    """
+
+    pump = pumpSim.PumpSim(**simArgs)
+    pump.port = pump.listen(pumpPort)
+    gauge = gaugeSim.GaugeSim(**simArgs)
+    gauge.port = gauge.listen(gaugePort)
+
+    return pump, gauge
+
+def simActorConfig(pump, gauge, controllerConfig=None):
+    """ Return an actorConfig which points the controllers at running simulators.
+
+    Args
+    ----
+    controllerConfig : dict of dicts
+      Extra configuration, by controller name.
+    """
+
+    config = dict(controllers=dict(starting=['pump', 'gauge'],
+                                   all=['pump', 'gauge']),
+                  pump=dict(host='127.0.0.1', port=pump.port),
+                  gauge=dict(host='127.0.0.1', port=gauge.port))
+    for name, section in (controllerConfig or dict()).items():
+        config[name].update(section)
+
+    return config
+
+def startSimActor(name='rough1', cmdSets=('TopCmd', 'RoughCmd'), controllerConfig=None,
+                  **simArgs):
+    """ Start the simulators, and a SimActor with all controllers and command sets attached. """
+
+    pump, gauge = startSims(**simArgs)
+    config = simActorConfig(pump, gauge, controllerConfig)
+
+    actor = simActor.SimActor(name, config)
+    for c in config['controllers']['starting']:
+        actor.attachController(c)
+    for c in cmdSets:
+        actor.attachCmdSet(c)
+
+    return actor, pump, gauge
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='run pump and gauge simulators')
+    parser.add_argument('--pumpPort', type=int, default=4001)
+    parser.add_argument('--gaugePort', type=int, default=4002)
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='reply latency, in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='maximum extra random latency, in seconds')
+    parser.add_argument('--dropRate', type=float, default=0.0,
+                        help='fraction of replies to drop')
+    parser.add_argument('--splitRate', type=float, default=0.0,
+                        help='fraction of replies to write in two pieces')
+    parser.add_argument('--corruptRate', type=float, default=0.0,
+                        help='fraction of replies to corrupt')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    pump, gauge = startSims(args.pumpPort, args.gaugePort,
+                            latency=args.latency, jitter=args.jitter,
+                            dropRate=args.dropRate, corruptRate=args.corruptRate,
+                            splitRate=args.splitRate,
+                            seed=args.seed)
+    logging.info('pump simulator on port %d, gauge simulator on port %d', pump.port, gauge.port)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
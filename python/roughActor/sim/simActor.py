@@ -0,0 +1,155 @@
+import importlib
+import logging
+
+from twisted.internet import defer
+
+from roughActor.utils import scheduler
+
+class SimKey(object):
+    def __init__(self, name, values):
+        self.name = name
+        self.values = values
+
+class SimParsedCmd(object):
+    """ Just enough of a parsed opscore command for our handlers: the name and keywords. """
+
+    def __init__(self, cmdStr):
+        words = cmdStr.split()
+        self.name = words[0]
+        self.keywords = dict()
+        for word in words[1:]:
+            key, _, values = word.partition('=')
+            self.keywords[key] = SimKey(key, [self.parseValue(v) for v in values.split(',') if v])
+
+    @staticmethod
+    def parseValue(value):
+        for cvt in int, float:
+            try:
+                return cvt(value)
+            except ValueError:
+                pass
+        return value
+
+class SimCmd(object):
+    """ A stand-in for an actorcore Command, which records the replies.
+
+    `done` is a Deferred which fires with the command when it is finished
+    or failed.
+    """
+
+    def __init__(self, cmdStr='', record=True):
+        self.cmdStr = cmdStr
+        self.cmd = SimParsedCmd(cmdStr) if cmdStr else None
+        self.record = record
+        self.replies = []
+        self.alive = True
+        self.failed = False
+        self.done = defer.Deferred()
+
+    def _reply(self, flag, response):
+        if self.record:
+            self.replies.append((flag, response))
+
+    def diag(self, response=''):
+        self._reply('d', response)
+
+    def inform(self, response=''):
+        self._reply('i', response)
+
+    def warn(self, response=''):
+        self._reply('w', response)
+
+    def respond(self, response=''):
+        self._reply('i', response)
+
+    def finish(self, response=''):
+        self._reply(':', response)
+        self._done()
+
+    def fail(self, response=''):
+        self._reply('f', response)
+        self.failed = True
+        self._done()
+
+    def _done(self):
+        if not self.alive:
+            raise RuntimeError('command %r already finished' % (self.cmdStr))
+        self.alive = False
+        self.done.callback(self)
+
+class SimActor(object):
+    """ A hub-less stand-in for OurActor, for driving controllers and command handlers.
+
+    Args
+    ----
+    name : str
+      The actor name.
+    actorConfig : dict
+      The per-controller configuration sections, like the real actorConfig.
+    """
+
+    def __init__(self, name, actorConfig):
+        self.name = name
+        self.actorConfig = actorConfig
+        self.logger = logging.getLogger(name)
+        self.bcast = SimCmd(record=False)
+
+        self.controllers = dict()
+        self.commandSets = dict()
+        self.handlers = dict()
+        self.scheduler = scheduler.MonitorScheduler(self)
+        self.archive = None
+
+    def attachController(self, name):
+        module = importlib.import_module('roughActor.Controllers.%s' % (name))
+        controller = getattr(module, name)(self, name)
+        controller.start()
+        self.controllers[name] = controller
+
+        return controller
+
+    def attachCmdSet(self, name):
+        module = importlib.import_module('roughActor.Commands.%s' % (name))
+        cmdSet = getattr(module, name)(self)
+        self.commandSets[name] = cmdSet
+
+        for verb, args, func in cmdSet.vocab:
+            self.handlers.setdefault(verb, []).append((args, func))
+
+    def findHandler(self, cmdStr):
+        """ Return the handler which would be called for a command string.
+
+        This picks the vocabulary entry whose literal words and <keys> all
+        appear in the command, preferring the most specific one. That is
+        enough for our vocabulary, but is not the opscore parser.
+        """
+
+        words = cmdStr.split()
+        names = [w.split('=')[0] for w in words[1:]]
+
+        best, bestScore = None, -1
+        for args, func in self.handlers.get(words[0], []):
+            required = [a.strip('<>') for a in args.split() if not a.startswith(('[', '@'))]
+            if all(r in names for r in required) and len(required) > bestScore:
+                best, bestScore = func, len(required)
+
+        if best is None:
+            raise KeyError('no handler for %r' % (cmdStr))
+        return best
+
+    def runCommand(self, cmdStr, record=True):
+        """ Dispatch a command string and return its SimCmd. Wait on cmd.done for the end. """
+
+        cmd = SimCmd(cmdStr, record=record)
+        self.findHandler(cmdStr)(cmd)
+
+        return cmd
+
+    def callCommand(self, cmdStr):
+        return self.runCommand(cmdStr, record=False)
+
+    def monitor(self, controller, period, cmd=None):
+        self.scheduler.setPeriod(controller, period)
+
+    def sendVersionKey(self, cmd):
+        cmd.inform('version="sim"')
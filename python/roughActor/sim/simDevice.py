@@ -0,0 +1,122 @@
+import collections
+import logging
+import random
+
+from twisted.internet import protocol, reactor
+
+from roughActor.Controllers import framer
+
+class SimProtocol(protocol.Protocol):
+    """ One client connection to a simulated device.
+
+    Requests are split on the device EOL and handed to the factory's
+    reply() method. Each reply is delayed, dropped or corrupted according to
+    the factory settings.
+    """
+
+    def connectionMade(self):
+        self.framer = framer.LineFramer(self.factory.EOL, keepEOL=False)
+
+        # Send each reply as soon as it is ready, like a terminal server.
+        self.transport.setTcpNoDelay(True)
+
+    def dataReceived(self, data):
+        EOL = self.factory.EOL
+
+        for request in self.framer.feed(data):
+            if request is None:
+                self.factory.logger.warning('dropping overlong request')
+                continue
+            self.factory.requests += 1
+
+            reply = self.factory.reply(request)
+            if reply is None:
+                continue
+            if self.factory.rng.random() < self.factory.dropRate:
+                self.factory.dropped += 1
+                continue
+            if self.factory.rng.random() < self.factory.corruptRate:
+                self.factory.corrupted += 1
+                reply = self.factory.corrupt(reply)
+
+            self.factory.answered[request, reply] += 1
+            self.factory.replyLater(self, reply + EOL)
+
+class SimDevice(protocol.Factory):
+    """ A simulated serial device behind a terminal server port.
+
+    Replies are sent in request order. Each one is sent `latency` (plus up to
+    `jitter`) seconds after the previous one, like a device which handles one
+    request at a time.
+
+    Args
+    ----
+    latency : float
+      Reply delay, in seconds.
+    jitter : float
+      Maximum random extra delay, in seconds.
+    dropRate : float
+      Fraction of replies which are never sent.
+    corruptRate : float
+      Fraction of replies which are corrupted.
+    splitRate : float
+      Fraction of replies which are written in two pieces, a few ms apart,
+      like a terminal server flushing in the middle of a telegram.
+    seed : int
+      Seed for the random choices, so runs can be repeated.
+    """
+
+    protocol = SimProtocol
+    EOL = b'\r'
+
+    def __init__(self, latency=0.0, jitter=0.0, dropRate=0.0, corruptRate=0.0,
+                 splitRate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.dropRate = dropRate
+        self.corruptRate = corruptRate
+        self.splitRate = splitRate
+        self.rng = random.Random(seed)
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.busyUntil = 0.0
+        self.requests = 0
+        self.dropped = 0
+        self.corrupted = 0
+        self.split = 0
+
+        # How many times each (request, reply as sent) pair was answered, without EOLs.
+        self.answered = collections.Counter()
+
+    def reply(self, request):
+        """ Return the reply bytes (without EOL) for one request, or None. """
+
+        raise NotImplementedError()
+
+    def corrupt(self, reply):
+        """ Return a damaged copy of a reply. """
+
+        i = self.rng.randrange(len(reply))
+        return reply[:i] + bytes([reply[i] ^ 0x01]) + reply[i+1:]
+
+    def replyLater(self, proto, reply):
+        delay = self.latency + self.rng.uniform(0.0, self.jitter)
+        now = reactor.seconds()
+        self.busyUntil = max(now, self.busyUntil) + delay
+
+        if self.rng.random() < self.splitRate:
+            self.split += 1
+            cut = self.rng.randrange(1, len(reply))
+            reactor.callLater(self.busyUntil - now, proto.transport.write, reply[:cut])
+            self.busyUntil += 0.005
+            reactor.callLater(self.busyUntil - now, proto.transport.write, reply[cut:])
+        elif self.busyUntil <= now:
+            proto.transport.write(reply)
+        else:
+            reactor.callLater(self.busyUntil - now, proto.transport.write, reply)
+
+    def listen(self, port=0, interface='127.0.0.1'):
+        """ Start listening. Returns the actual port number. """
+
+        self.listener = reactor.listenTCP(port, self, interface=interface)
+        return self.listener.getHost().port
@@ -0,0 +1,114 @@
+import functools
+import inspect
+import logging
+
+from twisted.internet import defer, reactor, task
+from twisted.python import failure
+
+from opscore.utility.qstr import qstr
+
+from roughActor.utils import metrics
+
+def failCommand(failure, cmd):
+    """ Fail a command with the message from an unhandled failure. """
+
+    logging.getLogger('roughActor').info('command failed: %s', failure.getTraceback())
+    cmd.fail('text=%s' % (qstr('command failed: %s' % (failure.getErrorMessage()))))
+
+def recordLatency(ret, actor, command, t0):
+    """ Record a command handler's run time since t0. Must be called in the reactor thread. """
+
+    metrics.registry.observe('command_latency_seconds', reactor.seconds() - t0,
+                             actor=actor, command=command)
+    return ret
+
+def recordFailure(failure, actor, command):
+    """ Count a command handler failure. Must be called in the reactor thread. """
+
+    metrics.registry.incr('command_failures_total', actor=actor, command=command)
+    return failure
+
+def timedCommand(func):
+    """ Decorate a plain command handler, which finishes its command before returning.
+
+    The handler runs where the dispatcher calls it, so it must not touch
+    state the reactor owns: use deferredCommand for those. Its run time and
+    failures are recorded in the metrics registry like those of
+    deferredCommand handlers, from the reactor thread.
+    """
+
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(self, cmd):
+        t0 = reactor.seconds()
+        try:
+            ret = func(self, cmd)
+        except Exception:
+            reactor.callFromThread(recordFailure, None, self.actor.name, name)
+            raise
+        reactor.callFromThread(recordLatency, None, self.actor.name, name, t0)
+        return ret
+
+    return wrapper
+
+def deferredCommand(func):
+    """ Decorate a command handler which yields Deferreds.
+
+    The handler is run as an inlineCallbacks generator in the reactor
+    thread. It returns to the command dispatcher immediately and must
+    finish the command from its callbacks. If it raises, the command is
+    failed. A handler which does not yield is simply run in the reactor
+    thread, like those which touch the registries, rings and controller
+    state the reactor owns. The handler's run time and failures are
+    recorded in the metrics registry, labelled with the actor name.
+    """
+
+    name = func.__qualname__
+    if inspect.isgeneratorfunction(func):
+        call = defer.inlineCallbacks(func)
+    else:
+        call = functools.partial(defer.maybeDeferred, func)
+
+    @functools.wraps(func)
+    def wrapper(self, cmd):
+        def run():
+            t0 = reactor.seconds()
+            d = call(self, cmd)
+            d.addCallbacks(recordLatency, recordFailure,
+                           callbackArgs=(self.actor.name, name, t0),
+                           errbackArgs=(self.actor.name, name))
+            d.addErrback(failCommand, cmd)
+
+        reactor.callFromThread(run)
+
+    return wrapper
+
+def sleep(seconds):
+    """ Return a Deferred which fires after some seconds, without blocking the reactor. """
+
+    return task.deferLater(reactor, seconds, lambda: None)
+
+def deadline(d, seconds):
+    """ Return a Deferred which fires like d, or fails with TimeoutError after some seconds.
+
+    Unlike d.addTimeout(), d itself is not cancelled, so device exchanges
+    still in flight are left to finish or time out on their own.
+    """
+
+    result = defer.Deferred()
+
+    def timedOut():
+        result.errback(defer.TimeoutError('no result within %gs' % (seconds)))
+
+    timer = reactor.callLater(seconds, timedOut)
+
+    def done(ret):
+        if timer.active():
+            timer.cancel()
+            result.callback(ret)
+        elif isinstance(ret, failure.Failure):
+            ret.trap(Exception)
+
+    d.addBoth(done)
+    return result
@@ -0,0 +1,203 @@
+""" Latency histograms and counters for the device transports and command handlers.
+
+The module-level `registry` collects everything. The `metrics` command
+reports it as keywords, and an optional local HTTP endpoint serves it in
+the Prometheus text format.
+"""
+
+import math
+
+import numpy as np
+
+class LatencyHistogram(object):
+    """ An HDR-style histogram of durations, with 2 significant digits over 1us..1000s.
+
+    Each decade is split into 90 buckets, [1.0, 1.1), [1.1, 1.2), ...
+    [9.9, 10), so any recorded value is known to within 10%, and recording
+    costs the same however many values have been recorded.
+    """
+
+    minExp = -6
+    maxExp = 3
+    perDecade = 90
+
+    def __init__(self):
+        nBuckets = (self.maxExp - self.minExp) * self.perDecade
+        self.counts = np.zeros(nBuckets + 2, dtype='i8')    # + underflow and overflow
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    @classmethod
+    def upperEdges(cls):
+        """ The upper edge of each bucket, including the underflow and overflow buckets. """
+
+        edges = [10.0 ** cls.minExp]
+        for e in range(cls.minExp, cls.maxExp):
+            edges.extend(m * 10.0 ** (e - 1) for m in range(11, 101))
+        edges.append(math.inf)
+        return np.array(edges)
+
+    def bucket(self, value):
+        if value < 10.0 ** self.minExp:
+            return 0
+        exp = math.floor(math.log10(value))
+        if exp >= self.maxExp:
+            return len(self.counts) - 1
+        mantissa = int(value / 10.0 ** (exp - 1))
+        return 1 + (exp - self.minExp) * self.perDecade + min(max(mantissa, 10), 99) - 10
+
+    def record(self, value):
+        self.counts[self.bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        """ The upper bucket edge under which q percent of the values lie. """
+
+        if self.count == 0:
+            return math.nan
+        i = np.searchsorted(np.cumsum(self.counts), math.ceil(self.count * q / 100.0))
+        return min(_edges[i], self.max)
+
+_edges = LatencyHistogram.upperEdges()
+
+class Metrics(object):
+    """ Named histograms and counters, each with optional labels. """
+
+    # The histogram buckets published to Prometheus, in seconds.
+    promBuckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.histograms = dict()
+        self.counters = dict()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name, seconds, **labels):
+        """ Record one duration in the histogram name{labels}. """
+
+        key = self._key(name, labels)
+        try:
+            hist = self.histograms[key]
+        except KeyError:
+            hist = self.histograms[key] = LatencyHistogram()
+        hist.record(seconds)
+
+    def incr(self, name, n=1, **labels):
+        """ Add n to the counter name{labels}. """
+
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    @staticmethod
+    def _matches(labels, match):
+        labels = dict(labels)
+        return all(labels.get(k) == v for k, v in match.items())
+
+    def reset(self, **match):
+        """ Clear the metrics, or only those with all the given label values. """
+
+        if not match:
+            self.histograms.clear()
+            self.counters.clear()
+            return
+        for table in self.histograms, self.counters:
+            for key in [key for key in table if self._matches(key[1], match)]:
+                del table[key]
+
+    @staticmethod
+    def _labelString(labels, sep=','):
+        return sep.join('%s=%s' % (k, v) for k, v in labels)
+
+    def genKeys(self, cmd, **match):
+        """ Generate the metrics keywords, optionally only for those with all the given label values.
+
+        latency=name,labels,count,p50,p90,p99,max, with times in ms, for each histogram.
+        counter=name,labels,value, for each counter.
+        """
+
+        for (name, labels), hist in sorted(self.histograms.items()):
+            if not self._matches(labels, match):
+                continue
+            cmd.inform('latency=%s,"%s",%d,%0.2f,%0.2f,%0.2f,%0.2f' %
+                       (name, self._labelString(labels, ' '), hist.count,
+                        1000 * hist.percentile(50), 1000 * hist.percentile(90),
+                        1000 * hist.percentile(99), 1000 * hist.max))
+        for (name, labels), value in sorted(self.counters.items()):
+            if not self._matches(labels, match):
+                continue
+            cmd.inform('counter=%s,"%s",%d' % (name, self._labelString(labels, ' '), value))
+
+    def prometheusText(self, prefix='roughactor_'):
+        """ Return all metrics in the Prometheus text exposition format. """
+
+        def labelStr(labels, extra=()):
+            parts = ['%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                     for k, v in tuple(labels) + tuple(extra)]
+            return '{%s}' % ','.join(parts) if parts else ''
+
+        lines = []
+        typed = set()
+        cumEdges = _edges
+        for (name, labels), hist in sorted(self.histograms.items()):
+            fullName = prefix + name
+            if fullName not in typed:
+                lines.append('# TYPE %s histogram' % (fullName))
+                typed.add(fullName)
+            cumCounts = np.cumsum(hist.counts)
+            for le in self.promBuckets:
+                n = cumCounts[np.searchsorted(cumEdges, le * (1 + 1e-9)) - 1]
+                lines.append('%s_bucket%s %d' % (fullName, labelStr(labels, [('le', '%g' % le)]), n))
+            lines.append('%s_bucket%s %d' % (fullName, labelStr(labels, [('le', '+Inf')]), hist.count))
+            lines.append('%s_sum%s %r' % (fullName, labelStr(labels), hist.total))
+            lines.append('%s_count%s %d' % (fullName, labelStr(labels), hist.count))
+
+        for (name, labels), value in sorted(self.counters.items()):
+            fullName = prefix + name
+            if fullName not in typed:
+                lines.append('# TYPE %s counter' % (fullName))
+                typed.add(fullName)
+            lines.append('%s%s %d' % (fullName, labelStr(labels), value))
+
+        return '\n'.join(lines) + '\n'
+
+registry = Metrics()
+
+# The listening ports, by (interface, port), so that the actors in one process can share one.
+_servers = dict()
+
+def startHttpServer(port, interface='127.0.0.1', metrics=None):
+    """ Serve metrics at http://interface:port/metrics, in the Prometheus text format.
+
+    Returns the listening port. Asking again for the same port returns the
+    existing one.
+    """
+
+    if (interface, port) in _servers:
+        return _servers[interface, port]
+
+    from twisted.internet import reactor
+    from twisted.web import resource, server
+
+    if metrics is None:
+        metrics = registry
+
+    class MetricsResource(resource.Resource):
+        isLeaf = True
+
+        def render_GET(self, request):
+            request.setHeader(b'Content-Type', b'text/plain; version=0.0.4')
+            return metrics.prometheusText().encode('utf-8')
+
+    root = resource.Resource()
+    root.putChild(b'metrics', MetricsResource())
+    listener = reactor.listenTCP(port, server.Site(root), interface=interface)
+    _servers[interface, port] = listener
+    return listener
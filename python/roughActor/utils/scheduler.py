@@ -0,0 +1,184 @@
+import logging
+
+import numpy as np
+
+from twisted.internet import reactor
+
+class Monitor(object):
+    """ The polling state of one controller. """
+
+    def __init__(self, name, period):
+        self.name = name
+        self.basePeriod = period
+        self.period = period
+        self.deadline = None
+        self.inFlight = False
+        self.polls = 0
+        self.missed = 0
+
+class MonitorScheduler(object):
+    """ Poll the controllers' status from one timer, on fixed-rate deadlines.
+
+    Each monitored controller is polled at deadline, deadline+period,
+    deadline+2*period, ..., so the period does not drift by the time the
+    polls take. New monitors are started `stagger` seconds apart, to keep
+    polls from bunching up on the terminal server. When a poll is still
+    running at its next deadline, or the reactor was too busy to make the
+    deadline, the deadline is skipped and reported with a monitorMissed
+    keyword.
+
+    A controller can poll faster while one of its history fields is
+    changing quickly, with a `monitor` section in its actorConfig:
+
+        monitor:
+          field: pressure     # the history field to watch
+          window: 30          # seconds of history to fit the rate over
+          threshold: 0.01     # the rate above which to poll fast, per second
+          fractional: true    # if true, the rate is relative to the mean
+          fastPeriod: 1       # the period to poll at while the rate is high
+
+    Args
+    ----
+    actor : the actor
+      Provides controllers, actorConfig and bcast.
+    stagger : float
+      The minimum spacing between the first polls of two controllers, in seconds.
+    """
+
+    def __init__(self, actor, stagger=0.25):
+        self.actor = actor
+        self.stagger = stagger
+        self.logger = logging.getLogger('monitors')
+
+        self.monitors = dict()
+        self.timer = None
+
+    def setPeriod(self, controller, period):
+        """ Start, adjust, or with period=0 stop, the monitor for one controller. """
+
+        if period <= 0:
+            self.monitors.pop(controller, None)
+            self._reschedule()
+            return
+
+        mon = self.monitors.get(controller)
+        if mon is None:
+            now = reactor.seconds()
+            starts = [m.deadline for m in self.monitors.values() if m.deadline is not None]
+            first = now
+            while any(abs(first - s) < self.stagger for s in starts):
+                first += self.stagger
+            mon = Monitor(controller, period)
+            mon.deadline = first
+            self.monitors[controller] = mon
+        else:
+            # Keep the phase: the next poll is one new period after the last one.
+            mon.deadline += period - mon.period
+            mon.basePeriod = period
+            mon.period = period
+
+        self._reschedule()
+
+    def _reschedule(self):
+        """ (Re)arm the single timer for the earliest deadline. """
+
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+
+        if not self.monitors:
+            return
+        deadline = min(m.deadline for m in self.monitors.values())
+        self.timer = reactor.callLater(max(0, deadline - reactor.seconds()), self._fire)
+
+    def _fire(self):
+        self.timer = None
+        now = reactor.seconds()
+
+        for mon in list(self.monitors.values()):
+            if mon.deadline > now:
+                continue
+
+            if mon.inFlight:
+                self._missed(mon, now, 'previous poll still running')
+            else:
+                self._poll(mon)
+
+            self._advance(mon, now)
+
+        self._reschedule()
+
+    def _advance(self, mon, now):
+        """ Move to the next deadline on the fixed-rate grid, skipping any already past. """
+
+        mon.deadline += mon.period
+        if mon.deadline <= now:
+            skipped = int((now - mon.deadline) // mon.period) + 1
+            mon.deadline += skipped * mon.period
+            self._missed(mon, now, 'reactor busy', count=skipped)
+
+    def _missed(self, mon, now, reason, count=1):
+        mon.missed += count
+        self.logger.warning('%s monitor missed %d deadline(s): %s', mon.name, count, reason)
+        self.actor.bcast.warn('monitorMissed=%s,%d,%d' % (mon.name, count, mon.missed))
+
+    def _poll(self, mon):
+        controller = self.actor.controllers.get(mon.name)
+        if controller is None:
+            self.logger.warning('no %s controller to monitor', mon.name)
+            return
+
+        mon.inFlight = True
+        mon.polls += 1
+        # Only the fields older than their cache max age are read, so the
+        # slow-changing ones (e.g. the pump lifetimes) are not re-read on every tick.
+        d = controller.status(cmd=self.actor.bcast, changedOnly=True)
+        d.addErrback(self._pollFailed, mon)
+        d.addBoth(self._pollDone, mon)
+
+    def _pollFailed(self, failure, mon):
+        self.logger.warning('%s monitor poll failed: %s', mon.name, failure.getErrorMessage())
+
+    def _pollDone(self, _, mon):
+        mon.inFlight = False
+        if self.monitors.get(mon.name) is not mon:
+            return
+
+        period = self.adaptedPeriod(mon)
+        if period != mon.period:
+            self.logger.info('%s monitor period %g -> %g', mon.name, mon.period, period)
+            mon.deadline += period - mon.period
+            mon.period = period
+            self._reschedule()
+
+    def adaptedPeriod(self, mon):
+        """ Return the period to use, given how fast the configured field is changing. """
+
+        config = self.actor.actorConfig[mon.name].get('monitor')
+        if not config:
+            return mon.basePeriod
+        fastPeriod = config.get('fastPeriod', mon.basePeriod)
+        if fastPeriod >= mon.basePeriod:
+            return mon.basePeriod
+
+        ring = getattr(self.actor.controllers[mon.name], 'history', None)
+        if ring is None:
+            return mon.basePeriod
+        n, vmin, vmax, vmean, vlast, slope = ring.stats(config['field'], config.get('window', 30.0))
+        if not np.isfinite(slope):
+            return mon.basePeriod
+
+        rate = abs(slope)
+        if config.get('fractional', True):
+            if vmean == 0:
+                return mon.basePeriod
+            rate /= abs(vmean)
+
+        return fastPeriod if rate > config.get('threshold', 0.0) else mon.basePeriod
+
+    def genKeys(self, cmd):
+        """ Generate one monitor=name,period,basePeriod,polls,missed keyword per monitor. """
+
+        for mon in self.monitors.values():
+            cmd.inform('monitor=%s,%g,%g,%d,%d' % (mon.name, mon.period, mon.basePeriod,
+                                                   mon.polls, mon.missed))
@@ -0,0 +1,60 @@
+import logging
+import time
+
+from twisted.internet import reactor
+
+from opscore.utility.qstr import qstr
+
+def attachControllers(actor, names, cmd=None):
+    """ Attach controllers in the background, one per reactor turn.
+
+    The actor keeps serving the hub while this runs. For each controller
+    a controllerAttached=name,seconds keyword is generated once it is
+    instantiated, then controllerConnected=name,seconds once its device
+    connection is open. Connecting does not hold up the next controller,
+    and a device which is down only produces a warning.
+
+    Args
+    ----
+    actor : the actor
+      Provides attachController() and bcast.
+    names : list of str
+      The controllers to attach, in order.
+    cmd : Command
+      Where to send the keywords. Default is the actor's bcast.
+    """
+
+    if cmd is None:
+        cmd = actor.bcast
+    logger = logging.getLogger('startup')
+    names = list(names)
+
+    def attachNext():
+        if not names:
+            return
+        name = names.pop(0)
+
+        t0 = time.time()
+        try:
+            actor.attachController(name)
+            controller = actor.controllers[name]
+        except Exception as e:
+            logger.warning('failed to attach %s: %s', name, e)
+            cmd.warn('text=%s' % (qstr('failed to attach %s: %s' % (name, e))))
+        else:
+            cmd.inform('controllerAttached=%s,%0.3f' % (name, time.time() - t0))
+            connection = getattr(controller, 'connection', None)
+            if connection is not None:
+                d = connection.connect()
+                d.addCallbacks(connected, notConnected, callbackArgs=(name, t0), errbackArgs=(name,))
+
+        reactor.callLater(0, attachNext)
+
+    def connected(_, name, t0):
+        cmd.inform('controllerConnected=%s,%0.3f' % (name, time.time() - t0))
+
+    def notConnected(failure, name):
+        logger.warning('failed to connect %s: %s', name, failure.getErrorMessage())
+        cmd.warn('text=%s' % (qstr('failed to connect %s: %s' % (name, failure.getErrorMessage()))))
+
+    reactor.callLater(0, attachNext)
@@ -0,0 +1,108 @@
+""" A preallocated, in-memory ring of the recent device exchanges.
+
+Recording an exchange is a single row store into a numpy structured
+array: nothing is formatted until the `trace dump` command asks for the
+rows. The per-telegram diag keywords are only generated while `trace diag
+on` is in effect for the actor.
+
+The module-level `ring` collects the exchanges of all the connections of
+all the actors in the process.
+"""
+
+import time
+
+import numpy as np
+
+OK = 0
+TIMEOUT = 1
+ERROR = 2
+statusNames = ('OK', 'timeout', 'error')
+
+# The longest actor and device names which are kept whole.
+NAMELEN = 32
+
+entryDtype = np.dtype([('time', '<f8'),
+                       ('duration', '<f4'),
+                       ('status', 'u1'),
+                       ('actor', 'S%d' % NAMELEN),
+                       ('device', 'S%d' % NAMELEN),
+                       ('requestLength', '<u2'),
+                       ('replyLength', '<u2'),
+                       ('request', 'S64'),
+                       ('reply', 'S192')])
+
+class TraceRing(object):
+    """ The last `size` device exchanges.
+
+    Requests and replies longer than their columns are truncated, but
+    their full lengths are kept. Actor and device names must fit in
+    NAMELEN bytes to be told apart.
+
+    Args
+    ----
+    size : int
+      The number of exchanges to keep.
+    """
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.entries = np.zeros(size, dtype=entryDtype)
+        self.count = 0
+        self.next = 0
+
+        # The actors whose connections should also generate diag keywords for each exchange.
+        self.diagActors = set()
+
+    def record(self, actor, device, request, reply, duration, status=OK):
+        """ Add one exchange.
+
+        Args
+        ----
+        actor, device : bytes
+          The actor and connection names.
+        request, reply : bytes
+          The raw telegram(s) sent and received.
+        duration : float
+          Seconds from sending to the last reply.
+        status : int
+          OK, TIMEOUT or ERROR.
+        """
+
+        i = self.next
+        self.entries[i] = (time.time(), duration, status, actor, device,
+                           len(request), len(reply), request, reply)
+        self.next = (i + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def last(self, n=None, actor=None):
+        """ Return the last n exchanges, optionally of one actor, oldest first, as a copy. """
+
+        idx = (self.next - self.count + np.arange(self.count)) % self.size
+        entries = self.entries[idx]
+        if actor is not None:
+            key = actor.encode('latin-1')
+            if len(key) > NAMELEN:
+                raise ValueError('actor name %r is longer than %d bytes' % (actor, NAMELEN))
+            entries = entries[entries['actor'] == key]
+        if n is not None:
+            entries = entries[max(len(entries) - n, 0):]
+        return entries
+
+    def clear(self):
+        self.count = 0
+        self.next = 0
+
+    def genKeys(self, cmd, n=None, actor=None):
+        """ Generate one trace keyword per exchange, oldest first. Returns the number generated. """
+
+        entries = self.last(n, actor=actor)
+        for e in entries:
+            cmd.inform('trace=%0.6f,%s,%0.4f,%s,%r,%r,%d,%d'
+                       % (e['time'], e['device'].decode('latin-1'), e['duration'],
+                          statusNames[e['status']],
+                          e['request'].decode('latin-1'), e['reply'].decode('latin-1'),
+                          e['requestLength'], e['replyLength']))
+        return len(entries)
+
+ring = TraceRing()
@@ -0,0 +1,33 @@
+import pytest
+
+from roughActor.Controllers import archive, archiveReader
+
+def test_high_bit_words(tmp_path):
+    arch = archive.TelemetryArchive(str(tmp_path), 'rough1')
+    t = 1700000000.0
+    arch.append(t, 'pump', speed=30, status=0x80000C0A, warnings=0x8000, errors=0xFFFFFFFE)
+    arch.append(t + 1, 'gauge', channel=1, pressure=1e-3)
+    arch.close()
+
+    recs = archiveReader.read(str(tmp_path), 'rough1', t, t + 2)
+    assert len(recs) == 2
+    pump, gauge = recs
+    assert pump['status'] == 0x80000C0A
+    assert pump['errors'] == 0xFFFFFFFE
+    assert gauge['status'] == archive.NOWORD
+
+def test_missing_values(tmp_path):
+    arch = archive.TelemetryArchive(str(tmp_path), 'rough1')
+    t = 1700000000.0
+    arch.append(t, 'pump', speed=30, status=0x0C0A, warnings=0, errors=0)
+    arch.append(t + 1, 'pump', motorTemp=27, controllerTemp=31)
+    with pytest.raises(KeyError):
+        arch.append(t + 2, 'pump', sped=30)
+    arch.close()
+
+    recs = archiveReader.read(str(tmp_path), 'rough1', t, t + 3)
+    assert len(recs) == 2
+    assert list(archiveReader.present(recs, 'speed')) == [True, False]
+    assert list(archiveReader.present(recs, 'status')) == [True, False]
+    assert list(archiveReader.present(recs, 'motorTemp')) == [False, True]
+    assert recs[1]['warnings'] == archive.missing['warnings']
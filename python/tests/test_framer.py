@@ -0,0 +1,34 @@
+from roughActor.Controllers import framer
+
+def test_split_and_joined_replies():
+    f = framer.LineFramer(b'\r')
+    assert f.feed(b'=V80') == []
+    assert f.feed(b'8 27;31') == []
+    assert f.feed(b'\r=V802 0;0400;') == [b'=V808 27;31\r']
+    assert f.feed(b'0000;0000;0000\r*C802 0\r') == [b'=V802 0;0400;0000;0000;0000\r', b'*C802 0\r']
+
+    f = framer.LineFramer(b'\r', keepEOL=False)
+    assert f.feed(b'a\rb\r') == [b'a', b'b']
+
+def test_multi_byte_eol_split_across_reads():
+    f = framer.LineFramer(b'\r\n')
+    assert f.feed(b'abc\r') == []
+    assert f.feed(b'\ndef\r\n') == [b'abc\r\n', b'def\r\n']
+
+def test_overlong_replies():
+    f = framer.LineFramer(b'\r', maxLength=8)
+
+    # Complete but too long: reported, and the next frame is fine.
+    assert f.feed(b'123456789\rok\r') == [None, b'ok\r']
+
+    # Too long without an EOL: reported once, and dropped up to the next EOL.
+    assert f.feed(b'0123456789') == [None]
+    assert f.feed(b'abcdef') == []
+    assert f.feed(b'xyz\rok\r') == [b'ok\r']
+    assert f.overflows == 2
+
+def test_reset_drops_partial_frame():
+    f = framer.LineFramer(b'\r')
+    f.feed(b'partial')
+    f.reset()
+    assert f.feed(b'next\r') == [b'next\r']
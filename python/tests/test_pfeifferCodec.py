@@ -0,0 +1,20 @@
+import warnings
+
+import numpy as np
+
+from roughActor.Controllers import pfeifferCodec
+
+def telegram(body):
+    return b'%s%03d\r' % (body, sum(body) % 256)
+
+def test_invalid_rows_do_not_overflow():
+    resps = [telegram(b'0011074006100023'),
+             telegram(b'001107400699z999'),
+             b'\xff' * 20]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        torr = pfeifferCodec.parsePressures(pfeifferCodec.decodeResponses(resps, busID=1, cmdCode=740))
+
+    assert np.isclose(torr[0], 0.750061683 * 1.0 * 10 ** 3)
+    assert np.isnan(torr[1:]).all()
@@ -0,0 +1,53 @@
+import math
+
+import pytest
+
+from roughActor.Controllers import publisher
+
+@pytest.fixture
+def now(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(publisher.time, 'time', lambda: now[0])
+    return now
+
+def test_deadband(now):
+    pub = publisher.KeyPublisher(heartbeat=60)
+    assert pub.shouldPublish('speed', 100, deadband=2)
+    assert not pub.shouldPublish('speed', 102, deadband=2)
+    assert pub.shouldPublish('speed', 103, deadband=2)
+
+    # Measured from the last published value, so slow drifts are published too.
+    assert not pub.shouldPublish('speed', 104, deadband=2)
+    assert pub.shouldPublish('speed', 105.5, deadband=2)
+
+    assert pub.shouldPublish('pressure', 1e-3, deadband=0.1, fractional=True)
+    assert not pub.shouldPublish('pressure', 1.09e-3, deadband=0.1, fractional=True)
+    assert pub.shouldPublish('pressure', 0.85e-3, deadband=0.1, fractional=True)
+
+    assert pub.shouldPublish('state', 'OK')
+    assert not pub.shouldPublish('state', 'OK')
+    assert pub.shouldPublish('state', 'FAULT')
+    assert pub.shouldPublish('state', 'FAULT', force=True)
+
+def test_nan(now):
+    pub = publisher.KeyPublisher(heartbeat=60)
+    assert pub.shouldPublish('pressure', 1.0, deadband=0.1, fractional=True)
+    assert pub.shouldPublish('pressure', math.nan, deadband=0.1, fractional=True)
+    assert not pub.shouldPublish('pressure', math.nan, deadband=0.1, fractional=True)
+    assert pub.shouldPublish('pressure', 1.0, deadband=0.1, fractional=True)
+
+def test_heartbeat(now):
+    pub = publisher.KeyPublisher(heartbeat=60)
+    assert pub.shouldPublish('speed', 100, deadband=2)
+    now[0] += 59
+    assert not pub.shouldPublish('speed', 100, deadband=2)
+    now[0] += 1
+    assert pub.shouldPublish('speed', 100, deadband=2)
+    now[0] += 30
+    assert not pub.shouldPublish('speed', 100, deadband=2)
+
+    assert pub.heartbeatDue('link')
+    assert not pub.heartbeatDue('link')
+    assert pub.heartbeatDue('link', force=True)
+    now[0] += 60
+    assert pub.heartbeatDue('link')
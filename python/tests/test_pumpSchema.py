@@ -0,0 +1,31 @@
+import pytest
+
+from roughActor.Controllers import pumpSchema
+
+def test_speed():
+    r = pumpSchema.decode('?V802', ['30', '0C0A', '8000', '0000', '0001'])
+    assert r.speed == 30
+    assert r.words == (0x80000C0A, 0, 1)
+
+def test_speed_wrong_field_count():
+    with pytest.raises(ValueError):
+        pumpSchema.decode('?V802', ['30', '0C0A'])
+
+@pytest.mark.parametrize('fields, elapsed, left', [(['12345'], 12345, None),
+                                                   (['12345', '7'], 12345, 7),
+                                                   (['12345', '7', '99'], 12345, 7)])
+def test_lifetime_optional_fields(fields, elapsed, left):
+    r = pumpSchema.decode('?V810', fields)
+    assert (r.elapsed, r.left) == (elapsed, left)
+
+def test_one_field_lifetime_reply():
+    pytest.importorskip('opscore')
+    from roughActor.Controllers import pump
+
+    class Actor(object):
+        name = 'rough1'
+        actorConfig = dict(pump=dict(host='127.0.0.1', port=0))
+
+    p = pump.pump(Actor(), 'pump')
+    r = p.decodeReply('?V810', '=V810 12345\r')
+    assert (r.elapsed, r.left) == (12345, None)
@@ -0,0 +1,46 @@
+import math
+
+import pytest
+
+from roughActor.Controllers import pumpdown
+
+def test_exponential_pumpdown():
+    P0, tau = 750.0, 120.0
+    est = pumpdown.PumpdownEstimator(window=60.0)
+    assert math.isnan(est.rate())
+
+    t0 = 1.7e9
+    for i in range(2000):
+        t = i * 1.0
+        est.add(t0 + t, P0 * math.exp(-t / tau))
+
+        if i >= 2:
+            assert est.rate() == pytest.approx(-1 / tau, rel=1e-6)
+
+    # Several rebases happened, and only the window is in the fit.
+    assert est.t0 > t0
+    assert est.n == 61
+
+    tLast = 1999.0
+    target = 1e-6
+    assert est.eta(target) == pytest.approx(tau * math.log(P0 / target) - tLast, rel=1e-6)
+    assert est.eta(1e3) == 0.0
+
+def test_window_follows_a_change_of_rate():
+    est = pumpdown.PumpdownEstimator(window=30.0)
+    for i in range(100):
+        est.add(float(i), 100.0 * math.exp(-i / 10.0))
+    for i in range(100, 200):
+        est.add(float(i), 100.0 * math.exp(-10.0) * math.exp(-(i - 100) / 50.0))
+    assert est.rate() == pytest.approx(-1 / 50.0, rel=1e-6)
+
+def test_no_eta():
+    est = pumpdown.PumpdownEstimator()
+    for i in range(10):
+        est.add(float(i), 1e-3 * (1 + i))
+    assert est.rate() > 0
+    assert math.isnan(est.eta(1e-6))
+    assert math.isnan(est.eta(None))
+
+    est.add(11.0, 0.0)
+    assert est.n == 10
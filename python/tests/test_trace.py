@@ -0,0 +1,17 @@
+import pytest
+
+from roughActor.utils import trace
+
+def test_long_names():
+    ring = trace.TraceRing(size=8)
+    ring.record(b'roughActor1', b'turboPump', b'?V802\r', b'=V802 0\r', 0.01)
+    ring.record(b'roughActor2', b'turboPump', b'?V808\r', b'=V808 27;31\r', 0.01)
+
+    entries = ring.last(actor='roughActor1')
+    assert len(entries) == 1
+    assert entries[0]['actor'] == b'roughActor1'
+    assert entries[0]['device'] == b'turboPump'
+    assert len(ring.last(actor='roughActor2')) == 1
+
+    with pytest.raises(ValueError):
+        ring.last(actor='r' * (trace.NAMELEN + 1))
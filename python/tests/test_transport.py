@@ -0,0 +1,253 @@
+import pytest
+
+from twisted.internet import defer, error, task
+from twisted.python.failure import Failure
+
+from roughActor.Controllers import breaker, transport
+from roughActor.utils import metrics, trace
+
+class FakeCmd(object):
+    def __init__(self):
+        self.warnings = []
+
+    def warn(self, response=''):
+        self.warnings.append(response)
+
+    def diag(self, response=''):
+        pass
+
+class FakeTransport(object):
+    def __init__(self, device):
+        self.device = device
+
+    def setTcpKeepAlive(self, flag):
+        pass
+
+    def write(self, data):
+        self.device.written.append(data)
+
+    def abortConnection(self):
+        self.device.drop()
+
+    loseConnection = abortConnection
+
+class FakeDevice(object):
+    """ Stands in for the terminal server: records the telegrams, and answers when told. """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.written = []
+        self.connects = 0
+        self.connectFailures = []
+        conn.connect = self.connect
+
+    def connect(self):
+        if self.connectFailures:
+            return defer.fail(self.connectFailures.pop(0))
+        if self.conn.protocol is None:
+            self.connects += 1
+            self.conn.protocol = transport.DeviceProtocol(self.conn)
+            self.conn.protocol.transport = FakeTransport(self)
+        return defer.succeed(self.conn.protocol)
+
+    def drop(self):
+        if self.conn.protocol is not None:
+            self.conn.connectionLost(self.conn.protocol, Failure(error.ConnectionLost('dropped')))
+
+    def answer(self, reply):
+        self.conn.protocol.dataReceived(reply)
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = task.Clock()
+    monkeypatch.setattr(transport, 'reactor', clock)
+    monkeypatch.setattr(breaker, 'reactor', clock)
+    return clock
+
+def makeConnection(**kwargs):
+    args = dict(timeout=0.5, minTimeout=0.2, maxTimeout=2.0, idleTimeout=0,
+                metrics=metrics.Metrics(), trace=trace.TraceRing(size=16))
+    args.update(kwargs)
+    conn = transport.DeviceConnection('dev', '127.0.0.1', 0, **args)
+    return conn, FakeDevice(conn)
+
+def results(d):
+    out = []
+    d.addBoth(out.append)
+    return out
+
+def counter(conn, name):
+    return sum(v for (n, labels), v in conn.metrics.counters.items() if n == name)
+
+def test_rtt_estimator():
+    rtt = transport.RttEstimator(initial=1.0, minTimeout=0.2, maxTimeout=2.0)
+    assert rtt.rto == 1.0
+
+    rtt.sample(0.1)
+    assert rtt.srtt == pytest.approx(0.1)
+    assert rtt.rto == pytest.approx(0.3)
+
+    for i in range(50):
+        rtt.sample(0.01)
+    assert rtt.rto == 0.2
+
+    rtt.backoff()
+    assert rtt.rto == pytest.approx(0.4)
+    for i in range(5):
+        rtt.backoff()
+    assert rtt.rto == 2.0
+
+def test_idempotent_timeout_is_retried(clock):
+    conn, device = makeConnection(retries=2)
+    cmd = FakeCmd()
+    out = results(conn.exchange(b'?V808\r', cmd, idempotent=True))
+
+    clock.advance(0)
+    assert device.written == [b'?V808\r']
+    clock.advance(0.5)
+    clock.advance(1.0)
+    assert device.written == [b'?V808\r', b'?V808\r']
+    assert device.connects == 2
+
+    device.answer(b'=V808 27;31\r')
+    assert out == [b'=V808 27;31\r']
+    assert counter(conn, 'device_retries_total') == 1
+    assert cmd.warnings == []
+
+def test_connect_timeout_is_retried_quietly(clock):
+    conn, device = makeConnection(retries=2)
+    device.connectFailures = [error.TimeoutError('connect')]
+    cmd = FakeCmd()
+    out = results(conn.exchange(b'?V808\r', cmd, idempotent=True))
+
+    clock.advance(0)
+    clock.advance(1.0)
+    device.answer(b'=V808 27;31\r')
+    assert out == [b'=V808 27;31\r']
+    assert cmd.warnings == []
+
+    device.connectFailures = [error.TimeoutError('connect')] * 3
+    out = results(conn.exchange(b'?V810\r', cmd, idempotent=True))
+    device.drop()
+    clock.pump([0, 1.0, 1.0, 1.0])
+    assert out[0].check(error.TimeoutError)
+    assert len(cmd.warnings) == 1
+
+def test_non_idempotent_timeout_is_not_retried(clock):
+    conn, device = makeConnection(retries=2)
+    cmd = FakeCmd()
+    out = results(conn.exchange(b'!C802 1\r', cmd))
+
+    clock.advance(0)
+    clock.advance(0.5)
+    clock.advance(2.0)
+    assert device.written == [b'!C802 1\r']
+    assert out[0].check(error.TimeoutError)
+    assert counter(conn, 'device_retries_total') == 0
+    assert len(cmd.warnings) == 1
+
+def test_dropped_connection_resends_only_idempotent(clock):
+    conn, device = makeConnection()
+    device.connect()
+    conn.protocol.transport.write = lambda data: (device.written.append(data), device.drop())
+
+    out = results(conn.exchange(b'!C802 1\r', FakeCmd()))
+    clock.advance(0)
+    assert device.written == [b'!C802 1\r']
+    assert out[0].check(error.ConnectionLost)
+
+    device.connect()
+    conn.protocol.transport.write = lambda data: (device.written.append(data), device.drop())
+    out = results(conn.exchange(b'?V808\r', FakeCmd(), idempotent=True))
+    clock.advance(0)
+    assert device.written[1:] == [b'?V808\r', b'?V808\r']
+    device.answer(b'=V808 27;31\r')
+    assert out == [b'=V808 27;31\r']
+
+def test_breaker_cycle(clock):
+    conn, device = makeConnection(retries=0, breakerThreshold=2, probeCmd=b'?S801\r')
+    states = []
+    conn.breaker.listener = lambda b: states.append(b.state)
+
+    for i in range(2):
+        out = results(conn.exchange(b'?V808\r', None, idempotent=True))
+        clock.advance(0)
+        clock.advance(2.0)
+        assert out[0].check(error.TimeoutError)
+    assert conn.breaker.isOpen
+    assert states == ['open']
+
+    # Fail fast while open.
+    nWritten = len(device.written)
+    out = results(conn.exchange(b'?V808\r', None, idempotent=True))
+    assert out[0].check(breaker.DeviceOfflineError)
+    assert len(device.written) == nWritten
+    assert counter(conn, 'device_rejected_total') == 1
+
+    # The probe goes out after about probeMin, and closes the breaker when answered.
+    clock.advance(1.2 * conn.breaker.probeMin)
+    assert device.written[-1] == b'?S801\r'
+    device.answer(b'=S801 nXDS15iC\r')
+    assert not conn.breaker.isOpen
+    assert states == ['open', 'closed']
+
+    out = results(conn.exchange(b'?V808\r', None, idempotent=True))
+    clock.advance(0)
+    device.answer(b'=V808 27;31\r')
+    assert out == [b'=V808 27;31\r']
+
+def test_breaker_probe_backoff(clock, monkeypatch):
+    monkeypatch.setattr(breaker.random, 'uniform', lambda a, b: 1.0)
+    probes = []
+    b = breaker.CircuitBreaker('dev', lambda: probes.append(clock.seconds()) or defer.fail(ValueError()),
+                               threshold=1, probeMin=1.0, probeMax=4.0)
+    b.failed()
+    clock.pump([1.0] * 12)
+    assert probes == [1.0, 3.0, 7.0, 11.0]
+    b.succeeded()
+    assert not b.isOpen
+    clock.advance(10)
+    assert len(probes) == 4
+
+def test_control_goes_before_queued_polls(clock):
+    conn, device = makeConnection()
+    first = results(conn.exchange(b'?V802\r', None, idempotent=True))
+    clock.advance(0)
+
+    # Queued while the first exchange is in flight: the poll first, then the control.
+    poll = results(conn.exchange(b'?V808\r', None, idempotent=True))
+    control = results(conn.exchange(b'!C802 1\r', None))
+    clock.advance(0)
+    assert device.written == [b'?V802\r']
+
+    device.answer(b'=V802 0;0400;0000;0000;0000\r')
+    clock.advance(0)
+    assert device.written[1] == b'!C802 1\r'
+    device.answer(b'*C802 0\r')
+    clock.advance(0)
+    assert device.written[2] == b'?V808\r'
+    device.answer(b'=V808 27;31\r')
+
+    assert first and control == [b'*C802 0\r'] and poll == [b'=V808 27;31\r']
+
+def test_identical_queries_share_one_exchange(clock):
+    conn, device = makeConnection()
+    a = results(conn.exchange(b'?V808\r', None, idempotent=True))
+    b = results(conn.exchange(b'?V808\r', None, idempotent=True))
+    clock.advance(0)
+    clock.advance(0)
+    assert device.written == [b'?V808\r']
+
+    device.answer(b'=V808 27;31\r')
+    assert a == b == [b'=V808 27;31\r']
+    assert counter(conn, 'device_coalesced_total') == 1
+
+    # Non-idempotent telegrams are never shared.
+    c = results(conn.exchange(b'!C802 1\r', None))
+    d = results(conn.exchange(b'!C802 1\r', None))
+    clock.advance(0)
+    device.answer(b'*C802 0\r')
+    clock.advance(0)
+    device.answer(b'*C802 0\r')
+    assert device.written[1:] == [b'!C802 1\r', b'!C802 1\r']
+    assert c == d == [b'*C802 0\r']